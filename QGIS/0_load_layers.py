@@ -30,6 +30,18 @@ project = QgsProject.instance()
 root = project.layerTreeRoot()
 
 
+def find_layer_file(folder, name):
+    """Find an output saved as GeoPackage or GeoParquet, preferring OUTPUT_FORMAT."""
+    extensions = [".gpkg", ".parquet"]
+    if config.OUTPUT_FORMAT == "parquet":
+        extensions.reverse()
+    for extension in extensions:
+        path = folder / (name + extension)
+        if path.exists():
+            return path
+    return folder / (name + extensions[0])
+
+
 # Dissolved
 input_file = str(boundary_folder / f"{city}/{city}.gpkg") + f"|layername={city}"
 output_file = str(boundary_folder / f"{city}/{city} Dissolved.gpkg")
@@ -96,14 +108,16 @@ if full:
 
 
 for layer_name in ["Buildings", "Streets"]:
-    layer_path = data_folder / f"1_buildings_streets/{city} - {layer_name}.gpkg"
+    layer_path = find_layer_file(
+        data_folder / "1_buildings_streets", f"{city} - {layer_name}"
+    )
     layer = iface.addVectorLayer(str(layer_path), "", "ogr")
     layer.setName(layer_name)
     print(f"Loaded {layer_name}")
 
 
 for layer_name in layer_name_list:
-    layer_path = data_folder / f"2_morphometrics/{city} - morpho.gpkg"
+    layer_path = find_layer_file(data_folder / "2_morphometrics", f"{city} - morpho")
     layer = iface.addVectorLayer(str(layer_path), "", "ogr")
     layer.setName(layer_name)
     print(f"{city}: loaded {layer_name}")
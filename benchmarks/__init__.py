@@ -0,0 +1,5 @@
+"""
+Offline benchmarks of the morphometric kernels on synthetic cities
+
+Run with python -m benchmarks (see benchmarks/__main__.py).
+"""
@@ -0,0 +1,73 @@
+"""
+Run the benchmarks of the morphometric kernels
+
+    python -m benchmarks
+    python -m benchmarks --graphs grid --sizes 10 20 40 --kernels centrality
+    python -m benchmarks --output new.json --baseline old.json
+
+Prints the best time and the peak memory of every kernel. With --baseline,
+the results are compared with a previous --output file and the kernels that
+got slower than --max-slowdown are reported.
+"""
+
+import argparse
+import json
+import logging
+import sys
+
+import pandas as pd
+
+from benchmarks import fixtures
+from benchmarks.kernels import KERNELS, run_benchmarks
+
+
+def compare(df, baseline, max_slowdown=1.25):
+    """Add the time and memory ratios to a baseline and flag regressions."""
+    keys = ["graph", "size", "kernel"]
+    base = pd.DataFrame(baseline)[keys + ["seconds", "peak_mb"]]
+    df = df.merge(base, on=keys, how="left", suffixes=("", "_baseline"))
+    df["time_ratio"] = df["seconds"] / df["seconds_baseline"]
+    df["memory_ratio"] = df["peak_mb"] / df["peak_mb_baseline"]
+    df["regression"] = df["time_ratio"] > max_slowdown
+    return df.drop(columns=["seconds_baseline", "peak_mb_baseline"])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks")
+    parser.add_argument(
+        "--graphs", nargs="+", default=list(fixtures.GRAPHS), choices=fixtures.GRAPHS
+    )
+    parser.add_argument(
+        "--sizes", nargs="+", type=int, default=[5, 10], help="blocks per side"
+    )
+    parser.add_argument("--kernels", nargs="+", default=list(KERNELS), choices=KERNELS)
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs")
+    parser.add_argument("--output", help="save the results to a JSON file")
+    parser.add_argument("--baseline", help="compare with the results of a JSON file")
+    parser.add_argument("--max-slowdown", type=float, default=1.25)
+    args = parser.parse_args(argv)
+
+    # Progress of the benchmarks only, without the logs of the kernels
+    logger = logging.getLogger("log")
+    logger.addHandler(logging.StreamHandler())
+    logger.setLevel(logging.INFO)
+    results = run_benchmarks(args.graphs, args.sizes, args.kernels, args.repeat)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=1)
+
+    df = pd.DataFrame(results)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            df = compare(df, json.load(f), args.max_slowdown)
+
+    pd.set_option("display.width", 200)
+    print(df.round(4).to_string(index=False))
+    if args.baseline and df["regression"].any():
+        print("\nRegressions:", ", ".join(df.loc[df["regression"], "kernel"].unique()))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
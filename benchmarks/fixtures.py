@@ -0,0 +1,192 @@
+"""
+Synthetic street networks and buildings for the benchmarks
+
+The graphs look like the graphs of osmnx: MultiDiGraphs in EPSG:4326 with x, y
+node coordinates, street counts, osmid and length on the edges, two edges per
+two-way street. Everything is generated from a seed, without network access.
+"""
+
+import math
+import random
+
+import geopandas as gpd
+import networkx as nx
+import numpy as np
+import osmnx as ox
+import pandas as pd
+from scipy.spatial import Delaunay
+from shapely.affinity import rotate
+from shapely.geometry import LineString, Polygon, box
+
+# Origin of the synthetic city, in Barcelona
+LAT0, LON0 = 41.38, 2.17
+
+# Degrees per meter around the origin
+M_LAT = 1 / 111_320
+M_LON = 1 / (111_320 * math.cos(math.radians(LAT0)))
+
+# Spacing of the grid street networks, in meters
+SPACING = 100.0
+
+
+def to_lonlat(x, y):
+    """Convert meters from the origin to longitude and latitude."""
+    return LON0 + x * M_LON, LAT0 + y * M_LAT
+
+
+def _to_graph(points, edges, seed=0, oneway=0.2, curved=0.0):
+    """Build an osmnx-like graph from points in meters and undirected edges.
+
+    A fraction oneway of the streets is one way and a fraction curved bends
+    away from the straight line between its nodes. Only the largest weakly
+    connected component is kept.
+    """
+    rng = random.Random(seed)
+    G = nx.MultiDiGraph(crs="epsg:4326")
+    for node, (x, y) in enumerate(points):
+        lon, lat = to_lonlat(x, y)
+        G.add_node(node, x=lon, y=lat)
+
+    for osmid, (u, v) in enumerate(edges):
+        (x0, y0), (x1, y1) = points[u], points[v]
+        data = {"osmid": osmid, "highway": "residential", "oneway": False}
+        if rng.random() < curved:
+            # bend the street through a point off its middle
+            dx, dy = x1 - x0, y1 - y0
+            offset = rng.uniform(-0.3, 0.3)
+            middle = ((x0 + x1) / 2 - dy * offset, (y0 + y1) / 2 + dx * offset)
+            coords = [(x0, y0), middle, (x1, y1)]
+            data["geometry"] = LineString([to_lonlat(x, y) for x, y in coords])
+            data["length"] = LineString(coords).length
+        else:
+            data["length"] = math.hypot(x1 - x0, y1 - y0)
+
+        if rng.random() < oneway:
+            G.add_edge(u, v, **{**data, "oneway": True, "reversed": False})
+        else:
+            G.add_edge(u, v, **{**data, "reversed": False})
+            reverse = {**data, "reversed": True}
+            if "geometry" in data:
+                reverse["geometry"] = data["geometry"].reverse()
+            G.add_edge(v, u, **reverse)
+
+    G = G.subgraph(max(nx.weakly_connected_components(G), key=len)).copy()
+    nx.set_node_attributes(G, ox.stats.count_streets_per_node(G), "street_count")
+    return G
+
+
+def grid_graph(size=10, seed=0):
+    """Get a street grid of size x size blocks of 100 m, with a few dead ends."""
+    rng = random.Random(seed)
+    points = [(i * SPACING, j * SPACING) for i in range(size) for j in range(size)]
+    edges = []
+    for i in range(size):
+        for j in range(size):
+            for di, dj in [(1, 0), (0, 1)]:
+                if i + di < size and j + dj < size and rng.random() > 0.05:
+                    edges.append((i * size + j, (i + di) * size + j + dj))
+    return _to_graph(points, edges, seed=seed)
+
+
+def organic_graph(size=10, seed=0):
+    """Get an irregular street network, like an old town.
+
+    A grid with jittered intersections, missing streets and curved streets.
+    """
+    rng = random.Random(seed)
+    points = [
+        (
+            i * SPACING + rng.uniform(-0.35, 0.35) * SPACING,
+            j * SPACING + rng.uniform(-0.35, 0.35) * SPACING,
+        )
+        for i in range(size)
+        for j in range(size)
+    ]
+    edges = []
+    for i in range(size):
+        for j in range(size):
+            for di, dj in [(1, 0), (0, 1), (1, 1)]:
+                if i + di >= size or j + dj >= size:
+                    continue
+                # some diagonals, many missing streets
+                keep = 0.15 if (di, dj) == (1, 1) else 0.8
+                if rng.random() < keep:
+                    edges.append((i * size + j, (i + di) * size + j + dj))
+    return _to_graph(points, edges, seed=seed, curved=0.5)
+
+
+def random_planar_graph(size=10, seed=0):
+    """Get a random planar street network of size x size nodes.
+
+    The Delaunay triangulation of random points, with a third of its edges
+    removed.
+    """
+    rng = np.random.default_rng(seed)
+    points = rng.uniform(0, size * SPACING, size=(size * size, 2))
+    triangles = Delaunay(points).simplices
+    edges = {
+        tuple(sorted((int(a), int(b))))
+        for simplex in triangles
+        for a, b in [
+            (simplex[0], simplex[1]),
+            (simplex[1], simplex[2]),
+            (simplex[0], simplex[2]),
+        ]
+    }
+    edges = [edge for edge in sorted(edges) if rng.random() > 1 / 3]
+    return _to_graph([tuple(p) for p in points], edges, seed=seed)
+
+
+GRAPHS = {
+    "grid": grid_graph,
+    "organic": organic_graph,
+    "random": random_planar_graph,
+}
+
+
+def buildings(size=10, per_block=4, seed=0):
+    """Get building footprints in the blocks of a size x size street grid.
+
+    Like features_from_polygon: a GeoDataFrame in EPSG:4326 indexed by
+    element type and osmid, with a height (as text) for most buildings.
+    """
+    rng = random.Random(seed)
+    side = math.ceil(math.sqrt(per_block))
+    cell = (SPACING - 20) / side
+    geometries, heights = [], []
+    for i in range(size - 1):
+        for j in range(size - 1):
+            for k in range(per_block):
+                x = i * SPACING + 10 + (k % side) * cell + rng.uniform(1, 3)
+                y = j * SPACING + 10 + (k // side) * cell + rng.uniform(1, 3)
+                width = rng.uniform(0.5, 0.9) * cell
+                depth = rng.uniform(0.5, 0.9) * cell
+                footprint = rotate(
+                    box(x, y, x + width, y + depth), rng.uniform(-15, 15)
+                )
+                coords = [to_lonlat(*xy) for xy in footprint.exterior.coords]
+                geometries.append(Polygon(coords))
+                height = rng.choice([3, 6, 9, 12, 15, 30])
+                heights.append(str(height) if rng.random() < 0.8 else None)
+    index = pd.MultiIndex.from_tuples(
+        [("way", 1000 + i) for i in range(len(geometries))],
+        names=["element_type", "osmid"],
+    )
+    return gpd.GeoDataFrame(
+        {"building": "yes", "height": heights},
+        geometry=geometries,
+        index=index,
+        crs="epsg:4326",
+    )
+
+
+def polygon(size=10):
+    """Get the polygon covering a size x size street grid."""
+    lon0, lat0 = to_lonlat(-10, -10)
+    lon1, lat1 = to_lonlat(size * SPACING, size * SPACING)
+    return box(lon0, lat0, lon1, lat1)
+
+
+def polygons_gdf(size=10):
+    """Get the polygon of a size x size grid as a boundaries GeoDataFrame."""
+    return gpd.GeoDataFrame({"UID": [0]}, geometry=[polygon(size)], crs="epsg:4326")
@@ -0,0 +1,192 @@
+"""
+Morphometric kernels timed by the benchmarks
+
+Every kernel is set up on a synthetic street network and its buildings, then
+timed without the setup. Steps of the metric graph are timed alone: their
+requirements are computed first.
+"""
+
+import logging
+import time
+import tracemalloc
+from functools import lru_cache
+
+import osmnx as ox
+
+from benchmarks import fixtures
+from layers.morpho.helpers import (
+    fractal_dimension,
+    get_entropy,
+    pp_compactness,
+    rasterize_graph,
+)
+from layers.morpho.metrics import Context, compute_metrics, get_requires, get_step
+from layers.morpho.morpho import get_variables_list
+
+logger = logging.getLogger("log")
+
+# Intermediates of the metric graph, most of them momepy calls
+STEPS = [
+    "streets_graph",
+    "basic_stats",
+    "diameter",
+    "node_connectivity",
+    "primal",
+    "centrality",  # the four measures, with local closeness
+    "buildings",
+    "tessellation",
+    "building_orientation",
+    "network_ids",
+    "street_profile",
+]
+
+# Groups of variables, computed together from the inputs
+STREET_VARS = [
+    "fractal-dimension",
+    "shannon_entropy-street_orientation_order",
+    "avg_street_length",
+    "avg_streets_per_node",
+    "intersection_density",
+    "street_density",
+    "avg_circuity",
+    "avg_PageRank",
+]
+CENTRALITY_VARS = [
+    "avg_betweenness_centrality",
+    "avg_local_closeness_centrality",
+    "avg_global_closeness_centrality",
+    "avg_straightness_centrality",
+]
+BUILT_VARS = [
+    "avg_building_area",
+    "avg_tesselation_area",
+    "avg_building_orientation",
+    "avg_tessellation_orientation",
+    "avg_building_cell_alignment",
+    "avg_building_compactness",
+    "total_built_area",
+]
+GROUPS = {
+    "street_vars": STREET_VARS,
+    "centrality_vars": CENTRALITY_VARS,
+    "built_vars": BUILT_VARS,
+    "full_vars": None,
+}
+
+
+@lru_cache(maxsize=None)
+def get_inputs(graph_type, size):
+    """Get the inputs of a polygon with a synthetic city of size x size blocks."""
+    polygon = fixtures.polygon(size)
+    area = ox.projection.project_geometry(polygon)[0].area
+    return {
+        "polygon": polygon,
+        "area": area,
+        "graph": fixtures.GRAPHS[graph_type](size),
+        "buildings_gdf": fixtures.buildings(size),
+    }
+
+
+def _kernel_rasterize_graph(inputs):
+    graph = inputs["graph"]
+    return lambda: rasterize_graph(graph)
+
+
+def _kernel_fractal_dimension(inputs):
+    raster = rasterize_graph(inputs["graph"])
+    return lambda: fractal_dimension(raster)
+
+
+def _kernel_entropy(inputs):
+    graph = inputs["graph"]
+    return lambda: get_entropy(graph)
+
+
+def _kernel_pp_compactness(inputs):
+    geometries = ox.project_gdf(inputs["buildings_gdf"]).geometry
+    return lambda: geometries.apply(pp_compactness)
+
+
+def _step_kernel(name):
+    def setup(inputs):
+        context = Context(**inputs)
+        # The requirements are computed before the timing
+        for requirement in get_requires(get_step(name)):
+            context.values[requirement] = context[requirement]
+        return lambda: context.compute(name)
+
+    return setup
+
+
+def _group_kernel(variables):
+    def setup(inputs):
+        selected = variables or get_variables_list(full=True)
+        return lambda: compute_metrics(selected, **inputs)
+
+    return setup
+
+
+KERNELS = {
+    "rasterize_graph": _kernel_rasterize_graph,
+    "fractal_dimension": _kernel_fractal_dimension,
+    "get_entropy": _kernel_entropy,
+    "pp_compactness": _kernel_pp_compactness,
+    **{name: _step_kernel(name) for name in STEPS},
+    **{name: _group_kernel(variables) for name, variables in GROUPS.items()},
+}
+
+
+def measure(func, repeat=3):
+    """Get the best time of func over repeat runs and its peak memory.
+
+    The peak memory of the Python and numpy allocations is measured with
+    tracemalloc in one more run, so that tracing does not slow down the timed
+    runs.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return min(times), peak
+
+
+def run_benchmarks(graph_types, sizes, kernels, repeat=3):
+    """Time kernels on every graph type and size.
+
+    Returns a list of results with the time in seconds and the peak memory in
+    MB of every kernel.
+    """
+    results = []
+    for graph_type in graph_types:
+        for size in sizes:
+            inputs = get_inputs(graph_type, size)
+            for kernel in kernels:
+                func = KERNELS[kernel](inputs)
+                seconds, peak = measure(func, repeat)
+                result = {
+                    "graph": graph_type,
+                    "size": size,
+                    "nodes": len(inputs["graph"]),
+                    "buildings": len(inputs["buildings_gdf"]),
+                    "kernel": kernel,
+                    "seconds": seconds,
+                    "peak_mb": peak / 1024**2,
+                }
+                logger.info(
+                    "%s %s %s: %.4f s, %.1f MB",
+                    graph_type,
+                    size,
+                    kernel,
+                    seconds,
+                    result["peak_mb"],
+                )
+                results.append(result)
+    return results
@@ -0,0 +1,252 @@
+"""
+Scaling of the morphometrics with the size of the city
+
+    python -m benchmarks.scaling
+    python -m benchmarks.scaling --sizes 500:1000 2000:5000 --exponent 1.2
+    python -m benchmarks.scaling --plot scaling.png --output scaling.json
+
+Runs the full get_morphometrics pipeline on synthetic cities of increasing
+size (street nodes:buildings), each in a new process so that its peak memory
+(RSS) is its own. The runtime of a variable is the time of all the steps of
+the metric graph it needs, from the timings of the run. The empirical
+complexity of every variable is the slope of its runtime against the size of
+its input (buildings if it needs them, street nodes otherwise) on a log-log
+scale. Variables growing faster than --exponent are flagged.
+"""
+
+import argparse
+import json
+import logging
+import math
+import multiprocessing
+import queue
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from benchmarks import fixtures
+from layers import telemetry
+from layers.morpho.metrics import get_plan
+from layers.morpho.morpho import OPTIONAL_VARS, get_morphometrics, get_variables_list
+
+logger = logging.getLogger("log")
+
+# Cities from 500 street nodes and 1k buildings to 200k nodes and 1M buildings
+SIZES = [
+    (500, 1_000),
+    (2_000, 5_000),
+    (10_000, 30_000),
+    (50_000, 200_000),
+    (200_000, 1_000_000),
+]
+
+# Steps faster than this are too noisy for the complexity fit, in seconds
+MIN_SECONDS = 0.01
+
+
+def get_city(nodes, buildings, graph_type="grid"):
+    """Get a synthetic city with about that many street nodes and buildings."""
+    size = max(2, round(math.sqrt(nodes)))
+    per_block = max(1, round(buildings / (size - 1) ** 2))
+    graph = fixtures.GRAPHS[graph_type](size)
+    city_buildings = fixtures.buildings(size, per_block=per_block)
+    return fixtures.polygons_gdf(size), graph, city_buildings
+
+
+def _run(nodes, buildings, graph_type, options, result_queue):
+    """Run the pipeline on a city and send its timings to result_queue."""
+    gdf, graph, city_buildings = get_city(nodes, buildings, graph_type)
+    with telemetry.recording() as recorder:
+        get_morphometrics(
+            gdf,
+            full=True,
+            city_graph=graph,
+            city_buildings=city_buildings,
+            **options,
+        )
+    result_queue.put(
+        {
+            "nodes": len(graph),
+            "buildings": len(city_buildings),
+            "records": recorder.get_records(),
+        }
+    )
+
+
+def run_size(nodes, buildings, graph_type="grid", options=None, timeout=None):
+    """Run the pipeline on a city in a new process.
+
+    Returns the sizes of the city and the timings of its steps, or None if it
+    took longer than timeout seconds.
+    """
+    result_queue = multiprocessing.Queue()
+    process = multiprocessing.Process(
+        target=_run,
+        args=(nodes, buildings, graph_type, options or {}, result_queue),
+    )
+    process.start()
+    start = time.perf_counter()
+    try:
+        while True:
+            try:
+                return result_queue.get(timeout=1)
+            except queue.Empty:
+                if not process.is_alive():
+                    logger.info("Scaling: the process failed.")
+                    return None
+                if timeout is not None and time.perf_counter() - start > timeout:
+                    return None
+    finally:
+        process.terminate()
+        process.join()
+
+
+def get_variable_costs(run, variables):
+    """Get the runtime and peak memory of every variable in a run.
+
+    The runtime of a variable is the sum of the times of the steps it needs.
+    The memory is the peak RSS of the process once they are done.
+    """
+    steps = pd.DataFrame(run["records"]).groupby("stage")
+    seconds = steps["seconds"].sum()
+    max_rss = steps["max_rss_mb"].max()
+    rows = []
+    for variable in variables:
+        plan = [step for step in get_plan([variable]) if step in seconds.index]
+        needs_buildings = "buildings" in plan
+        rows.append(
+            {
+                "variable": variable,
+                "nodes": run["nodes"],
+                "buildings": run["buildings"],
+                "n": run["buildings"] if needs_buildings else run["nodes"],
+                "seconds": seconds[plan].sum(),
+                "max_rss_mb": max_rss[plan].max() if plan else np.nan,
+            }
+        )
+    return rows
+
+
+def fit_exponents(df, exponent=1.2):
+    """Fit the runtime of every variable to c * n^k on a log-log scale.
+
+    Returns the exponent k of every variable and whether it is larger than
+    exponent. Sizes faster than MIN_SECONDS are left out of the fit.
+    """
+    rows = []
+    for variable, group in df.groupby("variable", sort=False):
+        group = group[group["seconds"] >= MIN_SECONDS]
+        k = np.nan
+        if group["n"].nunique() >= 2:
+            k = np.polyfit(np.log(group["n"]), np.log(group["seconds"]), 1)[0]
+        rows.append(
+            {
+                "variable": variable,
+                "exponent": k,
+                "max_seconds": group["seconds"].max(),
+                "superlinear": bool(k > exponent),
+            }
+        )
+    return pd.DataFrame(rows).sort_values("exponent", ascending=False)
+
+
+def plot(df, filename):
+    """Plot the runtime and peak memory of every variable against the size."""
+    try:
+        import matplotlib
+    except ImportError:
+        logger.warning("Scaling: plotting requires matplotlib: pip install matplotlib")
+        return
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    fig, (ax_time, ax_rss) = plt.subplots(1, 2, figsize=(16, 7))
+    for variable, group in df.groupby("variable", sort=False):
+        ax_time.plot(group["n"], group["seconds"], marker="o", label=variable)
+        ax_rss.plot(group["n"], group["max_rss_mb"], marker="o", label=variable)
+    for ax, ylabel in [(ax_time, "runtime (s)"), (ax_rss, "peak RSS (MB)")]:
+        ax.set_xscale("log")
+        ax.set_yscale("log")
+        ax.set_xlabel("size (buildings or street nodes)")
+        ax.set_ylabel(ylabel)
+    ax_rss.legend(fontsize="x-small", loc="center left", bbox_to_anchor=(1, 0.5))
+    fig.tight_layout()
+    fig.savefig(filename, dpi=120)
+    logger.info("Scaling: saved %s", filename)
+
+
+def _parse_size(text):
+    nodes, buildings = text.split(":")
+    return int(nodes), int(buildings)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.scaling")
+    parser.add_argument(
+        "--sizes",
+        nargs="+",
+        type=_parse_size,
+        default=SIZES,
+        help="city sizes as nodes:buildings",
+    )
+    parser.add_argument("--graph", default="grid", choices=fixtures.GRAPHS)
+    parser.add_argument(
+        "--exponent", type=float, default=1.2, help="flag variables above n^exponent"
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=3600, help="seconds per size, then stop"
+    )
+    parser.add_argument("--centrality-samples", type=float, default=None)
+    parser.add_argument("--connectivity-budget", type=float, default=60)
+    parser.add_argument(
+        "--tessellation-memory", type=float, default=None, help="bytes, in tiles"
+    )
+    parser.add_argument("--plot", help="save the scaling curves to an image")
+    parser.add_argument("--output", help="save the results to a JSON file")
+    args = parser.parse_args(argv)
+
+    logger.addHandler(logging.StreamHandler())
+    logger.setLevel(logging.INFO)
+    # Only the progress of the harness, not the logs of the pipeline
+    logger.handlers[-1].addFilter(lambda record: str(record.msg).startswith("Scaling"))
+
+    samples = args.centrality_samples
+    options = {
+        "centrality_samples": int(samples) if samples and samples >= 1 else samples,
+        "connectivity_budget": args.connectivity_budget,
+        "tessellation_memory": args.tessellation_memory,
+    }
+    variables = get_variables_list(full=True) + OPTIONAL_VARS
+
+    rows = []
+    for nodes, buildings in sorted(args.sizes):
+        logger.info("Scaling: %s nodes, %s buildings...", nodes, buildings)
+        run = run_size(nodes, buildings, args.graph, options, args.timeout)
+        if run is None:
+            logger.info("Scaling: stopped, no result in %s s.", args.timeout)
+            break
+        rows.extend(get_variable_costs(run, variables))
+
+    df = pd.DataFrame(rows)
+    if df.empty:
+        print("No results.")
+        return 1
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(rows, f, indent=1, default=float)
+    if args.plot:
+        plot(df, args.plot)
+
+    exponents = fit_exponents(df, args.exponent)
+    pd.set_option("display.width", 200)
+    print(exponents.round(3).to_string(index=False))
+    flagged = exponents.loc[exponents["superlinear"], "variable"]
+    if not flagged.empty:
+        print(f"\nGrowing faster than n^{args.exponent}:", ", ".join(flagged))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,59 +3,24 @@ Get boundaries from OSM
 """
 
 # Import packages
+import codecs
+import json
 import logging
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import geopandas as gpd
-import pandas as pd
 import requests
 from osm2geojson import json2geojson
 
 import config
-from layers.helpers import get_city_id
+from boundaries import store
+from layers.client import get_client
 
 logger = logging.getLogger("log")
 
 
-def save_query_data(city, column, value, filepath):
-    """Save admin_level or city_id to query data spreadsheet"""
-    try:
-        df = pd.read_csv(filepath, dtype={"city": str, column: "Int64"})
-        if city in df["city"].unique():
-            df.loc[df["city"] == city, column] = value
-            out_df = df.copy()
-            logger.debug("Updating %s=%s in %s", column, value, filepath)
-            logger.debug(out_df)
-        else:
-            out_dict = {"city": city, column: value}
-            out_df = pd.DataFrame([out_dict])
-            out_df = pd.concat([df, out_df])
-            logger.debug("Appending new data to %s", filepath)
-            logger.debug(out_df)
-    except FileNotFoundError:
-        pass
-
-    out_df.to_csv(filepath, index=False)
-
-
-def get_query_settings_from_file(city, filepath):
-    city_id = None
-    admin_level = None
-    try:
-        logger.debug("Reading: %s", filepath)
-        df = pd.read_csv(filepath)
-        df_city = df.loc[df["city"] == city]
-        if not df_city.empty:
-            city_id = df.loc[df["city"] == city, "city_id"].values[0]
-            logger.debug("Read city_id: %s", city_id)
-            admin_level = df.loc[df["city"] == city, "admin_level"].values[0]
-            logger.debug("Read admin_level: %s", admin_level)
-    except FileNotFoundError:
-        pass
-    except KeyError:
-        pass
-    return city_id, admin_level
-
-
 QUERY = """
 [out:json][timeout:25];
 // fetch area to search in
@@ -71,14 +36,49 @@ out skel qt;
 """
 
 
-def make_request(city_id, admin_level):
-    headers = {"User-Agent": "cityform/0.1"}
-    url = "http://overpass-api.de/api/interpreter"  # Overpass API URL
-    r = requests.get(
+# Number of boundary relations of every admin_level, from 10 to 0
+COUNT_QUERY = """
+[out:json][timeout:25];
+area(id:{city_id})->.searchArea;
+{counts}
+"""
+COUNT_STATEMENT = """relation["admin_level"="{admin_level}"](area.searchArea);
+out count;"""
+
+ADMIN_LEVELS = list(reversed(range(11)))
+
+
+# Boundaries of many cities in one query. Every city is followed by a marker
+# element with its index, so that the response can be split by city.
+BATCH_QUERY = """
+[out:json][timeout:{timeout}];
+{cities}
+"""
+BATCH_STATEMENT = """area(id:{city_id})->.searchArea;
+relation["admin_level"="{admin_level}"](area.searchArea);
+out body;
+>;
+out skel qt;
+make {marker} index="{index}";
+out;"""
+BATCH_MARKER = "cityform"
+
+# Seconds of the Overpass timeout per city of a batch query
+BATCH_TIMEOUT = 25
+
+
+def make_request(city_id, admin_level, stop=None):
+    """Request the boundaries of a city at admin_level.
+
+    Returns None without a request once stop (a threading.Event) is set.
+    """
+    if stop is not None and stop.is_set():
+        return None
+    url = config.OVERPASS_URL + "/interpreter"  # Overpass API URL
+    r = get_client().get(
         url,
         params={"data": QUERY.format(city_id=city_id, admin_level=admin_level)},
         timeout=30,
-        headers=headers,
     )
     if not r.ok:
         logger.debug(
@@ -93,56 +93,252 @@ def make_request(city_id, admin_level):
     return r.json()
 
 
-def get_admin_level(city_id):
-    for admin_level in reversed(range(11)):
+def iter_elements(chunks):
+    """Parse the elements of an Overpass JSON response as the chunks arrive.
+
+    Raises ValueError if Overpass stopped with an error after the elements.
+    """
+    decoder = json.JSONDecoder()
+    text = ""
+    started = False
+    for chunk in chunks:
+        text += chunk
+        if not started:
+            match = re.search(r'"elements"\s*:\s*\[', text)
+            if match is None:
+                continue
+            text = text[match.end() :]
+            started = True
+        pos = 0
+        while True:
+            while pos < len(text) and text[pos] in " \t\r\n,":
+                pos += 1
+            if pos == len(text) or text[pos] == "]":
+                break
+            try:
+                element, pos = decoder.raw_decode(text, pos)
+            except json.JSONDecodeError:
+                break  # incomplete, wait for the next chunk
+            yield element
+        text = text[pos:]
+        if text.startswith("]"):
+            break
+    rest = text + "".join(chunks)
+    remark = re.search(r'"remark"\s*:\s*"([^"]*)"', rest)
+    if remark and "error" in remark.group(1):
+        raise ValueError(remark.group(1))
+
+
+def request_batch(batch):
+    """Get the boundaries of many cities with one streamed Overpass query.
+
+    batch is a list of (city, city_id, admin_level). Yields every city and its
+    boundaries as soon as they are complete. Cities that are not yielded
+    (because the request failed) have to be requested again.
+    """
+    url = config.OVERPASS_URL + "/interpreter"  # Overpass API URL
+    cities = "\n".join(
+        BATCH_STATEMENT.format(
+            city_id=city_id, admin_level=admin_level, marker=BATCH_MARKER, index=i
+        )
+        for i, (_, city_id, admin_level) in enumerate(batch)
+    )
+    timeout = BATCH_TIMEOUT * len(batch)
+    query = BATCH_QUERY.format(timeout=timeout, cities=cities)
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    elements = []
+    try:
+        with get_client().post(
+            url, data={"data": query}, timeout=timeout + 30, stream=True
+        ) as r:
+            r.raise_for_status()
+            chunks = (decoder.decode(chunk) for chunk in r.iter_content(2**16))
+            for element in iter_elements(chunks):
+                if element["type"] != BATCH_MARKER:
+                    elements.append(element)
+                    continue
+                city = batch[int(element["tags"]["index"])][0]
+                yield city, {"elements": elements}
+                elements = []
+    except (requests.RequestException, ValueError, KeyError) as e:
+        logger.error("Batch of %s cities failed: %s", len(batch), e)
+
+
+def get_admin_level_counts(city_id):
+    """Get the number of boundaries of every admin_level in one request.
+
+    Returns None if the request fails.
+    """
+    url = config.OVERPASS_URL + "/interpreter"  # Overpass API URL
+    counts = "\n".join(
+        COUNT_STATEMENT.format(admin_level=admin_level) for admin_level in ADMIN_LEVELS
+    )
+    try:
+        r = get_client().get(
+            url,
+            params={"data": COUNT_QUERY.format(city_id=city_id, counts=counts)},
+            timeout=30,
+        )
+        r.raise_for_status()
+        elements = r.json()["elements"]
+        # One count per admin_level, in the order of the query
+        values = [int(element["tags"]["relations"]) for element in elements]
+    except (requests.RequestException, ValueError, KeyError) as e:
+        logger.debug("city_id=%s, admin_level counts failed: %s", city_id, e)
+        return None
+    if len(values) != len(ADMIN_LEVELS):
+        logger.debug("city_id=%s, unexpected admin_level counts", city_id)
+        return None
+    return dict(zip(ADMIN_LEVELS, values))
+
+
+def probe_admin_levels(city_id, workers=2):
+    """Get the most granular admin_level with boundaries and its boundaries.
+
+    Every admin_level is requested, by workers requests at a time. Requests
+    still pending are cancelled once the levels above the answer are known, and
+    the running ones are waited for, so that none outlives the call.
+    """
+    stop = threading.Event()
+    executor = ThreadPoolExecutor(max_workers=workers)
+    futures = {
+        executor.submit(make_request, city_id, admin_level, stop): admin_level
+        for admin_level in ADMIN_LEVELS
+    }
+    results = {}
+    try:
+        for future in as_completed(futures):
+            results[futures[future]] = future.result()
+            for admin_level in ADMIN_LEVELS:
+                if admin_level not in results:
+                    break
+                geojson = results[admin_level]
+                if geojson and geojson["elements"]:
+                    return admin_level, geojson
+    finally:
+        stop.set()
+        executor.shutdown(wait=True, cancel_futures=True)
+    return None, None
+
+
+def get_admin_level(city_id, workers=2):
+    """Get the most granular admin_level with boundaries and its boundaries.
+
+    The levels are found with one request that counts the boundaries of all of
+    them. If it fails, the levels are requested one by one (see
+    probe_admin_levels).
+    """
+    counts = get_admin_level_counts(city_id)
+    if counts is not None:
+        logger.debug("admin_level counts: %s", counts)
+        levels = [admin_level for admin_level, count in counts.items() if count]
+        if not levels:
+            return None, None
+        admin_level = max(levels)
         geojson = make_request(city_id, admin_level)
         if geojson and geojson["elements"]:
             logger.debug("admin_level=%s", admin_level)
-            break
-    else:
-        return None, None
+            return admin_level, geojson
 
+    logger.debug("Probing admin_level with %s workers.", workers)
+    admin_level, geojson = probe_admin_levels(city_id, workers)
+    if admin_level is not None:
+        logger.debug("admin_level=%s", admin_level)
     return admin_level, geojson
 
 
-def get_boundaries(city_list):
-    """Get boundaries"""
+def save_boundaries(city, geojson):
+    """Save the boundaries of a city from an Overpass response.
+
+    Returns the file, or None if the response could not be parsed.
+    """
+    # Create GeoDataFrame
+    try:
+        geojson = json2geojson(geojson)
+    except TypeError:
+        logger.error(
+            "There was an error parsing the geojson for city: %s. "
+            "Please download geojson from https://overpass-turbo.eu",
+            city,
+        )
+        return None
+
+    gdf = gpd.GeoDataFrame().from_features(geojson)
+    gdf = gdf.loc[gdf.geom_type == "MultiPolygon"]
+
+    gdf = gdf.set_crs("epsg:4326")
+    # gdf = gdf.loc[gdf['type'] == 'relation']
+
+    if not all(gdf["type"] == "relation"):
+        message = "Not all types are relations."
+        logger.error(message)
+        raise ValueError(message)
+
+    # Save
+    out_city = city.split(",")[0]  # Fix "Saint Petersburg, Russia" and others
+    out_file = config.BOUNDARIES_DIR / out_city / (out_city + ".gpkg")
+    if not out_file.parent.exists():
+        out_file.parent.mkdir(parents=True)
+    gdf.to_file(out_file, driver="GPKG")
+    logger.info("Saved: %s", out_file)
+    return out_file
+
+
+def get_boundaries(city_list, workers=2, batch_size=20):
+    """Get boundaries
+
+    The city_id and admin_level of every city are kept in the store (see
+    boundaries.store). workers is the number of concurrent requests to geolocate
+    the cities, and when the admin_level has to be probed level by level.
+    Cities with a known admin_level are requested batch_size at a time in one
+    query (None for one query per city).
+    """
     city_list_names_only = [city.split(":")[0] for city in city_list]
     logger.info("City list: %s", ", ".join(city_list_names_only))
 
+    # Geolocate all the cities missing from the store first
+    cities = [city for city in city_list if ":" not in city]
+    store.prefetch_city_ids(config.QUERY_DATA_DB, cities, workers)
+    settings = store.get_settings(config.QUERY_DATA_DB, cities)
+
+    # Cities with a known admin_level, in batches
+    done = set()
+    known = [(city, *settings[city]) for city in cities if None not in settings[city]]
+    if batch_size and len(known) > 1:
+        for i in range(0, len(known), batch_size):
+            batch = known[i : i + batch_size]
+            logger.info("Batch:     %s cities", len(batch))
+            for city, geojson in request_batch(batch):
+                logger.info("City:      %s", city)
+                done.add(city)
+                if not geojson["elements"]:
+                    logger.error("No boundaries found for city: %s", city)
+                    continue
+                save_boundaries(city, geojson)
+
     for city in city_list:
         if ":" in city:
             city, explanation = city.split(":", 1)
             logger.info("City:      %s (SKIPPED: %s)", city, explanation.strip())
             continue
+        if city in done:
+            continue
 
         logger.info("City:      %s", city)
 
-        # Get city_id and admin_level from file
-        query_data_file = config.DATA_ROOT / "query_data.csv"
-        city_id, admin_level = get_query_settings_from_file(city, str(query_data_file))
-
-        # Get city id from Nominatim
-        if pd.isna(city_id):
-            try:
-                logger.debug("city_id not found. Geolocating city: %s", city)
-                city_id = get_city_id(city)
-                query_data_file = config.DATA_ROOT / "query_data.csv"
-                save_query_data(city, "city_id", city_id, str(query_data_file))
-            except ValueError:
-                logger.error("Could not geolocate city: %s", city)
-                continue
+        city_id, admin_level = settings[city]
+        if city_id is None:
+            continue  # not geolocated
 
         # Get boundaries from Overpass API
-        if pd.isna(admin_level):
+        if admin_level is None:
             logger.debug(
                 "admin_level not found. Making requests for most granular "
                 "admin_level."
             )
-            admin_level, geojson = get_admin_level(city_id)
-            # Save admin_level
-            query_data_file = config.DATA_ROOT / "query_data.csv"
-            save_query_data(city, "admin_level", admin_level, str(query_data_file))
+            admin_level, geojson = get_admin_level(city_id, workers)
+            if admin_level is not None:
+                store.save(config.QUERY_DATA_DB, city, admin_level=admin_level)
             if not geojson:
                 logger.error("No boundaries found for city: %s", city)
                 continue
@@ -150,32 +346,4 @@ def get_boundaries(city_list):
             logger.debug("admin_level found: %s. Sending request", admin_level)
             geojson = make_request(city_id, admin_level)
 
-        # Create GeoDataFrame
-        try:
-            geojson = json2geojson(geojson)
-        except TypeError:
-            logger.error(
-                "There was an error parsing the geojson for city: %s. "
-                "Please download geojson from https://overpass-turbo.eu",
-                city,
-            )
-            continue
-
-        gdf = gpd.GeoDataFrame().from_features(geojson)
-        gdf = gdf.loc[gdf.geom_type == "MultiPolygon"]
-
-        gdf = gdf.set_crs("epsg:4326")
-        # gdf = gdf.loc[gdf['type'] == 'relation']
-
-        if not all(gdf["type"] == "relation"):
-            message = "Not all types are relations."
-            logger.error(message)
-            raise ValueError(message)
-
-        # Save
-        out_city = city.split(",")[0]  # Fix "Saint Petersburg, Russia" and others
-        out_file = config.BOUNDARIES_DIR / out_city / (out_city + ".gpkg")
-        if not out_file.parent.exists():
-            out_file.parent.mkdir(parents=True)
-        gdf.to_file(out_file, driver="GPKG")
-        logger.info("Saved: %s", out_file)
+        save_boundaries(city, geojson)
@@ -0,0 +1,157 @@
+"""
+Store of the query settings of every city (city_id and admin_level)
+
+A SQLite database indexed by city, in WAL mode so that parallel workers can
+read and write it at the same time. It replaces data/query_data.csv, which is
+imported when the store is created (or with python -m boundaries.store import).
+"""
+
+import argparse
+import logging
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing, contextmanager
+from pathlib import Path
+
+import pandas as pd
+
+import config
+from layers.helpers import get_city_id
+
+logger = logging.getLogger("log")
+
+COLUMNS = ["city_id", "admin_level"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS query_data (
+    city TEXT PRIMARY KEY,
+    city_id INTEGER,
+    admin_level INTEGER
+)
+"""
+
+# Seconds a writer waits for another one to finish
+BUSY_TIMEOUT = 30
+
+# Cities looked up per query (SQLite allows 999 parameters)
+CHUNK_SIZE = 500
+
+
+@contextmanager
+def connect(path):
+    """Open the store, creating it if needed. Commits when the block ends."""
+    path = Path(path)
+    created = not path.exists()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with closing(sqlite3.connect(path, timeout=BUSY_TIMEOUT)) as conn:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(SCHEMA)
+        with conn:
+            if created:
+                csv_file = path.with_suffix(".csv")
+                if csv_file.exists():
+                    count = _import_csv(conn, csv_file)
+                    logger.info("Store: imported %s cities from %s", count, csv_file)
+            yield conn
+
+
+def _to_int(value):
+    return None if pd.isna(value) else int(value)
+
+
+def get_settings(path, cities):
+    """Get the city_id and admin_level of every city, None when unknown."""
+    settings = {city: (None, None) for city in cities}
+    names = list(settings)
+    with connect(path) as conn:
+        for i in range(0, len(names), CHUNK_SIZE):
+            chunk = names[i : i + CHUNK_SIZE]
+            rows = conn.execute(
+                "SELECT city, city_id, admin_level FROM query_data "
+                f"WHERE city IN ({', '.join('?' * len(chunk))})",
+                chunk,
+            )
+            for city, city_id, admin_level in rows:
+                settings[city] = (city_id, admin_level)
+    return settings
+
+
+def save(path, city, **values):
+    """Save the city_id and/or admin_level of a city."""
+    columns = [column for column in COLUMNS if column in values]
+    if len(columns) != len(values):
+        raise ValueError(f"Unknown columns: {set(values) - set(COLUMNS)}")
+    updates = ", ".join(f"{column} = excluded.{column}" for column in columns)
+    with connect(path) as conn:
+        conn.execute(
+            f"INSERT INTO query_data (city, {', '.join(columns)}) "
+            f"VALUES (?{', ?' * len(columns)}) "
+            f"ON CONFLICT (city) DO UPDATE SET {updates}",
+            [city] + [_to_int(values[column]) for column in columns],
+        )
+    logger.debug("Store: saved %s for %s", values, city)
+
+
+def _import_csv(conn, csv_file):
+    """Import the rows of a query_data.csv, keeping the values already stored."""
+    df = pd.read_csv(csv_file, dtype={"city": str})
+    rows = [
+        (row.city, *[_to_int(getattr(row, column, None)) for column in COLUMNS])
+        for row in df.itertuples(index=False)
+    ]
+    conn.executemany(
+        "INSERT INTO query_data (city, city_id, admin_level) VALUES (?, ?, ?) "
+        "ON CONFLICT (city) DO UPDATE SET "
+        "city_id = coalesce(city_id, excluded.city_id), "
+        "admin_level = coalesce(admin_level, excluded.admin_level)",
+        rows,
+    )
+    return len(rows)
+
+
+def import_csv(path, csv_file):
+    """Import a query_data.csv into the store. Returns the number of cities."""
+    with connect(path) as conn:
+        return _import_csv(conn, csv_file)
+
+
+def prefetch_city_ids(path, cities, workers=2):
+    """Geolocate the cities of the list without a city_id in the store.
+
+    Requests are sent by workers threads, at the rate allowed for Nominatim
+    (see layers.client). Returns the city_id of every city found.
+    """
+    settings = get_settings(path, cities)
+    missing = [city for city, (city_id, _) in settings.items() if city_id is None]
+    if not missing:
+        return {}
+    logger.info("Geolocating %s cities.", len(missing))
+
+    def geolocate(city):
+        try:
+            city_id = get_city_id(city, config.NOMINATIM_URL)
+        except ValueError as e:
+            logger.error("Could not geolocate city: %s (%s)", city, e)
+            return None
+        save(path, city, city_id=city_id)
+        return city_id
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        city_ids = dict(zip(missing, executor.map(geolocate, missing)))
+    return {city: city_id for city, city_id in city_ids.items() if city_id is not None}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m boundaries.store")
+    parser.add_argument("command", choices=["import"])
+    parser.add_argument(
+        "csv", nargs="?", default=config.QUERY_DATA_DB.with_suffix(".csv")
+    )
+    parser.add_argument("--db", default=config.QUERY_DATA_DB)
+    args = parser.parse_args(argv)
+    count = import_csv(args.db, args.csv)
+    print(f"Imported {count} cities from {args.csv} into {args.db}")
+
+
+if __name__ == "__main__":
+    main()
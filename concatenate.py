@@ -1,13 +1,13 @@
 """
 Concatenate all morphometrics into one CSV.
+
+Only the cities whose morphometrics file is new or changed are read again.
 """
 
 import sys
 
-import geopandas as gpd
-import pandas as pd
-
 import config
+from layers.consolidate import consolidate, load_manifest
 
 
 def get_last_modified_file(directory):
@@ -25,17 +25,16 @@ morpho_folder = config.MORPHOMETRICS_DIR
 csv_folder = config.CSV_DIR
 out_csv = csv_folder / "Morphometrics.csv"
 
-df = pd.read_csv(out_csv)
-
-print("The last version of Morphometrics.csv has", df["city"].nunique(), "cities.")
+manifest = load_manifest(config.PARTITIONS_DIR)
+print("The last version of Morphometrics.csv has", len(manifest), "cities.")
 
 
 last_modified_file = get_last_modified_file(morpho_folder)
 print("The last modified file is:", last_modified_file)
 
 user_input = input(
-    "Do you wish to concatenate all morphometrics files and overwrite "
-    "Morphometrics.csv? (y/n) "
+    "Do you wish to update Morphometrics.csv with the new and changed "
+    "morphometrics files? (y/n) "
 )
 
 if user_input.lower() != "y":
@@ -44,19 +43,5 @@ if user_input.lower() != "y":
 
 
 print("Concatenating morphometrics files...")
-# if df["city"].nunique() > len(city_list):
-#     logger.info("CSV exists and has more cities. Skipping.")
-#     return
-
-df_full = pd.DataFrame()
-for file in morpho_folder.iterdir():
-    if " - morpho.gpkg" in file.name:
-        city_name = file.stem.split(" - morpho")[0].strip()
-        gdf = gpd.read_file(file)
-        gdf["city"] = city_name
-        df_full = pd.concat([df_full, gdf])
-
-# Save
-df_full.to_csv(str(out_csv), index=None)
-# logger.info("CSV: Saved %s", out_csv)
+consolidate(morpho_folder, config.PARTITIONS_DIR, out_csv)
 print("Saved", out_csv)
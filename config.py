@@ -36,11 +36,38 @@ QGIS_RESEARCH_SUBPATH = os.environ.get(
 QGIS_DATA_ROOT = DRIVE_ROOT / QGIS_RESEARCH_SUBPATH / "data"
 QGIS_FIGS_ROOT = DRIVE_ROOT / QGIS_RESEARCH_SUBPATH / "figs"
 
+# Local OpenStreetMap extract (.osm.pbf). If set, streets and buildings are read
+# from this file instead of being downloaded from the Overpass API
+OSM_PBF_FILE = os.environ.get("CITYFORM_OSM_PBF_FILE")
+if OSM_PBF_FILE:
+    OSM_PBF_FILE = Path(OSM_PBF_FILE)
+
+# Disk cache for OpenStreetMap data (street graphs and buildings)
+OSM_CACHE_DIR = Path(os.environ.get("CITYFORM_OSM_CACHE_DIR", DATA_ROOT / "osm_cache"))
+
+# Web services. Point them to a local replay server (see layers/replay.py) to
+# run without network access
+OVERPASS_URL = os.environ.get("CITYFORM_OVERPASS_URL", "https://overpass-api.de/api")
+NOMINATIM_URL = os.environ.get(
+    "CITYFORM_NOMINATIM_URL", "https://nominatim.openstreetmap.org"
+)
+# Requests per second to the web services (None: no limit), and retries of
+# the requests that fail with 429/5xx or a connection error
+OVERPASS_RATE_LIMIT = 1.0
+NOMINATIM_RATE_LIMIT = 1.0  # usage policy of nominatim.openstreetmap.org
+HTTP_MAX_RETRIES = 5
+# Recorded responses of the replay server
+REPLAY_DIR = Path(os.environ.get("CITYFORM_REPLAY_DIR", DATA_ROOT / "replay"))
+# city_id and admin_level of every city (query_data.csv is imported once)
+QUERY_DATA_DB = DATA_ROOT / "query_data.sqlite"
+
 # Specific data subdirectories (for convenience)
 BOUNDARIES_DIR = DATA_ROOT / "0_boundaries"
 BUILDINGS_STREETS_DIR = DATA_ROOT / "1_buildings_streets"
 MORPHOMETRICS_DIR = DATA_ROOT / "2_morphometrics"
+CHECKPOINTS_DIR = MORPHOMETRICS_DIR / "checkpoints"
 CSV_DIR = DATA_ROOT / "4_csv"
+PARTITIONS_DIR = CSV_DIR / "partitions"
 
 # ============================================================================
 # Runtime Configuration
@@ -57,7 +84,38 @@ STREETS = True
 BUILDINGS = True
 MORPHOMETRICS = True
 FULL_VARIABLES = True
+# Calculate only these variables, e.g. "fractal-dimension,avg_street_length"
+# (see python run.py variables). None calculates the basic or full list.
+VARIABLES = os.environ.get("CITYFORM_VARIABLES")
+VARIABLES = (
+    [v.strip() for v in VARIABLES.split(",") if v.strip()] if VARIABLES else None
+)
 CSV_OUT = False  # concatenate all morphometrics files into one CSV
+BOUNDARIES_WORKERS = 2  # concurrent Overpass requests to find the admin_level
+BOUNDARIES_BATCH_SIZE = 20  # cities per Overpass query with a known admin_level
+OUTPUT_FORMAT = "gpkg"  # "gpkg" or "parquet" (GeoParquet, requires pyarrow)
+CHECKPOINTS = True  # save every finished polygon, so that crashed runs can resume
+TIMINGS = True  # save the time of every stage to "[city] - timings.jsonl"
+WORKERS = 1  # number of processes used to calculate morphometrics per polygon
+CITY_GRAPH = True  # download the street graph once per city and clip it per polygon
+CITY_BUILDINGS = True  # download the buildings once per city and split them per polygon
+BUILDINGS_PARTITION = "intersects"  # "intersects" or "centroid"
+# Centrality: None (exact), number of sampled nodes, or error budget < 1
+CENTRALITY_SAMPLES = None
+CENTRALITY_SEED = 0  # random seed of the sampled nodes
+DIAMETER_MAX_BFS = None  # None (exact) or maximum number of BFS for the diameter
+CONNECTIVITY_TIME_BUDGET = None  # seconds per polygon, None for no limit (exact)
+FRACTAL_RESOLUTION = 924  # pixels on the longest side of the fractal dimension raster
+# Tessellation in tiles that fit in this memory (bytes), None for one piece
+TESSELLATION_MAX_MEMORY = None
+TESSELLATION_WORKERS = 1  # processes tessellating the tiles of a polygon
+# OpenStreetMap cache
+OSM_CACHE = True  # cache downloaded graphs and buildings on disk
+OSM_CACHE_MAX_SIZE = 20 * 1024**3  # bytes, least recently used entries are evicted
+OSM_CACHE_TTL = 30  # days before a cached download is refreshed (None: never)
+# Query Overpass for the data as of this date, e.g. "2024-01-01T00:00:00Z".
+# Cached entries of a snapshot never expire, so runs can be reproduced.
+OSM_SNAPSHOT_DATE = None
 # LOG_LEVEL = "INFO"
 LOG_LEVEL = "DEBUG"
 
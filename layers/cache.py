@@ -0,0 +1,113 @@
+"""
+Disk cache for OpenStreetMap data
+
+Street graphs and features are saved by a hash of the request: polygon WKB,
+query parameters (tags, network_type, simplify flags...), data source and OSM
+snapshot date. Entries are compressed pickles. The least recently used entries
+are evicted when the cache grows over config.OSM_CACHE_MAX_SIZE.
+"""
+
+import gzip
+import hashlib
+import json
+import logging
+import os
+import pickle
+import time
+from pathlib import Path
+
+import config
+from layers.files import atomic_write
+
+logger = logging.getLogger("log")
+
+SUFFIX = ".pkl.gz"
+
+
+def get_key(kind, polygon, source, **params):
+    """Get the cache key of a request."""
+    h = hashlib.sha256()
+    h.update(kind.encode())
+    h.update(polygon.wkb)
+    h.update(json.dumps(params, sort_keys=True, default=str).encode())
+    h.update(str(source).encode())
+    h.update(str(config.OSM_SNAPSHOT_DATE).encode())
+    return h.hexdigest()
+
+
+def get_path(key):
+    """Get the file of a cache entry."""
+    return Path(config.OSM_CACHE_DIR) / key[:2] / (key + SUFFIX)
+
+
+def is_expired(path):
+    """Check if a cache entry is older than the cache TTL.
+
+    Entries never expire when the data is pinned to an OSM snapshot date.
+    """
+    if config.OSM_SNAPSHOT_DATE or config.OSM_CACHE_TTL is None:
+        return False
+    age = time.time() - path.stat().st_mtime
+    return age > config.OSM_CACHE_TTL * 24 * 3600
+
+
+def load(key):
+    """Load a cache entry. Returns None if it is missing or expired."""
+    path = get_path(key)
+    try:
+        if is_expired(path):
+            logger.debug("Cache: expired %s", key)
+            return None
+        with gzip.open(path, "rb") as f:
+            value = pickle.load(f)
+        # Access time is used to evict the least recently used entries,
+        # modification time is the time the entry was saved
+        os.utime(path, (time.time(), path.stat().st_mtime))
+    except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+        return None
+    return value
+
+
+def save(key, value):
+    """Save a cache entry atomically, so it can be shared by parallel workers."""
+    path = get_path(key)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with atomic_write(path, "wb") as f, gzip.GzipFile(fileobj=f, mode="wb") as gz:
+        pickle.dump(value, gz, protocol=pickle.HIGHEST_PROTOCOL)
+    evict(config.OSM_CACHE_MAX_SIZE)
+
+
+def evict(max_size):
+    """Remove the least recently used entries until the cache fits max_size bytes."""
+    files = []
+    for path in Path(config.OSM_CACHE_DIR).glob("*/*" + SUFFIX):
+        try:
+            stat = path.stat()
+        except FileNotFoundError:  # removed by another process
+            continue
+        files.append((stat.st_atime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+        if total <= max_size:
+            break
+        path.unlink(missing_ok=True)
+        total -= size
+        logger.debug("Cache: evicted %s", path.name)
+
+
+def cached(kind, fetch, polygon, source, **params):
+    """Return fetch(polygon, **params), using the cache when it is enabled."""
+    if not config.OSM_CACHE:
+        return fetch(polygon, **params)
+
+    key = get_key(kind, polygon, source, **params)
+    value = load(key)
+    if value is not None:
+        logger.debug("Cache: loaded %s %s", kind, key)
+        return value
+
+    value = fetch(polygon, **params)
+    save(key, value)
+    logger.debug("Cache: saved %s %s", kind, key)
+    return value
@@ -0,0 +1,74 @@
+"""
+Checkpoints of the morphometrics of a city
+
+The values of every finished polygon are saved to a JSON file in a per-city
+directory, so that a run that crashes can resume where it stopped. The
+parameters of the run are saved next to them: checkpoints made with other
+parameters are discarded.
+"""
+
+import json
+import logging
+import shutil
+from pathlib import Path
+
+from layers.files import atomic_write, to_json
+
+logger = logging.getLogger("log")
+
+PARAMS_FILE = "params.json"
+
+
+def _write(path, data):
+    """Write data to a JSON file atomically."""
+    with atomic_write(path) as f:
+        json.dump(data, f, default=to_json)
+
+
+def get_path(directory, index):
+    """Get the checkpoint file of a polygon."""
+    return Path(directory) / f"{index}.json"
+
+
+def open_checkpoints(directory, params):
+    """Load the checkpoints saved with the same parameters.
+
+    Returns the values by polygon index. Checkpoints made with other parameters
+    are removed.
+    """
+    directory = Path(directory)
+    params = json.loads(json.dumps(params, default=to_json))
+    params_file = directory / PARAMS_FILE
+    if params_file.exists():
+        with open(params_file, encoding="utf-8") as f:
+            saved = json.load(f)
+        if saved != params:
+            logger.info("Checkpoints: parameters changed, starting over.")
+            clear(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    _write(params_file, params)
+
+    results = {}
+    for path in directory.glob("*.json"):
+        if path.name == PARAMS_FILE:
+            continue
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+        except json.JSONDecodeError:
+            logger.warning("Checkpoints: skipping unreadable %s", path.name)
+            continue
+        results[data["index"]] = data["values"]
+    if results:
+        logger.info("Checkpoints: %s polygons done in %s", len(results), directory)
+    return results
+
+
+def save(directory, index, values):
+    """Save the values of a polygon."""
+    _write(get_path(directory, index), {"index": index, "values": values})
+
+
+def clear(directory):
+    """Remove the checkpoints of a city."""
+    shutil.rmtree(directory, ignore_errors=True)
@@ -0,0 +1,283 @@
+"""
+Shared HTTP client of the web services (Overpass and Nominatim)
+
+One requests.Session per process keeps the connections alive. Every request
+to a service first takes a token from the rate limiter of the service (a
+token bucket), and 429/5xx answers and connection errors are retried with
+exponential backoff and full jitter, honouring Retry-After. When Overpass
+answers 429, the wait is taken from its /status endpoint.
+
+The boundaries queries and the geolocation of cities (through a geopy adapter)
+go through the client. The downloads of osmnx take their tokens from the same
+rate limiters and are retried by the client, through the auth and hooks of
+ox.settings.requests_kwargs (see route_osmnx).
+"""
+
+import email.utils
+import logging
+import random
+import re
+import threading
+import time
+from functools import lru_cache
+from urllib.parse import urlsplit
+
+import osmnx as ox
+import requests
+from geopy.adapters import RequestsAdapter
+from geopy.geocoders import Nominatim
+from requests.adapters import HTTPAdapter
+from requests.auth import AuthBase
+
+import config
+
+logger = logging.getLogger("log")
+
+USER_AGENT = "cityform/0.1"
+
+# Answers worth retrying
+RETRY_STATUS = {429, 502, 503, 504}
+
+# Backoff of the retries: a random wait up to BACKOFF_BASE * 2^attempt seconds,
+# at most BACKOFF_MAX
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+
+# Requests the rate limiter lets through at once (Overpass has 2 slots per IP)
+BURSTS = {"overpass": 2, "nominatim": 1}
+
+
+class TokenBucket:
+    """Rate limiter letting rate requests per second through, burst at once."""
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Wait for a token. Returns the time waited, in seconds."""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.burst, self.tokens + (now - self.updated) * self.rate
+            )
+            self.updated = now
+            # the token is reserved now, so that waiting threads queue up
+            self.tokens -= 1
+            wait = max(0.0, -self.tokens / self.rate)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+def get_backoff(attempt, base=BACKOFF_BASE, cap=BACKOFF_MAX):
+    """Get the wait before a retry: exponential backoff with full jitter."""
+    return random.uniform(0, min(cap, base * 2**attempt))
+
+
+def parse_retry_after(value):
+    """Get the seconds of a Retry-After header, None if there is none."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, date.timestamp() - time.time())
+
+
+def parse_overpass_status(text):
+    """Get the seconds until a slot of Overpass is free, from its /status.
+
+    Returns 0 if a slot is available now, None if the status is not known.
+    """
+    if re.search(r"^\d+ slots? available now", text, re.MULTILINE):
+        return 0.0
+    waits = [
+        float(s)
+        for s in re.findall(r"Slot available after: \S+ in (\d+) seconds", text)
+    ]
+    return min(waits) if waits else None
+
+
+def get_service(url):
+    """Get the service of a URL: "overpass", "nominatim" or None."""
+    for service, base_url in [
+        ("overpass", config.OVERPASS_URL),
+        ("nominatim", config.NOMINATIM_URL),
+    ]:
+        if url.startswith(base_url.rstrip("/")):
+            return service
+    return None
+
+
+class Client:
+    """HTTP client with keep-alive connections, rate limits and retries."""
+
+    def __init__(self, rates, max_retries=5, pool_size=10):
+        self.session = requests.Session()
+        self.session.headers["User-Agent"] = USER_AGENT
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.buckets = {
+            service: TokenBucket(rate, BURSTS.get(service, 1))
+            for service, rate in rates.items()
+            if rate
+        }
+        self.max_retries = max_retries
+
+    def acquire(self, url):
+        """Wait for a token of the service of url."""
+        # the Overpass status is free, it is not rate limited
+        if url.endswith("/status"):
+            return
+        bucket = self.buckets.get(get_service(url))
+        if bucket is not None:
+            bucket.acquire()
+
+    def get_wait(self, response, attempt):
+        """Get the seconds to wait before retrying a response."""
+        wait = max(
+            get_backoff(attempt),
+            parse_retry_after(response.headers.get("Retry-After")) or 0,
+        )
+        if get_service(response.url) == "overpass" and response.status_code == 429:
+            wait = max(wait, self.get_overpass_wait())
+        logger.debug(
+            "HTTP: %s answered %s, retrying in %.1f s.",
+            response.url,
+            response.status_code,
+            wait,
+        )
+        return wait
+
+    def request(self, method, url, attempt=0, **kwargs):
+        """Send a request like requests.request.
+
+        Returns the last response once it succeeds or the retries run out.
+        attempt is the number of attempts already made.
+        """
+        while True:
+            self.acquire(url)
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt >= self.max_retries:
+                    raise
+                wait = get_backoff(attempt)
+                logger.debug("HTTP: %s failed (%s), retrying in %.1f s.", url, e, wait)
+            else:
+                if (
+                    response.status_code not in RETRY_STATUS
+                    or attempt >= self.max_retries
+                ):
+                    return response
+                wait = self.get_wait(response, attempt)
+            time.sleep(wait)
+            attempt += 1
+
+    def retry(self, response, **kwargs):
+        """Response hook retrying the answers of another session with the client.
+
+        kwargs are the arguments of the send, of which only timeout is kept.
+        """
+        if response.status_code not in RETRY_STATUS or self.max_retries == 0:
+            return response
+        time.sleep(self.get_wait(response, 0))
+        request = response.request
+        return self.request(
+            request.method,
+            request.url,
+            attempt=1,
+            data=request.body,
+            headers=request.headers,
+            timeout=kwargs.get("timeout"),
+        )
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def get_overpass_wait(self):
+        """Get the seconds until a slot of Overpass is free, 0 if not known."""
+        try:
+            response = self.session.get(
+                config.OVERPASS_URL.rstrip("/") + "/status", timeout=10
+            )
+        except requests.RequestException:
+            return 0.0
+        return parse_overpass_status(response.text) or 0.0
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Get the client of this process."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = Client(
+                {
+                    "overpass": config.OVERPASS_RATE_LIMIT,
+                    "nominatim": config.NOMINATIM_RATE_LIMIT,
+                },
+                max_retries=config.HTTP_MAX_RETRIES,
+            )
+        return _client
+
+
+class ClientAdapter(RequestsAdapter):
+    """geopy adapter sending the requests of a geocoder through the client."""
+
+    def __init__(self, *, proxies, ssl_context):
+        super().__init__(proxies=proxies, ssl_context=ssl_context)
+        self.session.close()
+        self.session = get_client()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass  # the client is shared
+
+    def __del__(self):
+        pass
+
+
+@lru_cache(maxsize=None)
+def get_geocoder(nominatim_url):
+    """Get a Nominatim geocoder of nominatim_url using the client."""
+    url = urlsplit(nominatim_url)
+    return Nominatim(
+        user_agent="get-city-id",
+        domain=url.netloc + url.path.rstrip("/"),
+        scheme=url.scheme,
+        adapter_factory=ClientAdapter,
+    )
+
+
+class ClientAuth(AuthBase):
+    """Requests auth taking a token of the client before every request.
+
+    Its responses are retried by the client.
+    """
+
+    def __call__(self, request):
+        client = get_client()
+        client.acquire(request.url)
+        request.register_hook("response", client.retry)
+        return request
+
+
+def route_osmnx():
+    """Rate limit and retry the Overpass and Nominatim requests of osmnx."""
+    ox.settings.requests_kwargs = {**ox.settings.requests_kwargs, "auth": ClientAuth()}
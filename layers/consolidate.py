@@ -0,0 +1,146 @@
+"""
+Consolidation of the morphometrics of all cities into one CSV
+
+The attributes of every morphometrics file are kept in one partition per city,
+and a manifest records the size and modification time of the file each
+partition was read from. A refresh only reads the cities whose file is new or
+changed, without the geometry, removes the cities whose file is gone, and
+writes the CSV from the partitions in a single concatenation. The CSV is only
+written again when the manifest differs from the one it was written from.
+"""
+
+import hashlib
+import json
+import logging
+from pathlib import Path
+
+import pandas as pd
+
+from layers import storage
+from layers.files import atomic_write
+
+logger = logging.getLogger("log")
+
+MANIFEST_FILE = "manifest.json"
+
+# Record of the manifest and the file of the last CSV written
+CSV_RECORD_FILE = "csv.json"
+
+
+def get_signature(path):
+    """Get the file name, size and modification time of a file."""
+    stat = Path(path).stat()
+    return {"file": Path(path).name, "size": stat.st_size, "mtime": stat.st_mtime_ns}
+
+
+def get_partition_path(directory, city):
+    """Get the partition of a city."""
+    return Path(directory) / f"{city}.csv"
+
+
+def load_manifest(directory):
+    """Load the manifest of the partitions, empty if there is none."""
+    manifest_file = Path(directory) / MANIFEST_FILE
+    if not manifest_file.exists():
+        return {}
+    with open(manifest_file, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_manifest(directory, manifest):
+    """Save the manifest of the partitions."""
+    with atomic_write(Path(directory) / MANIFEST_FILE) as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+
+
+def get_manifest_hash(manifest):
+    """Get a hash of the manifest, which identifies the partitions of a CSV."""
+    data = json.dumps(manifest, sort_keys=True).encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+def get_csv_record(out_csv, manifest):
+    """Get the record of out_csv written from the partitions of manifest."""
+    return {
+        "path": str(Path(out_csv).resolve()),
+        "manifest": get_manifest_hash(manifest),
+        **get_signature(out_csv),
+    }
+
+
+def is_up_to_date(partitions_dir, out_csv, manifest):
+    """Check whether out_csv was written from the partitions of manifest.
+
+    The CSV must also be the same file that was written (not edited, replaced
+    or removed since).
+    """
+    record_file = Path(partitions_dir) / CSV_RECORD_FILE
+    if not Path(out_csv).exists() or not record_file.exists():
+        return False
+    with open(record_file, encoding="utf-8") as f:
+        record = json.load(f)
+    return record == get_csv_record(out_csv, manifest)
+
+
+def update_partitions(morpho_dir, partitions_dir):
+    """Update the partitions of the cities whose morphometrics changed.
+
+    Returns the manifest and the lists of changed and removed cities.
+    """
+    partitions_dir = Path(partitions_dir)
+    partitions_dir.mkdir(parents=True, exist_ok=True)
+    manifest = load_manifest(partitions_dir)
+    files = storage.glob(morpho_dir, " - morpho")
+
+    changed = []
+    for city, path in files.items():
+        signature = get_signature(path)
+        partition = get_partition_path(partitions_dir, city)
+        if manifest.get(city) == signature and partition.exists():
+            continue
+        df = storage.read_attributes(path)
+        df["city"] = city
+        with atomic_write(partition) as f:
+            df.to_csv(f, index=None)
+        manifest[city] = signature
+        changed.append(city)
+
+    removed = [city for city in manifest if city not in files]
+    for city in removed:
+        get_partition_path(partitions_dir, city).unlink(missing_ok=True)
+        del manifest[city]
+
+    if changed or removed:
+        save_manifest(partitions_dir, manifest)
+    return manifest, changed, removed
+
+
+def consolidate(morpho_dir, partitions_dir, out_csv):
+    """Write the morphometrics of all cities to out_csv.
+
+    Only the cities that changed since the last call are read again.
+    """
+    out_csv = Path(out_csv)
+    manifest, changed, removed = update_partitions(morpho_dir, partitions_dir)
+    logger.info(
+        "CSV: %s cities, %s updated, %s removed.",
+        len(manifest),
+        len(changed),
+        len(removed),
+    )
+    if is_up_to_date(partitions_dir, out_csv, manifest):
+        logger.info("CSV: %s is up to date.", out_csv)
+        return out_csv
+
+    frames = [
+        pd.read_csv(get_partition_path(partitions_dir, city))
+        for city in sorted(manifest)
+    ]
+    df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+    out_csv.parent.mkdir(parents=True, exist_ok=True)
+    with atomic_write(out_csv) as f:
+        df.to_csv(f, index=None)
+    with atomic_write(Path(partitions_dir) / CSV_RECORD_FILE) as f:
+        json.dump(get_csv_record(out_csv, manifest), f, indent=1)
+    logger.info("CSV: Saved %s", out_csv)
+    return out_csv
@@ -0,0 +1,40 @@
+"""
+Writing files safely
+
+Files shared by parallel workers or read by a later run (cache entries,
+checkpoints, partitions, fixtures) are written to a temporary file that then
+replaces them, so that a crash never leaves a partial file behind.
+"""
+
+import os
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+
+
+@contextmanager
+def atomic_write(path, mode="w"):
+    """Open a temporary file that replaces path when the block ends.
+
+    Text is written as UTF-8, without translating newlines. If the block
+    raises, path is left as it was.
+    """
+    path = Path(path)
+    text = {} if "b" in mode else {"encoding": "utf-8", "newline": ""}
+    fd, tmp_file = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, mode, **text) as f:
+            yield f
+        os.replace(tmp_file, path)
+    except BaseException:
+        os.remove(tmp_file)
+        raise
+
+
+def to_json(value):
+    """Convert numpy scalars to Python values, as the default of json.dump."""
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
@@ -7,7 +7,7 @@ import logging
 import sys
 from pathlib import Path
 
-from geopy.geocoders import Nominatim
+from layers.client import get_geocoder
 
 # warnings.filterwarnings("ignore")
 
@@ -45,10 +45,11 @@ def load_cities_from_file(filename):
     return cities
 
 
-def get_city_id(city_name):
+def get_city_id(city_name, nominatim_url="https://nominatim.openstreetmap.org"):
     """Get the city ID from the city name"""
-    geolocator = Nominatim(user_agent="get-city-id")
-    geo_results = geolocator.geocode(city_name, exactly_one=False, limit=3)
+    geo_results = get_geocoder(nominatim_url).geocode(
+        city_name, exactly_one=False, limit=3
+    )
     if not geo_results:
         raise ValueError(f"Could not geolocate city: {city_name}")
 
@@ -69,6 +70,9 @@ def get_city_id(city_name):
 
 HELP_MESSAGE = """
 Usage: python run.py [cities.txt] [start] city1 city2 city3 ...
+       python run.py boundaries
+       python run.py variables
+       python run.py timings
 
 Arguments:
 cities.txt: A text file containing a list of cities.
@@ -99,6 +103,14 @@ def parse_input(argv: list[str]) -> list[str]:
         logger.debug("Boundaries argument provided.")
         city_list = None
 
+    elif argv[1] == "variables":
+        logger.debug("Variables argument provided.")
+        city_list = None
+
+    elif argv[1] == "timings":
+        logger.debug("Timings argument provided.")
+        city_list = None
+
     # If first argument is a file, load cities from file
     elif Path(argv[1]).suffix == ".txt":
         if Path(argv[1]).is_file():
@@ -8,14 +8,19 @@ import time
 
 import geopandas as gpd
 import osmnx as ox
-import pandas as pd
 
 import config
+from layers import checkpoint, sources, storage, telemetry
+from layers.consolidate import consolidate
 from layers.helpers import find_next_city, format_time
 from layers.morpho import get_morphometrics
+from layers.morpho.helpers import BUILDING_GEOMETRIES
 
 logger = logging.getLogger("log")
 
+# Tags of the saved buildings
+BUILDING_COLUMNS = ["name", "height"]
+
 
 def get_polygons(city):
     """Get polygons from city."""
@@ -44,30 +49,94 @@ def get_polygons(city):
     return gdf, gdf_collapsed
 
 
-def get_buildings(gdf_collapsed):
-    """Get buildings from city."""
+def download_buildings(gdf_collapsed):
+    """Download the footprints of all buildings of the city.
+
+    Only the tags of BUILDING_COLUMNS and the geometries of BUILDING_GEOMETRIES
+    are kept.
+    """
     tags = {"building": True}
     logger.info("Buildings:  Downloading all buildings.")
-    buildings = ox.features_from_polygon(gdf_collapsed["geometry"][0], tags)
-    buildings = buildings[["geometry", "name"]]
-    buildings_save = buildings.drop(labels="node", axis=0, level=0)
+    buildings = sources.features_from_polygon(
+        gdf_collapsed["geometry"][0],
+        tags,
+        columns=BUILDING_COLUMNS,
+        geom_types=BUILDING_GEOMETRIES,
+    )
+    return buildings
+
 
-    # Keep only polygons
-    is_polygon_mask = buildings_save["geometry"].apply(
-        lambda geom: geom.geom_type == "Polygon"
+def keep_polygons(buildings):
+    """Keep the buildings with a geometry of BUILDING_GEOMETRIES."""
+    return buildings[buildings.geom_type.isin(BUILDING_GEOMETRIES)]
+
+
+def get_city_buildings(city, gdf_collapsed, download=True, output_format="gpkg"):
+    """Get the buildings of the whole city for the morphometrics.
+
+    If download is False, the buildings saved by a previous run are loaded when
+    they exist, in either output format.
+    """
+    buildings_file = storage.find(
+        config.BUILDINGS_STREETS_DIR, city + " - Buildings", output_format
     )
-    buildings_save = buildings_save[is_polygon_mask]
+    if not download and buildings_file is not None:
+        logger.info("Buildings:  Loading %s", buildings_file)
+        return keep_polygons(storage.read(buildings_file, columns=["height"]))
 
-    return buildings_save
+    return keep_polygons(download_buildings(gdf_collapsed))
 
 
-def get_streets(gdf_collapsed):
-    """Get streets from city."""
-    # Get Streets
+def get_buildings(gdf_collapsed, buildings=None):
+    """Get buildings from city."""
+    if buildings is None:
+        buildings = download_buildings(gdf_collapsed)
+    # Height is kept so that saved buildings can be reused for the morphometrics
+    columns = [col for col in ["geometry", "name", "height"] if col in buildings]
+    buildings = buildings[columns]
+    buildings_save = buildings.drop(labels="node", axis=0, level=0, errors="ignore")
+
+    # Keep the same polygons as the morphometrics, so that they can be reloaded
+    return keep_polygons(buildings_save)
+
+
+def download_city_graph(gdf_collapsed):
+    """Download the street graph of the whole city."""
     logger.info("Streets:    Downloading all streets.")
-    graph = ox.graph_from_polygon(
-        gdf_collapsed["geometry"][0], network_type="drive", retain_all=True
+    # truncate_by_edge keeps the streets that cross the city boundary so that
+    # polygon graphs can be clipped from the city graph (see clip_graph)
+    graph = sources.graph_from_polygon(
+        gdf_collapsed["geometry"][0],
+        network_type="drive",
+        retain_all=True,
+        truncate_by_edge=True,
     )
+    return graph
+
+
+def get_city_graph(city, gdf_collapsed, download=True, save=True):
+    """Get the street graph of the whole city.
+
+    If download is False, the graph saved by a previous run is loaded when it
+    exists.
+    """
+    graph_file = config.BUILDINGS_STREETS_DIR / (city + " - Streets.graphml")
+    if not download and graph_file.exists():
+        logger.info("Streets:    Loading %s", graph_file)
+        return ox.load_graphml(graph_file)
+
+    graph = download_city_graph(gdf_collapsed)
+    if save:
+        ox.save_graphml(graph, graph_file)
+        logger.info("Streets:    Saved %s", graph_file)
+    return graph
+
+
+def get_streets(gdf_collapsed, graph=None):
+    """Get streets from city."""
+    # Get Streets
+    if graph is None:
+        graph = download_city_graph(gdf_collapsed)
 
     # Remove nodes to export to geopackage
     gdf_streets = ox.utils_graph.graph_to_gdfs(graph, nodes=False)
@@ -80,44 +149,116 @@ def get_streets(gdf_collapsed):
 
 
 def get_city_layers(
-    city, buildings=True, streets=True, morphometrics=True, save=True, full=True
+    city,
+    buildings=True,
+    streets=True,
+    morphometrics=True,
+    save=True,
+    full=True,
+    workers=1,
+    city_graph=True,
+    city_buildings=True,
+    partition="intersects",
+    centrality_samples=None,
+    centrality_seed=None,
+    diameter_max_bfs=None,
+    connectivity_budget=None,
+    fractal_resolution=None,
+    tessellation_memory=None,
+    tessellation_workers=1,
+    checkpoints=True,
+    variables=None,
+    output_format="gpkg",
 ):
-    """Get city layers."""
+    """Get city layers.
+
+    With city_graph, the street graph is downloaded once for the whole city and
+    reused for the morphometrics of every polygon. The same goes for the
+    buildings with city_buildings.
+
+    With checkpoints, the morphometrics of every finished polygon are saved, so
+    that a crashed run resumes where it stopped. They are removed once the
+    morphometrics file is saved.
+
+    Streets, buildings and morphometrics are saved in output_format, "gpkg"
+    (GeoPackage) or "parquet" (GeoParquet).
+    """
     logger.info("-----------------------------------------------------------------")
     logger.info("City:       %s", city)
     start = time.perf_counter()
 
-    gdf, gdf_collapsed = get_polygons(city)
+    with telemetry.stage("polygons"):
+        gdf, gdf_collapsed = get_polygons(city)
+
+    graph = None
+    if streets or (morphometrics and city_graph):
+        with telemetry.stage("city_graph"):
+            graph = get_city_graph(city, gdf_collapsed, download=streets, save=save)
 
     if streets:
-        gdf_streets = get_streets(gdf_collapsed)
+        with telemetry.stage("streets"):
+            gdf_streets = get_streets(gdf_collapsed, graph)
         if save:
-            out_file = config.BUILDINGS_STREETS_DIR / (city + " - Streets.gpkg")
-            if out_file.exists():
-                out_file.unlink()
-            gdf_streets.to_file(out_file, driver="GPKG")
+            out_file = storage.get_path(
+                config.BUILDINGS_STREETS_DIR, city + " - Streets", output_format
+            )
+            with telemetry.stage("save_streets"):
+                storage.write(gdf_streets, out_file)
             logger.info("Streets:    Saved %s", out_file)
     else:
         logger.info("Streets:    Skipped.")
 
+    all_buildings = None
+    if buildings or (morphometrics and city_buildings):
+        with telemetry.stage("city_buildings"):
+            all_buildings = get_city_buildings(
+                city, gdf_collapsed, download=buildings, output_format=output_format
+            )
+
     if buildings:
-        gdf_buildings = get_buildings(gdf_collapsed)
+        gdf_buildings = get_buildings(gdf_collapsed, all_buildings)
         if save:
             # Save
-            out_file = config.BUILDINGS_STREETS_DIR / (city + " - Buildings.gpkg")
-            if out_file.exists():
-                out_file.unlink()
-            gdf_buildings.to_file(out_file, driver="GPKG")
+            out_file = storage.get_path(
+                config.BUILDINGS_STREETS_DIR, city + " - Buildings", output_format
+            )
+            with telemetry.stage("save_buildings"):
+                storage.write(gdf_buildings, out_file)
             logger.info("Buildings:  Saved %s", out_file)
     else:
         logger.info("Buildings:  Skipped.")
 
     if morphometrics:
-        gdf = get_morphometrics(gdf, full=full)
+        checkpoint_dir = None
+        if checkpoints and save:
+            checkpoint_dir = config.CHECKPOINTS_DIR / city
+        with telemetry.stage("morphometrics"):
+            gdf = get_morphometrics(
+                gdf,
+                full=full,
+                workers=workers,
+                city_graph=graph if city_graph else None,
+                city_buildings=all_buildings if city_buildings else None,
+                partition=partition,
+                centrality_samples=centrality_samples,
+                centrality_seed=centrality_seed,
+                diameter_max_bfs=diameter_max_bfs,
+                connectivity_budget=connectivity_budget,
+                fractal_resolution=fractal_resolution,
+                tessellation_memory=tessellation_memory,
+                tessellation_workers=tessellation_workers,
+                checkpoint_dir=checkpoint_dir,
+                variables=variables,
+            )
         if save:
-            out_file = config.MORPHOMETRICS_DIR / (city + " - morpho.gpkg")
-            gdf.to_file(out_file, driver="GPKG")
+            out_file = storage.get_path(
+                config.MORPHOMETRICS_DIR, city + " - morpho", output_format
+            )
+            with telemetry.stage("save_morphometrics"):
+                storage.write(gdf, out_file)
             logger.info("Morphometrics: Saved %s", out_file)
+        if checkpoint_dir is not None:
+            checkpoint.clear(checkpoint_dir)
     else:
         logger.info("Morphometrics: Skipped.")
 
@@ -126,42 +267,77 @@ def get_city_layers(
 
 
 def main(
-    city_list, buildings=True, streets=True, morphometrics=True, full=True, csv_out=True
+    city_list,
+    buildings=True,
+    streets=True,
+    morphometrics=True,
+    full=True,
+    csv_out=True,
+    workers=1,
+    city_graph=True,
+    city_buildings=True,
+    partition="intersects",
+    centrality_samples=None,
+    centrality_seed=None,
+    diameter_max_bfs=None,
+    connectivity_budget=None,
+    fractal_resolution=None,
+    tessellation_memory=None,
+    tessellation_workers=1,
+    checkpoints=True,
+    variables=None,
+    output_format="gpkg",
+    timings=True,
 ):
-    """Entrypoint."""
+    """Entrypoint.
+
+    With timings, the time of every stage of each city and polygon is saved to
+    "{city} - timings.jsonl" in the morphometrics folder.
+    """
     for city in city_list:
-        try:
-            get_city_layers(
-                city, buildings, streets, morphometrics, full=full, save=True
+        with telemetry.recording(city=city) as recorder:
+            try:
+                with telemetry.stage("city"):
+                    get_city_layers(
+                        city,
+                        buildings,
+                        streets,
+                        morphometrics,
+                        full=full,
+                        save=True,
+                        workers=workers,
+                        city_graph=city_graph,
+                        city_buildings=city_buildings,
+                        partition=partition,
+                        centrality_samples=centrality_samples,
+                        centrality_seed=centrality_seed,
+                        diameter_max_bfs=diameter_max_bfs,
+                        connectivity_budget=connectivity_budget,
+                        fractal_resolution=fractal_resolution,
+                        tessellation_memory=tessellation_memory,
+                        tessellation_workers=tessellation_workers,
+                        checkpoints=checkpoints,
+                        variables=variables,
+                        output_format=output_format,
+                    )
+            except Exception as e:
+                # logger.exception adds traceback and nice error format
+                logger.exception(e)
+                logger.error("Error processing city %s. Skipping.", city)
+        if timings:
+            telemetry.save(
+                telemetry.get_path(config.MORPHOMETRICS_DIR, city),
+                recorder.get_records(),
             )
-        except Exception as e:
-            logger.exception(e)  # logger.exception adds traceback and nice error format
-            logger.error("Error processing city %s. Skipping.", city)
-            continue
 
     next_city = find_next_city(city_list, city)
     if next_city:
         logger.info("Next: %s", next_city)
 
     if csv_out:
-        # Concatenate all files in the 2_morphometrics folder
-        morpho_folder = config.MORPHOMETRICS_DIR
-        csv_folder = config.CSV_DIR
-        out_csv = csv_folder / "Morphometrics.csv"
-        df = pd.read_csv(out_csv)
-
-        if df["city"].nunique() > len(city_list):
-            logger.info("CSV exists and has more cities. Skipping.")
-            return
-
-        df_full = pd.DataFrame()
-        for file in morpho_folder.iterdir():
-            if " - morpho.gpkg" in file.name:
-                city_name = file.stem.split(" - morpho")[0].strip()
-                gdf = gpd.read_file(file)
-                gdf["city"] = city_name
-                df_full = pd.concat([df_full, gdf])
-
-        # Save
-        df_full.to_csv(out_csv, index=None)
-        logger.info("CSV: Saved %s", out_csv)
+        # Consolidate the cities in the 2_morphometrics folder that changed
+        consolidate(
+            config.MORPHOMETRICS_DIR,
+            config.PARTITIONS_DIR,
+            config.CSV_DIR / "Morphometrics.csv",
+        )
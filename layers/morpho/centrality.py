@@ -0,0 +1,211 @@
+"""
+Centrality of the street network
+
+Betweenness, closeness (local and global) and straightness centrality all need
+the shortest paths from every node. They are computed together from a single
+Dijkstra sweep per source on a CSR matrix of the graph, with the same results
+as momepy: local closeness keeps the distances of the sweep within its radius
+(a quarter of the diameter in the metric graph).
+
+Only the measures asked for are computed: betweenness needs two triangular
+solves per source, and when local closeness is the only one the sweep stops at
+its radius.
+
+In the approximate mode the sweep is done from a random sample of source
+nodes: betweenness is estimated from the sampled pivots as in
+nx.betweenness_centrality, closeness and straightness by averaging the exact
+values of the sampled nodes.
+"""
+
+import logging
+import math
+import random
+
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.csgraph import dijkstra
+from scipy.sparse.linalg import spsolve_triangular
+
+logger = logging.getLogger("log")
+
+# Number of sources per Dijkstra call, bounds the memory of the distance matrix
+BATCH_SIZE = 256
+
+MEASURES = ["betweenness", "closeness_global", "closeness_local", "straightness"]
+
+
+def get_sample_size(n, samples=None):
+    """Get the number of sampled source nodes out of n.
+
+    samples is either None (exact), a number of nodes, or an error budget
+    epsilon < 1, which samples ceil(ln(n) / epsilon^2) nodes. Returns None when
+    the computation should be exact.
+    """
+    if samples is None:
+        return None
+    if isinstance(samples, float) and 0 < samples < 1:
+        k = math.ceil(math.log(max(n, 2)) / samples**2)
+    elif samples >= 1:
+        k = int(samples)
+    else:
+        raise ValueError(f"Invalid number of centrality samples: {samples}")
+    return k if k < n else None
+
+
+def sample_nodes(graph, k, seed=None):
+    """Get k random nodes of graph."""
+    return random.Random(seed).sample(list(graph.nodes), k)
+
+
+def to_csr(graph, weight="mm_len"):
+    """Convert an undirected graph to a symmetric CSR matrix of edge weights.
+
+    Parallel edges keep the smallest weight and self-loops are dropped, like
+    the shortest paths of networkx. Returns the nodes and the matrix.
+    """
+    nodes = list(graph.nodes)
+    position = {node: i for i, node in enumerate(nodes)}
+    edges = [
+        (position[u], position[v], w)
+        for u, v, w in graph.edges(data=weight, default=1)
+        if u != v
+    ]
+    if not edges:
+        return nodes, sp.csr_matrix((len(nodes), len(nodes)))
+    u, v, w = (np.array(x) for x in zip(*edges))
+    u, v, w = np.concatenate([u, v]), np.concatenate([v, u]), np.concatenate([w, w])
+
+    # keep the shortest of parallel edges
+    order = np.lexsort((w, v, u))
+    u, v, w = u[order], v[order], w[order]
+    first = np.ones(len(u), dtype=bool)
+    first[1:] = (u[1:] != u[:-1]) | (v[1:] != v[:-1])
+    matrix = sp.csr_matrix(
+        (w[first].astype(float), (u[first], v[first])), shape=(len(nodes), len(nodes))
+    )
+    return nodes, matrix
+
+
+def _get_order(distances):
+    """Get the nodes reached from a source, sorted by distance."""
+    reached = np.flatnonzero(np.isfinite(distances))
+    return reached[np.argsort(distances[reached], kind="stable")]
+
+
+def _dependencies(distances, order, u, v, w):
+    """Get the Brandes dependencies of a source.
+
+    Edges (u, v) on a shortest path from the source satisfy d(u) + w = d(v).
+    Sorted by distance (order), they form a triangular system for the number of
+    paths sigma and a second one for the dependencies delta.
+    """
+    position = np.full(len(distances), -1)
+    position[order] = np.arange(len(order))
+
+    tight = np.isfinite(distances[u]) & (distances[u] + w == distances[v])
+    tight &= position[u] < position[v]
+    n = len(order)
+    L = sp.csr_matrix(
+        (np.ones(tight.sum()), (position[v[tight]], position[u[tight]])),
+        shape=(n, n),
+    )
+    identity = sp.identity(n, format="csr")
+
+    # sigma(v) = sum of sigma(u) over the edges (u, v) on a shortest path
+    source = np.zeros(n)
+    source[0] = 1
+    sigma = spsolve_triangular(identity - L, source, lower=True)
+    # x = (1 + delta) / sigma, x(u) = 1 / sigma(u) + sum of x(v) over (u, v)
+    x = spsolve_triangular((identity - L.T).tocsr(), 1 / sigma, lower=False)
+    delta = sigma * x - 1
+    return delta
+
+
+def centrality(graph, radius=None, sources=None, weight="mm_len", measures=None):
+    """Get the centrality measures of graph from one shortest path sweep.
+
+    The nodes of graph are (x, y) coordinates, as in the primal graphs of
+    momepy.gdf_to_nx. sources are the nodes to run the sweep from, all nodes
+    by default. measures are the names of the measures to compute, all by
+    default.
+
+    Returns a dict of arrays:
+    - betweenness of every node: nx.betweenness_centrality with endpoints and
+      normalized, estimated from the sources if they are a sample.
+    - closeness_global, closeness_local (within radius) and straightness of
+      every source: momepy.closeness_centrality and
+      momepy.straightness_centrality.
+    """
+    measures = MEASURES if measures is None else measures
+    nodes, matrix = to_csr(graph, weight)
+    n = len(nodes)
+    position = {node: i for i, node in enumerate(nodes)}
+    if sources is None:
+        sources = np.arange(n)
+    else:
+        sources = np.array([position[node] for node in sources], dtype=int)
+    coordinates = np.array(nodes, dtype=float).reshape(n, -1)
+
+    coo = matrix.tocoo()
+    u, v, w = coo.row, coo.col, coo.data
+
+    betweenness = np.zeros(n)
+    closeness_global = np.zeros(len(sources))
+    closeness_local = np.zeros(len(sources))
+    straightness = np.zeros(len(sources))
+    # paths longer than radius are only needed by the other measures
+    limit = np.inf
+    if radius is not None and list(measures) == ["closeness_local"]:
+        limit = radius
+    for start in range(0, len(sources), BATCH_SIZE):
+        batch = sources[start : start + BATCH_SIZE]
+        distances = dijkstra(matrix, directed=True, indices=batch, limit=limit)
+        for i, (s, d) in enumerate(zip(batch, distances), start=start):
+            order = _get_order(d)
+            if "betweenness" in measures:
+                # Betweenness with endpoints
+                delta = _dependencies(d, order, u, v, w)
+                betweenness[s] += len(order) - 1
+                betweenness[order[1:]] += delta[1:] + 1
+
+            # Closeness, improved formula of Wasserman and Faust
+            reached = d[order[1:]]
+            if "closeness_global" in measures and reached.sum() > 0 and n > 1:
+                closeness_global[i] = len(reached) ** 2 / reached.sum() / (n - 1)
+            local = reached[reached <= radius] if radius is not None else reached
+            if "closeness_local" in measures and local.sum() > 0 and n > 1:
+                closeness_local[i] = len(local) ** 2 / local.sum() / (n - 1)
+
+            # Straightness, normalized by the number of reached nodes
+            if "straightness" in measures and len(reached) > 0:
+                euclidean = np.linalg.norm(
+                    coordinates[order[1:]] - coordinates[s], axis=1
+                )
+                straightness[i] = np.mean(euclidean / reached)
+
+    if n >= 2:
+        betweenness *= 1 / (n * (n - 1)) * n / len(sources)
+    values = {
+        "betweenness": betweenness,
+        "closeness_global": closeness_global,
+        "closeness_local": closeness_local,
+        "straightness": straightness,
+    }
+    return {name: values[name] for name in measures}
+
+
+def get_centrality(
+    graph, radius=None, k=None, seed=None, weight="mm_len", measures=None
+):
+    """Get the average centrality measures of graph.
+
+    With k, the shortest paths are computed from k sampled nodes only.
+    """
+    measures = MEASURES if measures is None else measures
+    if len(graph) == 0:
+        return dict.fromkeys(measures, np.nan)
+    sources = sample_nodes(graph, k, seed) if k is not None else None
+    values = centrality(
+        graph, radius=radius, sources=sources, weight=weight, measures=measures
+    )
+    return {name: np.mean(value) for name, value in values.items()}
@@ -3,14 +3,16 @@ Helper functions
 """
 import logging
 import math
-import os
 
-import imageio.v2 as imageio
 import networkx as nx
 import numpy as np
 import osmnx as ox
 import pandas as pd
+import shapely
 from shapely.errors import GEOSException
+from shapely.strtree import STRtree
+
+from layers import sources
 
 # import warnings
 
@@ -19,68 +21,115 @@ from shapely.errors import GEOSException
 
 logger = logging.getLogger("log")
 
+# OSM tags of the buildings used by the metrics
+BUILDING_COLUMNS = ["height"]
+
+# Geometries of the building footprints
+BUILDING_GEOMETRIES = ["Polygon", "MultiPolygon"]
+
+# Pixels on the longest side of the rasterized street network
+FRACTAL_RESOLUTION = 924
+
 
 def reverse_bearing(x):
     """Reverse bearing"""
     return x + 180 if x < 180 else x - 180
 
 
-def get_bearings(G):
-    """Get bearings"""
-    # calculate the edge bearings
-    Gu = ox.add_edge_bearings(ox.get_undirected(G))
-
-    weight_by_length = False
+def get_edge_bearings(G, weight_by_length=False):
+    """Get the bearing of every street segment and its weight.
 
-    bearings = {}
+    Bearings are calculated from node coordinate arrays like ox.add_edge_bearings
+    (self-loops have no bearing and are left out). The weights are the street
+    lengths if weight_by_length, else ones.
+    """
+    if ox.projection.is_projected(G.graph["crs"]):
+        raise ValueError("graph must be unprojected to add edge bearings")
+    if G.number_of_edges() == 0:
+        return np.empty(0), np.empty(0)
+    Gu = ox.get_undirected(G)
+    edges = [(u, v, length) for u, v, length in Gu.edges(data="length") if u != v]
+    if not edges:
+        return np.empty(0), np.empty(0)
+
+    nodes = {node: i for i, node in enumerate(Gu.nodes)}
+    x = np.fromiter((x for _, x in Gu.nodes(data="x")), dtype=float, count=len(nodes))
+    y = np.fromiter((y for _, y in Gu.nodes(data="y")), dtype=float, count=len(nodes))
+    u = np.fromiter((nodes[u] for u, _, _ in edges), dtype=int, count=len(edges))
+    v = np.fromiter((nodes[v] for _, v, _ in edges), dtype=int, count=len(edges))
+
+    bearings = ox.bearing.calculate_bearing(y[u], x[u], y[v], x[v]).round(1)
     if weight_by_length:
-        # weight bearings by length (meters)
-        city_bearings = []
-        for u, v, k, d in Gu.edges(keys=True, data=True):
-            city_bearings.extend([d["bearing"]] * int(d["length"]))
-        b = pd.Series(city_bearings)
-        bearings = pd.concat([b, b.map(reverse_bearing)]).reset_index(drop="True")
+        weights = np.array([length for _, _, length in edges], dtype=float)
     else:
-        # don't weight bearings, just take one value per street segment
-        b = pd.Series([d["bearing"] for u, v, k, d in Gu.edges(keys=True, data=True)])
-        bearings = pd.concat([b, b.map(reverse_bearing)]).reset_index(drop="True")
+        weights = np.ones(len(edges))
+    return bearings, weights
+
 
-    return bearings
+def get_bearings(G):
+    """Get bearings"""
+    bearings, _ = get_edge_bearings(G)
+    # every street segment counts in both directions
+    reverse = np.where(bearings < 180, bearings + 180, bearings - 180)
+    return pd.Series(np.concatenate([bearings, reverse]))
 
 
-def count_and_merge(n: int, bearings: pd.Series) -> np.ndarray:
+def count_and_merge(n: int, bearings, weights=None) -> np.ndarray:
     """Count and merge"""
     # make twice as many bins as desired, then merge them in pairs
     # prevents bin-edge effects around common values like 0° and 90°
     n = n * 2
     bins = np.arange(n + 1) * 360 / n
-    count, _ = np.histogram(bearings, bins=bins)
+    count, _ = np.histogram(bearings, bins=bins, weights=weights)
 
     # move the last bin to the front, so eg 0.01° and 359.99° will be binned together
     count = np.roll(count, 1)
     return count[::2] + count[1::2]
 
 
-def get_orientation_order(count: np.ndarray) -> float:
-    """Calculate orientation order"""
-    try:
-        H0 = 0
-        # for i in range(len(count)):
-        for c in count:
-            Pi = c / sum(count)
-            if Pi != 0:
-                H0 += Pi * np.log(Pi)
+def get_orientation_order(count: np.ndarray):
+    """Calculate orientation order
 
-        H0 = -1 * H0
-        Hmax = np.log(len(count))
-        Hg = np.log(2)
+    count can also be a 2D array with one row of bin counts per street network,
+    in which case an array of orientation orders is returned.
+    """
+    count = np.asarray(count, dtype=float)
+    total = count.sum(axis=-1, keepdims=True)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        P = count / total
+        H0 = -np.sum(np.where(P > 0, P * np.log(P), 0), axis=-1)
+    Hmax = np.log(count.shape[-1])
+    Hg = np.log(2)
+
+    orientation_order = 1 - (((H0 - Hg) / (Hmax - Hg)) ** 2)
+    orientation_order = np.where(total[..., 0] > 0, orientation_order, np.nan)
+    if orientation_order.ndim == 0:
+        return float(orientation_order)
+    return orientation_order
 
-        orientation_order = 1 - (((H0 - Hg) / (Hmax - Hg)) ** 2)
 
-    except Exception as e:
-        logger.debug(f"Error in orientation order {e}")
+def get_orientation_orders(bearings, weights=None, sizes=(36,)) -> dict:
+    """Calculate the orientation order for several numbers of bins in one pass.
 
-    return orientation_order
+    The bearings are sorted once and every histogram is read from the
+    cumulative weights. Returns the orientation order by number of bins.
+    """
+    bearings = np.asarray(bearings, dtype=float)
+    if weights is None:
+        weights = np.ones(len(bearings))
+    order = np.argsort(bearings)
+    sorted_bearings = bearings[order]
+    cumulative = np.concatenate([[0], np.cumsum(np.asarray(weights)[order])])
+
+    orders = {}
+    for n in sizes:
+        bins = np.arange(2 * n + 1) * 360 / (2 * n)
+        # the last bin is closed, like np.histogram
+        edges = np.append(np.searchsorted(sorted_bearings, bins[:-1]), len(bearings))
+        count = np.diff(cumulative[edges])
+        count = np.roll(count, 1)
+        orders[n] = get_orientation_order(count[::2] + count[1::2])
+    return orders
 
 
 def pp_compactness(geom):  # Polsby-Popper
@@ -93,7 +142,7 @@ def pp_compactness(geom):  # Polsby-Popper
 def fractal_dimension(Z, threshold=0.8):
     """Returns box-counting dimension of a 2D array.
     Args:
-        Z: 2D array to be analysed.
+        Z: 2D array to be analysed, or a boolean array of filled pixels.
         threshold: Cutoff for converting values in Z to 1 and 0.
     Returns:
         The estimated box counting dimension.
@@ -110,8 +159,9 @@ def fractal_dimension(Z, threshold=0.8):
         # We count non-empty (0) and non-full boxes (k*k)
         return len(np.where((S > 0) & (S < k * k))[0])
 
-    # Transform Z into a binary array
-    Z = Z < threshold
+    # Transform Z into a binary array (boolean arrays are used as they are)
+    if Z.dtype != bool:
+        Z = Z < threshold
     # Minimal dimension of image
     p = min(Z.shape)
     # Greatest power of 2 less than or equal to p
@@ -129,18 +179,31 @@ def fractal_dimension(Z, threshold=0.8):
     return -coeffs[0]
 
 
-def clean_heights(x):
-    """Cleans building heights"""
-    try:
-        return float(x)
-    except ValueError:
-        return 0
+def parse_heights(heights):
+    """Parse building heights to float32 meters, 0 when missing or not a number."""
+    return pd.to_numeric(heights, errors="coerce").fillna(0).astype("float32")
+
+
+def prepare_buildings(buildings_gdf):
+    """Prepare the buildings of a polygon for the metrics.
+
+    Only the footprints (BUILDING_GEOMETRIES) and the tags used by the metrics
+    (BUILDING_COLUMNS) are kept, before the projection. Heights are
+    parsed with parse_heights.
+    """
+    columns = [col for col in BUILDING_COLUMNS if col in buildings_gdf.columns]
+    is_polygon = buildings_gdf.geom_type.isin(BUILDING_GEOMETRIES)
+    buildings = buildings_gdf.loc[is_polygon, columns + [buildings_gdf.geometry.name]]
+    buildings = buildings.reset_index(drop=True)
+    if "height" in buildings.columns:
+        buildings["height"] = parse_heights(buildings["height"])
+    return ox.project_gdf(buildings)
 
 
 def get_graph(polygon):
     """Get networkX graph from polygon."""
     # get primary geometry and load network
-    graph = ox.graph_from_polygon(
+    graph = sources.graph_from_polygon(
         polygon,
         network_type="drive",
         simplify=True,
@@ -152,6 +215,73 @@ def get_graph(polygon):
     return graph
 
 
+def get_node_index(graph):
+    """Get a spatial index of the graph nodes.
+
+    Returns the STRtree of node points and the node ids in the same order.
+    """
+    nodes = np.array(list(graph.nodes))
+    points = shapely.points(
+        [graph.nodes[node]["x"] for node in nodes],
+        [graph.nodes[node]["y"] for node in nodes],
+    )
+    return STRtree(points), nodes
+
+
+def clip_graph(graph, polygon, node_index=None):
+    """Get the part of an already downloaded graph within polygon.
+
+    Mirrors get_graph: nodes outside the polygon are kept if one of their
+    neighbors is inside (truncate_by_edge=True) and only the largest weakly
+    connected component is returned (retain_all=False).
+    """
+    if node_index is None:
+        node_index = get_node_index(graph)
+    tree, nodes = node_index
+
+    inside = nodes[tree.query(polygon, predicate="intersects")].tolist()
+    if not inside:
+        raise ValueError("Found no graph nodes within the requested polygon")
+
+    keep = set(inside)
+    for node in inside:
+        keep.update(graph.successors(node))
+        keep.update(graph.predecessors(node))
+
+    largest = max(nx.weakly_connected_components(graph.subgraph(keep)), key=len)
+    return graph.subgraph(largest).copy()
+
+
+def get_building_index(buildings, partition="intersects"):
+    """Get a spatial index of the buildings for clip_buildings.
+
+    With partition="centroid" the index is built on the building centroids.
+    """
+    if partition not in ("intersects", "centroid"):
+        raise ValueError(f"Unknown buildings partition: {partition}")
+    geometries = buildings.geometry.values
+    if partition == "centroid":
+        geometries = shapely.centroid(geometries)
+    return STRtree(geometries), partition
+
+
+def clip_buildings(buildings, polygon, building_index=None):
+    """Get the buildings of an already downloaded set within polygon.
+
+    With the "intersects" partition every building that intersects the polygon
+    is returned, like ox.features_from_polygon. With the "centroid" partition
+    only the buildings whose centroid is within the polygon are returned, so
+    that every building belongs to a single polygon.
+    """
+    if building_index is None:
+        building_index = get_building_index(buildings)
+    tree, partition = building_index
+
+    predicate = "contains" if partition == "centroid" else "intersects"
+    positions = np.sort(tree.query(polygon, predicate=predicate))
+    return buildings.iloc[positions]
+
+
 def clean_gdf(gdf):
     """Clean gdf."""
     gdf["Center_point"] = gdf["geometry"].to_crs("+proj=cea").centroid.to_crs(4326)
@@ -178,27 +308,135 @@ def get_area(gdf):
     return gdf
 
 
-def get_fractal_dimension(graph):
-    """Get fractal dimension of street network."""
-    filepath = "./street-network.png"
-    ox.plot_graph(
-        graph,
-        bgcolor="white",
-        node_color="black",
-        edge_color="black",
-        show=False,
-        close=True,
-        dpi=150,
-        save=True,
-        filepath=filepath,
-    )
-    image = imageio.imread(filepath, mode="L") / 255.0
-    os.remove(filepath)
-    return -fractal_dimension(image)
+def get_edge_segments(graph):
+    """Get the straight segments of all edge geometries as (x0, y0, x1, y1) arrays.
+
+    Edges without geometry are a straight line between their nodes.
+    """
+    lines = []
+    for u, v, data in graph.edges(data=True):
+        if "geometry" in data:
+            lines.append(np.asarray(data["geometry"].coords)[:, :2])
+        else:
+            lines.append(
+                np.array(
+                    [
+                        [graph.nodes[u]["x"], graph.nodes[u]["y"]],
+                        [graph.nodes[v]["x"], graph.nodes[v]["y"]],
+                    ]
+                )
+            )
+    if not lines:
+        return (np.empty(0),) * 4
+    starts = np.concatenate([line[:-1] for line in lines])
+    ends = np.concatenate([line[1:] for line in lines])
+    return starts[:, 0], starts[:, 1], ends[:, 0], ends[:, 1]
+
+
+def _stamp(grid, rows, cols, mask):
+    """Set the pixels covered by mask, centered at every (row, col), to True."""
+    height, width = grid.shape
+    center = mask.shape[0] // 2
+    for dy, dx in zip(*np.nonzero(mask)):
+        grid[
+            np.clip(rows + dy - center, 0, height - 1),
+            np.clip(cols + dx - center, 0, width - 1),
+        ] = True
+
+
+def rasterize_graph(graph, resolution=FRACTAL_RESOLUTION, line_width=2, node_size=8):
+    """Burn the street network into a boolean grid.
+
+    Mimics the image drawn by ox.plot_graph at 150 dpi without the round trip
+    through matplotlib and a PNG file: the bounding box of the edges is padded
+    by 2%, unprojected graphs are scaled by cos(latitude) so they are not
+    stretched, and the longest side spans resolution pixels. Edges are drawn
+    line_width pixels wide and nodes as disks of node_size pixels.
+    """
+    x0, y0, x1, y1 = get_edge_segments(graph)
+    node_x = np.array([data["x"] for _, data in graph.nodes(data=True)])
+    node_y = np.array([data["y"] for _, data in graph.nodes(data=True)])
+    if not len(x0):
+        return np.zeros((resolution, resolution), dtype=bool)
+
+    xs = np.concatenate([x0, x1])
+    ys = np.concatenate([y0, y1])
+    west, east, south, north = xs.min(), xs.max(), ys.min(), ys.max()
+    if not ox.projection.is_projected(graph.graph["crs"]):
+        cos_lat = np.cos((south + north) / 2 / 180 * np.pi)
+        x0, x1, node_x = x0 * cos_lat, x1 * cos_lat, node_x * cos_lat
+        west, east = west * cos_lat, east * cos_lat
+
+    pad_x = (east - west) * 0.02
+    pad_y = (north - south) * 0.02
+    west, east, south, north = west - pad_x, east + pad_x, south - pad_y, north + pad_y
+    scale = (resolution - 1) / max(east - west, north - south)
+    width = int(round((east - west) * scale)) + 1
+    height = int(round((north - south) * scale)) + 1
+
+    # Pixel coordinates, with rows going down like in an image
+    px0, px1 = (x0 - west) * scale, (x1 - west) * scale
+    py0, py1 = (north - y0) * scale, (north - y1) * scale
+
+    # Sample every segment at least once per pixel
+    dx, dy = px1 - px0, py1 - py0
+    steps = np.ceil(np.maximum(np.abs(dx), np.abs(dy))).astype(int) + 1
+    segment = np.repeat(np.arange(len(steps)), steps)
+    position = np.arange(steps.sum()) - np.repeat(np.cumsum(steps) - steps, steps)
+    t = position / np.maximum(steps[segment] - 1, 1)
+    cols = np.rint(px0[segment] + t * dx[segment]).astype(int)
+    rows = np.rint(py0[segment] + t * dy[segment]).astype(int)
+
+    grid = np.zeros((height, width), dtype=bool)
+    _stamp(grid, rows, cols, np.ones((line_width, line_width), dtype=bool))
+
+    if node_size > 0:
+        radius = node_size / 2
+        offsets = np.arange(-(node_size // 2), node_size // 2 + 1) + 0.5
+        disk = offsets[:, None] ** 2 + offsets[None, :] ** 2 <= radius**2
+        node_cols = np.rint((node_x - west) * scale).astype(int)
+        node_rows = np.rint((north - node_y) * scale).astype(int)
+        _stamp(grid, node_rows, node_cols, disk)
+
+    return grid
+
+
+def get_fractal_dimension(graph, resolution=FRACTAL_RESOLUTION):
+    """Get fractal dimension of street network.
+
+    The street network is rasterized in memory at the given resolution (pixels
+    on the longest side) and analysed with box counting.
+    """
+    grid = rasterize_graph(graph, resolution=resolution)
+    return -fractal_dimension(grid)
 
 
-def get_entropy(graph: nx.Graph) -> float:
+def get_entropy(graph: nx.Graph, n: int = 36, weight_by_length: bool = False) -> float:
     """Get entropy of street orientation order."""
-    bearings = get_bearings(graph)
-    count = count_and_merge(36, bearings)
-    return get_orientation_order(count)
+    return float(get_entropies([graph], n=n, weight_by_length=weight_by_length)[0])
+
+
+def get_entropies(graphs, n: int = 36, weight_by_length: bool = False) -> np.ndarray:
+    """Get the entropy of street orientation order of a batch of graphs.
+
+    The bearings of all graphs are counted in a single weighted histogram with
+    one row per graph.
+    """
+    bearings, weights, groups = [], [], []
+    for i, graph in enumerate(graphs):
+        b, w = get_edge_bearings(graph, weight_by_length=weight_by_length)
+        reverse = np.where(b < 180, b + 180, b - 180)
+        bearings.extend([b, reverse])
+        weights.extend([w, w])
+        groups.append(np.full(2 * len(b), i))
+    bearings = np.concatenate(bearings) if bearings else np.empty(0)
+    weights = np.concatenate(weights) if weights else np.empty(0)
+    groups = np.concatenate(groups) if groups else np.empty(0, dtype=int)
+
+    # twice as many bins as desired, merged in pairs (see count_and_merge)
+    bins = np.floor(bearings / (360 / (2 * n))).astype(int) % (2 * n)
+    count = np.bincount(
+        groups * 2 * n + bins, weights=weights, minlength=len(graphs) * 2 * n
+    ).reshape(len(graphs), 2 * n)
+    count = np.roll(count, 1, axis=1)
+    return get_orientation_order(count[:, ::2] + count[:, 1::2]).reshape(-1)
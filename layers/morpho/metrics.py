@@ -0,0 +1,599 @@
+"""
+Metric graph of the morphometrics
+
+Every variable is a metric computed from intermediates (street graph, primal
+graph, buildings, tessellation...), which are computed from other
+intermediates or from the inputs of the polygon. Both are registered with the
+names they require, which makes a DAG: only the intermediates needed by the
+selected variables are built, each at most once per polygon.
+
+The requirements of a step can also depend on the selected variables (a
+function of them), e.g. centrality only needs the diameter for local
+closeness.
+
+A step whose requirements include None (e.g. a polygon without buildings)
+gives None, and the variables that depend on it are left missing.
+"""
+
+import logging
+import warnings
+from collections import namedtuple
+
+import momepy
+import networkx as nx
+import numpy as np
+import osmnx as ox
+
+from layers import sources, telemetry
+from layers.morpho.centrality import get_centrality, get_sample_size
+from layers.morpho.helpers import (
+    BUILDING_COLUMNS,
+    BUILDING_GEOMETRIES,
+    FRACTAL_RESOLUTION,
+    get_entropy,
+    get_fractal_dimension,
+    get_graph,
+    pp_compactness,
+    prepare_buildings,
+)
+from layers.morpho.network import diameter, node_connectivity
+from layers.morpho.tessellation import chunked_tessellation, tessellate
+
+logger = logging.getLogger("log")
+
+Step = namedtuple("Step", ["name", "func", "requires", "options", "parent"])
+
+# Inputs of every polygon, given to the context
+INPUTS = ["polygon", "area"]
+
+# Run options, passed to the steps that declare them
+OPTIONS = {
+    "verbose": False,
+    "centrality_samples": None,
+    "centrality_seed": None,
+    "centrality_measures": None,
+    "diameter_max_bfs": None,
+    "connectivity_budget": None,
+    "fractal_resolution": None,
+    "tessellation_memory": None,
+    "tessellation_workers": 1,
+}
+
+INTERMEDIATES = {}
+METRICS = {}
+
+
+def intermediate(name, requires=(), options=()):
+    """Register a function computing an intermediate value.
+
+    requires is a list of names, or a function of the selected variables
+    returning them.
+    """
+    requires = requires if callable(requires) else tuple(requires)
+
+    def decorator(func):
+        INTERMEDIATES[name] = Step(name, func, requires, tuple(options), None)
+        return func
+
+    return decorator
+
+
+def metric(name, requires=(), options=(), parent=None):
+    """Register a function computing a variable.
+
+    Metrics with a parent are extra columns (e.g. the method used), computed
+    whenever the parent variable is.
+    """
+
+    def decorator(func):
+        METRICS[name] = Step(name, func, tuple(requires), tuple(options), parent)
+        return func
+
+    return decorator
+
+
+def get_step(name):
+    """Get the registered intermediate or metric."""
+    if name in METRICS:
+        return METRICS[name]
+    if name in INTERMEDIATES:
+        return INTERMEDIATES[name]
+    raise KeyError(f"Unknown morphometric step: {name}")
+
+
+def get_requires(step, variables=None):
+    """Get the requirements of a step for the selected variables (None: all)."""
+    if callable(step.requires):
+        return tuple(step.requires(variables))
+    return step.requires
+
+
+def get_extra_columns(variables):
+    """Get the extra columns of variables."""
+    return [
+        name
+        for name, step in METRICS.items()
+        if step.parent is not None and step.parent in variables
+    ]
+
+
+def get_plan(variables):
+    """Get the steps needed by variables, in the order they are computed.
+
+    Raises ValueError for unknown variables.
+    """
+    unknown = [v for v in variables if v not in METRICS]
+    if unknown:
+        raise ValueError(f"Unknown variables: {', '.join(unknown)}")
+
+    plan = []
+    visiting = set()
+    selected = list(variables) + get_extra_columns(variables)
+
+    def visit(name):
+        if name in plan or name in INPUTS:
+            return
+        if name in visiting:
+            raise ValueError(f"Circular requirement: {name}")
+        visiting.add(name)
+        for requirement in get_requires(get_step(name), selected):
+            visit(requirement)
+        visiting.discard(name)
+        plan.append(name)
+
+    for variable in selected:
+        visit(variable)
+    return plan
+
+
+class Context:
+    """Values of one polygon, computed lazily and at most once.
+
+    variables are the selected variables, which some steps need fewer
+    requirements for (None: all variables).
+    """
+
+    def __init__(self, options=None, variables=None, **inputs):
+        self.options = {**OPTIONS, **(options or {})}
+        self.variables = variables
+        self.values = {k: v for k, v in inputs.items() if v is not None}
+
+    def __getitem__(self, name):
+        if name not in self.values:
+            self.values[name] = self.compute(name)
+        return self.values[name]
+
+    def compute(self, name):
+        """Compute a step from its requirements."""
+        step = get_step(name)
+        args = [self[r] for r in get_requires(step, self.variables)]
+        if any(arg is None for arg in args):
+            return None
+        logger.debug("%s.", name)
+        options = {option: self.options[option] for option in step.options}
+        with telemetry.stage(name):
+            return step.func(*args, **options)
+
+
+def compute_metrics(variables, options=None, **inputs):
+    """Compute variables for a polygon.
+
+    inputs are the polygon, its area and optionally its street graph and
+    buildings. Returns the values by column, without the missing ones.
+    """
+    # Only the centrality measures of the variables are computed
+    measures = [CENTRALITY_VARS[v] for v in variables if v in CENTRALITY_VARS]
+    options = {"centrality_measures": measures, **(options or {})}
+    context = Context(options, variables, **inputs)
+    values = {}
+    for name in get_plan(variables):
+        value = context[name]
+        if name in METRICS and value is not None:
+            values[name] = value
+
+    # Size of the polygon, to explain its timings
+    graph = context.values.get("graph")
+    if graph is not None:
+        telemetry.tag(nodes=len(graph), edges=graph.number_of_edges())
+    buildings = context.values.get("buildings")
+    if buildings is not None:
+        telemetry.tag(buildings=len(buildings))
+    return values
+
+
+def print_variables():
+    """Print the variables and the intermediates they need."""
+    for name, step in METRICS.items():
+        if step.parent is not None:
+            continue
+        steps = [s for s in get_plan([name]) if s in INTERMEDIATES]
+        print(f"{name:40} {', '.join(steps) or '-'}")
+
+
+# Street network
+
+
+@intermediate("graph", requires=["polygon"])
+def _graph(polygon):
+    return get_graph(polygon)
+
+
+@intermediate("streets_graph", requires=["graph"])
+def _streets_graph(graph):
+    return ox.projection.project_graph(graph)
+
+
+@intermediate("undirected", requires=["streets_graph"])
+def _undirected(streets_graph):
+    return ox.get_undirected(streets_graph)
+
+
+@intermediate("edges", requires=["undirected"])
+def _edges(undirected):
+    return ox.graph_to_gdfs(
+        undirected,
+        nodes=False,
+        edges=True,
+        node_geometry=False,
+        fill_edge_geometry=True,
+    )
+
+
+@intermediate("diameter", requires=["undirected"], options=["diameter_max_bfs"])
+def _diameter(undirected, diameter_max_bfs=None):
+    return diameter(undirected, max_bfs=diameter_max_bfs)
+
+
+@intermediate("basic_stats", requires=["graph", "area"])
+def _basic_stats(graph, area):
+    return ox.stats.basic_stats(graph, area=area)
+
+
+@intermediate("node_connectivity", requires=["graph"], options=["connectivity_budget"])
+def _node_connectivity(graph, connectivity_budget=None):
+    return node_connectivity(graph, budget=connectivity_budget)
+
+
+@intermediate("primal", requires=["edges"])
+def _primal(edges):
+    return momepy.gdf_to_nx(edges, approach="primal")
+
+
+def _centrality_requires(variables):
+    # The radius of local closeness is a quarter of the diameter
+    if variables is None or "avg_local_closeness_centrality" in variables:
+        return ["primal", "diameter"]
+    return ["primal"]
+
+
+@intermediate(
+    "centrality",
+    requires=_centrality_requires,
+    options=["centrality_samples", "centrality_seed", "centrality_measures"],
+)
+def _centrality(
+    primal,
+    diameter_value=None,
+    centrality_samples=None,
+    centrality_seed=None,
+    centrality_measures=None,
+):
+    k = get_sample_size(len(primal), centrality_samples)
+    if k is not None:
+        logger.debug("Sampling %s out of %s nodes for centrality.", k, len(primal))
+    radius = diameter_value * (1 / 4) if diameter_value is not None else None
+    return get_centrality(
+        primal,
+        radius=radius,
+        k=k,
+        seed=centrality_seed,
+        measures=centrality_measures or list(CENTRALITY_VARS.values()),
+    )
+
+
+# Buildings
+
+
+@intermediate("buildings_gdf", requires=["polygon"])
+def _buildings_gdf(polygon):
+    try:
+        return sources.features_from_polygon(
+            polygon,
+            tags={"building": True},
+            columns=BUILDING_COLUMNS,
+            geom_types=BUILDING_GEOMETRIES,
+        )
+    except ox._errors.InsufficientResponseError:
+        logger.debug("No data elements in server response.")
+    except Exception as e:
+        logger.debug("Error: %s", e)
+    return None
+
+
+@intermediate("buildings", requires=["buildings_gdf"], options=["verbose"])
+def _buildings(buildings_gdf, verbose=False):
+    if buildings_gdf.empty:
+        logger.debug("No buildings in polygon.")
+        return None
+
+    buildings_gdf_projected = prepare_buildings(buildings_gdf)
+    if buildings_gdf_projected.empty:
+        logger.debug("Projected buildings_gdf is empty.")
+        return None
+
+    buildings = momepy.preprocess(
+        buildings_gdf_projected,
+        size=30,
+        compactness=True,
+        islands=True,
+        verbose=verbose,
+    )
+    buildings["uID"] = momepy.unique_id(buildings)
+    return buildings
+
+
+@intermediate(
+    "tessellation",
+    requires=["buildings"],
+    options=["verbose", "tessellation_memory", "tessellation_workers"],
+)
+def _tessellation(
+    buildings, verbose=False, tessellation_memory=None, tessellation_workers=1
+):
+    limit = momepy.buffered_limit(buildings)
+    if tessellation_memory is None:
+        return tessellate(buildings, limit, verbose)
+    return chunked_tessellation(
+        buildings, limit, tessellation_memory, tessellation_workers, verbose
+    )
+
+
+@intermediate("building_area", requires=["buildings"])
+def _building_area(buildings):
+    return momepy.Area(buildings).series
+
+
+@intermediate("building_heights", requires=["buildings"])
+def _building_heights(buildings):
+    if "height" not in buildings.columns:  # OSM did not provide height
+        return None
+    return buildings["height"].fillna(0)
+
+
+@intermediate("building_orientation", requires=["buildings"], options=["verbose"])
+def _building_orientation(buildings, verbose=False):
+    return buildings.assign(
+        orientation=momepy.Orientation(buildings, verbose=verbose).series
+    )
+
+
+@intermediate(
+    "tessellation_orientation", requires=["tessellation"], options=["verbose"]
+)
+def _tessellation_orientation(tessellation, verbose=False):
+    return tessellation.assign(
+        orientation=momepy.Orientation(tessellation, verbose=verbose).series
+    )
+
+
+@intermediate(
+    "network_ids",
+    requires=["edges", "building_orientation"],
+    options=["verbose"],
+)
+def _network_ids(edges, buildings, verbose=False):
+    edges = edges.assign(networkID=momepy.unique_id(edges))
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        buildings = buildings.assign(
+            networkID=momepy.get_network_id(
+                buildings, edges, "networkID", verbose=verbose
+            )
+        )
+    return edges, buildings.loc[buildings.networkID >= 0]
+
+
+@intermediate("street_profile", requires=["edges", "buildings", "building_heights"])
+def _street_profile(edges, buildings, heights):
+    buildings = buildings.assign(height=heights)
+    try:
+        return momepy.StreetProfile(edges, buildings, heights="height")
+    except ValueError:
+        # check if we are incorrectly ignoring the error
+        logger.error(
+            "Skipped momepy.StreetProfile but buildings dataframe had height column."
+        )
+    return None
+
+
+# Scale Complexity
+
+
+@metric("fractal-dimension", requires=["graph"], options=["fractal_resolution"])
+def _fractal_dimension(graph, fractal_resolution=None):
+    if fractal_resolution is None:
+        fractal_resolution = FRACTAL_RESOLUTION
+    return get_fractal_dimension(graph, resolution=fractal_resolution)
+
+
+@metric("compactness-area", requires=["polygon"])
+def _compactness_area(polygon):
+    return pp_compactness(polygon)
+
+
+@metric("diameter-periphery", requires=["diameter"])
+def _diameter_periphery(diameter_value):
+    return diameter_value
+
+
+# Spatial Complexity and Connectivity
+
+
+@metric("shannon_entropy-street_orientation_order", requires=["graph"])
+def _entropy(graph):
+    return get_entropy(graph)
+
+
+def _basic_stat(name, key):
+    metric(name, requires=["basic_stats"])(lambda basic: basic[key])
+
+
+_basic_stat("avg_street_length", "street_length_avg")
+_basic_stat("avg_streets_per_node", "streets_per_node_avg")
+_basic_stat("intersection_density", "node_density_km")
+_basic_stat("street_density", "street_density_km")
+_basic_stat("avg_circuity", "circuity_avg")
+
+
+@metric("avg_proportion_streets_per_node", requires=["basic_stats"])
+def _proportion_streets_per_node(basic):
+    return np.mean(list(basic["streets_per_node_proportions"].values()))
+
+
+@metric("avg_node_connectivity", requires=["node_connectivity"])
+def _avg_node_connectivity(connectivity):
+    return connectivity[0]
+
+
+@metric(
+    "avg_node_connectivity_method",
+    requires=["node_connectivity"],
+    parent="avg_node_connectivity",
+)
+def _avg_node_connectivity_method(connectivity):
+    return connectivity[1]
+
+
+@metric("avg_PageRank", requires=["graph"])
+def _pagerank(graph):
+    return np.mean(list(nx.pagerank(graph).values()))
+
+
+@metric("avg_node_degree", requires=["primal"])
+def _avg_node_degree(primal):
+    try:
+        avg_node_degree = momepy.mean_node_degree(primal, verbose=False)
+    except TypeError as e:
+        logger.debug("Error calculating node degree: %s", e)
+        return None
+    logger.info("avg_node_degree=%s", avg_node_degree)
+    return avg_node_degree
+
+
+CENTRALITY_VARS = {
+    "avg_betweenness_centrality": "betweenness",
+    "avg_local_closeness_centrality": "closeness_local",
+    "avg_global_closeness_centrality": "closeness_global",
+    "avg_straightness_centrality": "straightness",
+}
+
+
+def _samples(primal, centrality_samples=None):
+    # Number of sampled nodes, recorded in the approximate mode only
+    if centrality_samples is None:
+        return None
+    return get_sample_size(len(primal), centrality_samples) or len(primal)
+
+
+for _name, _key in CENTRALITY_VARS.items():
+    metric(_name, requires=["centrality"])(lambda values, key=_key: values[key])
+    metric(
+        _name + "_samples",
+        requires=["primal"],
+        options=["centrality_samples"],
+        parent=_name,
+    )(_samples)
+
+
+# Built Complexity/Morphology
+
+
+@metric("avg_building_area", requires=["building_area"])
+def _avg_building_area(area):
+    return area.mean()
+
+
+@metric("avg_tesselation_area", requires=["tessellation"])
+def _avg_tessellation_area(tessellation):
+    return momepy.Area(tessellation).series.mean()
+
+
+@metric("avg_building_height", requires=["building_heights"])
+def _avg_building_height(heights):
+    if (heights == 0).all():
+        return None
+    # heights are float32, the mean is summed in float64
+    return heights.astype("float64").mean()
+
+
+@metric("avg_building_volume", requires=["buildings", "building_heights"])
+def _avg_building_volume(buildings, heights):
+    if (heights == 0).all():  # if height = 0 then volume = 0
+        return None
+    buildings = buildings.assign(height=heights)
+    return momepy.Volume(buildings, heights="height").series.mean()
+
+
+@metric("avg_building_orientation", requires=["building_orientation"])
+def _avg_building_orientation(buildings):
+    return buildings["orientation"].mean()
+
+
+@metric("avg_tessellation_orientation", requires=["tessellation_orientation"])
+def _avg_tessellation_orientation(tessellation):
+    return tessellation["orientation"].mean()
+
+
+@metric(
+    "avg_building_cell_alignment",
+    requires=["building_orientation", "tessellation_orientation"],
+)
+def _avg_building_cell_alignment(buildings, tessellation):
+    blg_cell_align = momepy.CellAlignment(
+        buildings, tessellation, "orientation", "orientation", "uID", "uID"
+    )
+    return blg_cell_align.series.mean()
+
+
+@metric("avg_street_alignment", requires=["network_ids"])
+def _avg_street_alignment(network_ids):
+    edges, buildings_net = network_ids
+    str_align = momepy.StreetAlignment(
+        buildings_net, edges, "orientation", "networkID", "networkID"
+    )
+    return str_align.series.mean()
+
+
+# Every street profile variable is the average width, as in previous versions
+for _name in [
+    "avg_width-street_profile",
+    "avg_width_deviations-street_profile",
+    "avg_openness-street_profile",
+    "avg_heights-street_profile",
+    "avg_heights_deviations-street_profile",
+    "avg_profile-street_profile",
+]:
+    metric(_name, requires=["street_profile"])(lambda profile: profile.w.mean())
+
+
+@metric("avg_building_compactness", requires=["buildings"])
+def _avg_building_compactness(buildings):
+    return buildings["geometry"].apply(pp_compactness).mean()
+
+
+# Infrastructure
+
+
+@metric("total_area", requires=["area"])
+def _total_area(area):
+    return area
+
+
+@metric("total_built_area", requires=["building_area"])
+def _total_built_area(area):
+    return area.sum()
+
+
+@metric("total_street_length", requires=["basic_stats"])
+def _total_street_length(basic):
+    return basic["street_length_total"]
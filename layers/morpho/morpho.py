@@ -4,30 +4,43 @@ Morphometrics
 
 import logging
 import warnings
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 import geopandas as gpd
-import momepy
 import networkx as nx
 import numpy as np
-import osmnx as ox
 
+import config
+from layers import checkpoint, telemetry
 from layers.morpho.helpers import (
+    BUILDING_COLUMNS,
     clean_gdf,
-    clean_heights,
+    clip_buildings,
+    clip_graph,
     get_area,
-    get_entropy,
-    get_fractal_dimension,
-    get_graph,
-    pp_compactness,
+    get_building_index,
+    get_node_index,
 )
+from layers.morpho.metrics import METRICS, compute_metrics, get_plan
+from layers.sources import get_source
 
 warnings.filterwarnings("ignore")
 
 logger = logging.getLogger("log")
 
 
-def get_variables_list(full: bool) -> list:
-    """Get list of variables to be calculated."""
+def get_variables_list(full: bool, variables: list = None) -> list:
+    """Get list of variables to be calculated.
+
+    If variables are given, they are checked and returned instead of the basic
+    or full list.
+    """
+    if variables:
+        unknown = [variable for variable in variables if variable not in METRICS]
+        if unknown:
+            raise ValueError(f"Unknown variables: {', '.join(unknown)}")
+        return list(dict.fromkeys(variables))
+
     # Scale Complexity
     scale_vars = ["fractal-dimension"]
     if full:
@@ -86,304 +99,267 @@ def get_variables_list(full: bool) -> list:
     return all_vars
 
 
-def add_scale_vars(gdf, index, graph, polygon, full):
-    """Add scale variables to gdf."""
-    logger.debug("Scale Complexity.")
-
-    gdf.loc[index, "fractal-dimension"] = get_fractal_dimension(graph)
-
-    if full:
-        gdf.loc[index, "compactness-area"] = pp_compactness(polygon)
-        gdf.loc[index, "diameter-periphery"] = nx.diameter(graph.to_undirected())
-
-        return gdf
-
-
-def add_node_degree(gdf, index, street_graph):
-    try:
-        result = momepy.mean_node_degree(street_graph, verbose=False)
-        gdf.loc[index, "avg_node_degree"] = result
-    except TypeError:
-        import traceback
-
-        traceback.print_exc()
-        breakpoint()
-
-    return gdf
-
-
-def add_spatial_vars(gdf, index, graph, edges, full, verbose=False):
-    """Add spatial variables to gdf."""
-    try:
-        gdf.loc[index, "shannon_entropy-street_orientation_order"] = get_entropy(graph)
-    except KeyError:  # this error is raised in get_bearings()
-        pass
-
-    # Basic Stats
-    basic = ox.stats.basic_stats(graph, area=gdf.loc[index, "area_m2"])
-    gdf.loc[index, "avg_street_length"] = basic["street_length_avg"]
-    if full:
-        gdf.loc[index, "avg_streets_per_node"] = basic["streets_per_node_avg"]
-        gdf.loc[index, "avg_proportion_streets_per_node"] = np.mean(
-            list(basic["streets_per_node_proportions"].values())
-        )
-        gdf.loc[index, "intersection_density"] = basic["node_density_km"]
-        gdf.loc[index, "street_density"] = basic["street_density_km"]
-        gdf.loc[index, "avg_circuity"] = basic["circuity_avg"]
-        gdf.loc[index, "avg_node_connectivity"] = np.mean(nx.node_connectivity(graph))
-        gdf.loc[index, "avg_PageRank"] = np.mean(list(nx.pagerank(graph).values()))
-
-    # Multiple centrality assessment
-    logger.debug("Multiple centrality assessment")
-
-    logger.debug("gdf to nx.")
-    primal = momepy.gdf_to_nx(edges, approach="primal")
-
-    # Debug
-    try:
-        avg_node_degree = momepy.mean_node_degree(primal, verbose=False)
-        logger.info("avg_node_degree=%s", avg_node_degree)
-        gdf.loc[index, "avg_node_degree"] = avg_node_degree
-    except TypeError as e:
-        logger.debug("Error calculating node degree: %s", e)
-
-    logger.debug("Betweenness.")
-    primal = momepy.betweenness_centrality(
-        primal, name="betweenness_metric_n", mode="nodes", weight="mm_len"
-    )
-    nodes = momepy.nx_to_gdf(primal, lines=False)
-    gdf.loc[index, "avg_betweenness_centrality"] = np.mean(
-        nodes["betweenness_metric_n"]
+# Computed in full mode and saved when OSM provides building heights
+OPTIONAL_VARS = ["avg_building_height", "avg_building_volume"]
+
+
+def get_polygon_morphometrics(
+    row: gpd.GeoDataFrame,
+    full: bool = True,
+    verbose: bool = False,
+    graph: nx.MultiDiGraph = None,
+    buildings: gpd.GeoDataFrame = None,
+    centrality_samples=None,
+    centrality_seed=None,
+    diameter_max_bfs=None,
+    connectivity_budget=None,
+    fractal_resolution=None,
+    tessellation_memory=None,
+    tessellation_workers=1,
+    variables: list = None,
+) -> dict:
+    """Get morphometrics for a single polygon.
+
+    Takes a one-row GeoDataFrame and returns the calculated values by column.
+    Only the variables (default: get_variables_list(full)) and the
+    intermediates they need are computed. The street graph and the buildings
+    are downloaded for the polygon unless they are provided.
+
+    centrality_samples turns on the approximate centrality mode (see
+    get_sample_size), diameter_max_bfs bounds the diameter computation and
+    connectivity_budget the node connectivity (see node_connectivity).
+    fractal_resolution is the raster size of the fractal dimension (see
+    get_fractal_dimension).
+    tessellation_memory caps the memory of the tessellation, which is then
+    computed in tiles by tessellation_workers processes (see
+    chunked_tessellation).
+    """
+    index = row.index[0]
+    selected = get_variables_list(full, variables)
+    if variables is None and full:
+        selected = selected + OPTIONAL_VARS
+
+    options = {
+        "verbose": verbose,
+        "centrality_samples": centrality_samples,
+        "centrality_seed": centrality_seed,
+        "diameter_max_bfs": diameter_max_bfs,
+        "connectivity_budget": connectivity_budget,
+        "fractal_resolution": fractal_resolution,
+        "tessellation_memory": tessellation_memory,
+        "tessellation_workers": tessellation_workers,
+    }
+    return compute_metrics(
+        selected,
+        options,
+        polygon=row.loc[index, "geometry"],
+        area=row.loc[index, "area_m2"],
+        graph=graph,
+        buildings_gdf=buildings,
     )
 
-    if full:
-        logger.debug("Closeness centrality local.")
-        primal = momepy.closeness_centrality(
-            primal,
-            radius=gdf.loc[index, "diameter-periphery"] * (1 / 4),
-            name="closeness_local",
-            distance="mm_len",
-            weight="mm_len",
-            verbose=verbose,
-        )
-        logger.debug("Closeness centrality global.")
-        primal = momepy.closeness_centrality(
-            primal, name="closeness_global", weight="mm_len"
-        )
-        logger.debug("Straightness centrality.")
-        primal = momepy.straightness_centrality(primal)
-        logger.debug("nx to gdf.")
-        nodes = momepy.nx_to_gdf(primal, lines=False)
-
-        gdf.loc[index, "avg_local_closeness_centrality"] = np.mean(
-            nodes["closeness_local"]
-        )
-        gdf.loc[index, "avg_global_closeness_centrality"] = np.mean(
-            nodes["closeness_global"]
-        )
-        gdf.loc[index, "avg_straightness_centrality"] = np.mean(nodes["straightness"])
-    return gdf, basic
-
 
-def add_built_vars(gdf, index, edges, polygon, verbose=False):
-    """Add built variables to gdf."""
-    logger.debug("Building area, compactness.")
+def _polygon_morphometrics(row, **kwargs):
+    """Run get_polygon_morphometrics, logging errors instead of raising them."""
+    index = row.index[0]
     try:
-        buildings_gdf = ox.features_from_polygon(polygon, tags={"building": True})
-    except ox._errors.InsufficientResponseError:
-        logger.debug("No data elements in server response.")
-        return gdf, None
+        return get_polygon_morphometrics(row, **kwargs)
+    except ValueError as e:  # raised by get_graph when there is no street network
+        logger.error("Polygon %s: %s", index, e)
     except Exception as e:
-        logger.debug("Error:", e)
-        return gdf, None
+        logger.exception(e)
+        logger.error("Error processing polygon %s. Skipping.", index)
+    return None
 
-    if buildings_gdf.empty:
-        logger.debug("No buildings in polygon.")
-        return gdf, None
 
-    buildings_gdf_projected = ox.project_gdf(buildings_gdf)
-    buildings_gdf_projected = buildings_gdf_projected.reset_index()
-    buildings_gdf_projected = buildings_gdf_projected[
-        buildings_gdf_projected.geom_type.isin(["Polygon", "MultiPolygon"])
-    ]
-    if buildings_gdf_projected.empty:
-        logger.debug("Projected buildings_gdf is empty.")
-        return gdf, None
-
-    logger.debug("momepy preprocess.")
-    buildings = momepy.preprocess(
-        buildings_gdf_projected,
-        size=30,
-        compactness=True,
-        islands=True,
-        verbose=verbose,
-    )
-
-    buildings["uID"] = momepy.unique_id(buildings)
-
-    logger.debug("momepy buffered limit.")
-    limit = momepy.buffered_limit(buildings)
+def _timed_polygon_morphometrics(row, **kwargs):
+    """Run _polygon_morphometrics, recording the timings of its stages.
 
-    logger.debug("momepy tessellation.")
-    with warnings.catch_warnings():
-        warnings.simplefilter("ignore")
-        tess = momepy.Tessellation(
-            buildings, unique_id="uID", limit=limit, verbose=verbose
-        )
-
-    tessellation = tess.tessellation
+    Returns the values and the timings, which are sent back from the worker
+    processes.
+    """
+    with telemetry.recording(polygon=row.index[0]) as recorder:
+        with telemetry.stage("polygon"):
+            values = _polygon_morphometrics(row, **kwargs)
+    return values, recorder.get_records()
 
-    logger.debug("avg_building_area.")
-    blg_area = momepy.Area(buildings)
-    buildings["area"] = blg_area.series
-    gdf.loc[index, "avg_building_area"] = buildings["area"].mean()
 
-    logger.debug("avg_tesselation_area.")
-    tes_area = momepy.Area(tessellation)
-    tessellation["area"] = tes_area.series
-    gdf.loc[index, "avg_tesselation_area"] = tessellation["area"].mean()
+def get_polygon_graphs(gdf, city_graph):
+    """Clip the city street graph to every polygon in gdf.
 
-    logger.debug("building height.")
-    try:
-        buildings["height"] = buildings["height"].fillna(0).apply(clean_heights)
-        if (buildings["height"] == 0).all():
-            pass
-        else:
-            gdf.loc[index, "avg_building_height"] = buildings["height"].mean()
-    except KeyError:  # OSM did not provide height
-        pass
-
-    logger.debug("avg_building_volume")
-    try:
-        if (buildings["height"] == 0).all():  # if height = 0 then volume = 0
-            pass
-        else:
-            blg_volume = momepy.Volume(buildings, heights="height")
-            buildings["volume"] = blg_volume.series
-            gdf.loc[index, "avg_building_volume"] = buildings["volume"].mean()
-    except KeyError:  # OSM did not provide height
-        pass
-
-    logger.debug("building orientation")
-    buildings["orientation"] = momepy.Orientation(buildings, verbose=verbose).series
-    gdf.loc[index, "avg_building_orientation"] = buildings["orientation"].mean()
-
-    logger.debug("tessellation orientation")
-    tessellation["orientation"] = momepy.Orientation(
-        tessellation, verbose=verbose
-    ).series
-    gdf.loc[index, "avg_tessellation_orientation"] = tessellation["orientation"].mean()
-
-    logger.debug("building cell alignment")
-    blg_cell_align = momepy.CellAlignment(
-        buildings, tessellation, "orientation", "orientation", "uID", "uID"
-    )
-    buildings["cell_align"] = blg_cell_align.series
-    gdf.loc[index, "avg_building_cell_alignment"] = buildings["cell_align"].mean()
-
-    logger.debug("Network ID")
-    edges["networkID"] = momepy.unique_id(edges)
-    with warnings.catch_warnings():
-        warnings.simplefilter("ignore")
-        buildings["networkID"] = momepy.get_network_id(
-            buildings, edges, "networkID", verbose=verbose
-        )
-    buildings_net = buildings.loc[buildings.networkID >= 0]
-
-    logger.debug("street alignment")
-    str_align = momepy.StreetAlignment(
-        buildings_net, edges, "orientation", "networkID", "networkID"
-    )
-    logger.debug("Assign street alignment to buildings dataframe.")
-    with warnings.catch_warnings():
-        warnings.simplefilter("ignore")
-        buildings_net["str_align"] = str_align.series
-    logger.debug("Average Street Alignment.")
-    gdf.loc[index, "avg_street_alignment"] = buildings_net["str_align"].mean()
-
-    logger.debug("Street profile")
-    try:
-        profile = momepy.StreetProfile(edges, buildings, heights="height")
-
-        edges["widths"] = profile.w
-        edges["width_deviations"] = profile.wd
-        edges["openness"] = profile.o
-        edges["heights"] = profile.h
-        edges["heights_deviations"] = profile.hd
-        edges["profile"] = profile.p
-
-        gdf.loc[index, "avg_width-street_profile"] = edges["widths"].mean()
-        gdf.loc[index, "avg_width_deviations-street_profile"] = edges["widths"].mean()
-        gdf.loc[index, "avg_openness-street_profile"] = edges["widths"].mean()
-        gdf.loc[index, "avg_heights-street_profile"] = edges["widths"].mean()
-        gdf.loc[index, "avg_heights_deviations-street_profile"] = edges["widths"].mean()
-        gdf.loc[index, "avg_profile-street_profile"] = edges["widths"].mean()
-    except KeyError:  # OSM did not provide height
-        pass
-    except ValueError:
-        if "height" in buildings.columns:
-            # check if we are incorrectly ignoring the error
-            logger.error(
-                "Skipped momepy.StreetProfile but buildings dataframe had height column."
+    Polygons without streets are logged and left out.
+    """
+    node_index = get_node_index(city_graph)
+    graphs = {}
+    for index in gdf.index:
+        try:
+            graphs[index] = clip_graph(
+                city_graph, gdf.loc[index, "geometry"], node_index
             )
-
-    buildings["compactness"] = buildings["geometry"].apply(pp_compactness)
-    gdf.loc[index, "avg_building_compactness"] = buildings["compactness"].mean()
-    return gdf, buildings
-
-
-def add_infra_vars(gdf, index, buildings, basic):
-    """Add infrastructure variables to gdf."""
-    gdf.loc[index, "total_area"] = gdf.loc[index, "area_m2"]
-    if buildings is not None:
-        gdf.loc[index, "total_built_area"] = buildings["area"].sum()
-    gdf.loc[index, "total_street_length"] = basic["street_length_total"]
-    return gdf
+        except ValueError as e:
+            logger.error("Polygon %s: %s", index, e)
+    return graphs
+
+
+def get_polygon_buildings(gdf, city_buildings, partition="intersects"):
+    """Split the city buildings into the buildings of every polygon in gdf.
+
+    Only the tags used by the metrics (BUILDING_COLUMNS) are kept, so that other
+    tags of the city buildings (e.g. name) are not copied to every polygon.
+    """
+    columns = [col for col in BUILDING_COLUMNS if col in city_buildings.columns]
+    city_buildings = city_buildings[columns + [city_buildings.geometry.name]]
+    building_index = get_building_index(city_buildings, partition)
+    return {
+        index: clip_buildings(
+            city_buildings, gdf.loc[index, "geometry"], building_index
+        )
+        for index in gdf.index
+    }
 
 
 def get_morphometrics(
-    gdf: gpd.GeoDataFrame, full: bool = True, verbose: bool = False
+    gdf: gpd.GeoDataFrame,
+    full: bool = True,
+    verbose: bool = False,
+    workers: int = 1,
+    city_graph: nx.MultiDiGraph = None,
+    city_buildings: gpd.GeoDataFrame = None,
+    partition: str = "intersects",
+    centrality_samples=None,
+    centrality_seed=None,
+    diameter_max_bfs=None,
+    connectivity_budget=None,
+    fractal_resolution=None,
+    tessellation_memory=None,
+    tessellation_workers=1,
+    checkpoint_dir=None,
+    variables: list = None,
 ) -> None:
-    """Get morphometrics for a city."""
+    """Get morphometrics for a city.
+
+    With workers > 1 the polygons are processed in a pool of worker processes.
+    Results are merged back in index order, so the output is the same as in the
+    serial run.
+
+    If city_graph is given, the street graph of each polygon is clipped from it
+    instead of being downloaded polygon by polygon. In the same way, if
+    city_buildings is given, the buildings of each polygon are taken from it
+    (see clip_buildings for the partition options).
+
+    With centrality_samples, the centrality measures are approximated from a
+    sample of nodes drawn with centrality_seed (see get_sample_size).
+    diameter_max_bfs bounds the number of BFS of the diameter computation and
+    connectivity_budget the time of the node connectivity of each polygon.
+    fractal_resolution sets the raster size of the fractal dimension.
+    With tessellation_memory (bytes), the tessellation of the buildings is
+    computed in tiles that fit in that memory, by tessellation_workers
+    processes. The cells are the same as in one piece.
+
+    With checkpoint_dir, the values of every finished polygon are saved there
+    and the polygons saved by a previous run with the same parameters are
+    skipped.
+
+    variables selects the variables to calculate instead of the basic or full
+    list. Only the data they need is prepared.
+    """
     logger.info("Morphometrics:")
 
     # Setup
     gdf = clean_gdf(gdf)
     gdf = get_area(gdf)
-    all_vars = get_variables_list(full)
+    all_vars = get_variables_list(full, variables)
+    plan = get_plan(all_vars)
     for variable in all_vars:
         gdf[variable] = np.nan
 
+    results = {}
+    if checkpoint_dir is not None:
+        params = {
+            "full": full,
+            "source": get_source(),
+            "snapshot_date": config.OSM_SNAPSHOT_DATE,
+            # graph clipped from the city graph or downloaded per polygon
+            "city_graph": city_graph is not None,
+            "partition": partition if city_buildings is not None else None,
+            "centrality_samples": centrality_samples,
+            "centrality_seed": centrality_seed,
+            "diameter_max_bfs": diameter_max_bfs,
+            "connectivity_budget": connectivity_budget,
+            "fractal_resolution": fractal_resolution,
+            "variables": all_vars,
+        }
+        results = checkpoint.open_checkpoints(checkpoint_dir, params)
+    pending = gdf[~gdf.index.isin(list(results))]
+
+    def finish(index, values):
+        results[index] = values
+        if checkpoint_dir is not None and values is not None:
+            checkpoint.save(checkpoint_dir, index, values)
+
+    tasks = {
+        index: {
+            "row": gdf.loc[[index]],
+            "full": full,
+            "verbose": verbose,
+            "centrality_samples": centrality_samples,
+            "centrality_seed": centrality_seed,
+            "diameter_max_bfs": diameter_max_bfs,
+            "connectivity_budget": connectivity_budget,
+            "fractal_resolution": fractal_resolution,
+            "tessellation_memory": tessellation_memory,
+            "tessellation_workers": tessellation_workers,
+            "variables": variables,
+        }
+        for index in pending.index
+    }
+    if city_graph is not None and "graph" in plan:
+        logger.info("Clipping street graph for %s polygons.", len(pending))
+        with telemetry.stage("clip_graph"):
+            graphs = get_polygon_graphs(pending, city_graph)
+        tasks = {
+            index: {**task, "graph": graphs[index]}
+            for index, task in tasks.items()
+            if index in graphs
+        }
+    if city_buildings is not None and "buildings_gdf" in plan:
+        logger.info("Splitting buildings for %s polygons.", len(pending))
+        with telemetry.stage("split_buildings"):
+            buildings = get_polygon_buildings(pending, city_buildings, partition)
+        for index, task in tasks.items():
+            task["buildings"] = buildings[index]
+
+    if workers > 1:
+        logger.info("Running %s polygons with %s workers.", len(pending), workers)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(_timed_polygon_morphometrics, **task): index
+                for index, task in tasks.items()
+            }
+            for count, future in enumerate(as_completed(futures), start=1):
+                index = futures[future]
+                logger.info("Polygon %s out of %s: id = %s", count, len(pending), index)
+                try:
+                    values, timings = future.result()
+                except Exception as e:  # the worker process died
+                    logger.error("Polygon %s: worker failed: %s", index, e)
+                    continue
+                telemetry.extend(timings)
+                finish(index, values)
+    else:
+        for count, (index, task) in enumerate(tasks.items(), start=1):
+            logger.info("Polygon %s out of %s: id = %s", count, len(pending), index)
+            values, timings = _timed_polygon_morphometrics(**task)
+            telemetry.extend(timings)
+            finish(index, values)
+
+    # Merge results in a fixed order
     for index in gdf.index:
-        logger.info("Polygon %s out of %s: id = %s", index + 1, len(gdf), index)
-
-        # Setup
-        polygon = gdf.loc[index, "geometry"]
-        try:
-            graph = get_graph(polygon)
-        except ValueError as e:
-            logger.error(e)
+        values = results.get(index)
+        if values is None:
             continue
-        streets_graph = ox.projection.project_graph(graph)
-        edges = ox.graph_to_gdfs(
-            ox.get_undirected(streets_graph),
-            nodes=False,
-            edges=True,
-            node_geometry=False,
-            fill_edge_geometry=True,
-        )
-
-        # Debug
-        # gdf = add_node_degree(gdf, index, streets_graph)
-
-        # Scale Complexity
-        gdf = add_scale_vars(gdf, index, graph, polygon, full)
-        # Spatial Complexity and Connectivity
-        gdf, basic = add_spatial_vars(gdf, index, graph, edges, full, verbose)
-        # Built Complexity/Morphology
-        gdf, buildings = add_built_vars(gdf, index, edges, polygon)
-        # Infrastructure
-        gdf = add_infra_vars(gdf, index, buildings, basic)
+        for column, value in values.items():
+            gdf.loc[index, column] = value
 
     # Report results
     for variable in all_vars:
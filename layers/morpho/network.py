@@ -0,0 +1,172 @@
+"""
+Street network measures: diameter and node connectivity
+"""
+
+import logging
+import random
+import time
+
+import networkx as nx
+from networkx.algorithms.connectivity import (
+    build_auxiliary_node_connectivity,
+    local_node_connectivity,
+)
+from networkx.algorithms.flow import build_residual_network
+
+logger = logging.getLogger("log")
+
+# Number of random pairs of the node connectivity estimate
+CONNECTIVITY_SAMPLES = 100
+
+
+def _bfs(graph, source):
+    """Get the hop distance from source to every reachable node."""
+    return nx.single_source_shortest_path_length(graph, source)
+
+
+def _farthest(distances):
+    """Get the farthest node and its distance."""
+    node = max(distances, key=distances.get)
+    return node, distances[node]
+
+
+def _middle(graph, a, b):
+    """Get the node in the middle of a shortest path between a and b."""
+    path = nx.shortest_path(graph, a, b)
+    return path[len(path) // 2]
+
+
+def diameter(graph, max_bfs=None):
+    """Get the diameter (in hops) of a connected undirected graph.
+
+    Exact iFUB algorithm (Crescenzi et al. 2013): a double sweep finds a
+    central start node, then the eccentricities of the nodes farthest from it
+    are computed level by level until the lower bound meets the upper bound.
+    This usually takes a few BFS instead of one per node as in nx.diameter.
+
+    With max_bfs, stops after that many BFS and returns the lower bound found
+    so far, which is the diameter or an underestimate of it.
+    """
+    if len(graph) == 0:
+        raise ValueError("Graph has no nodes")
+
+    # Double sweep from the node with the highest degree
+    start = max(graph.degree, key=lambda x: x[1])[0]
+    a, _ = _farthest(_bfs(graph, start))
+    distances = _bfs(graph, a)
+    if len(distances) < len(graph):
+        raise nx.NetworkXError(
+            "Found infinite path length because the graph is not connected"
+        )
+    b, lower = _farthest(distances)
+    count = 2
+
+    # Levels of the BFS tree from the middle of the longest path found
+    u = _middle(graph, a, b)
+    levels = {}
+    for node, level in _bfs(graph, u).items():
+        levels.setdefault(level, []).append(node)
+    count += 1
+    i = max(levels)
+    lower = max(lower, i)
+    upper = 2 * i
+
+    while upper > lower:
+        for node in levels[i]:
+            if max_bfs is not None and count >= max_bfs:
+                logger.debug("Diameter: stopped after %s BFS.", count)
+                return lower
+            lower = max(lower, max(_bfs(graph, node).values()))
+            count += 1
+        if lower > 2 * (i - 1):
+            break
+        upper = 2 * (i - 1)
+        i -= 1
+
+    logger.debug("Diameter: %s BFS for %s nodes.", count, len(graph))
+    return lower
+
+
+def _node_neighbors(G):
+    """Get the distinct successors and predecessors of every node, without itself."""
+    succ = {u: set(G.successors(u)) - {u} for u in G}
+    pred = {u: set(G.predecessors(u)) - {u} for u in G}
+    return succ, pred
+
+
+def _candidate_pairs(G, v, succ, pred):
+    """Get the ordered pairs whose local connectivity gives the connectivity of G.
+
+    Esfahanian-Hakimi for digraphs: a minimum vertex cut either leaves v on the
+    source side, leaves it on the sink side, or contains v, in which case it
+    separates a predecessor of v from a successor of v.
+    """
+    for w in G:
+        if w != v and w not in succ[v]:
+            yield v, w
+    for w in G:
+        if w != v and w not in pred[v]:
+            yield w, v
+    for x in pred[v]:
+        for y in succ[v]:
+            if x != y and y not in succ[x]:
+                yield x, y
+
+
+def node_connectivity(G, budget=None, samples=CONNECTIVITY_SAMPLES, seed=0):
+    """Get the node connectivity of a street graph and the method used.
+
+    Returns (connectivity, method). Street graphs usually have a node with a
+    single distinct successor or predecessor, or an articulation point, which
+    bound the connectivity to 1 without any flow computation ("bound"). Otherwise
+    the local connectivity of the Esfahanian-Hakimi pairs is computed with max
+    flows ("exact"). Unlike nx.node_connectivity, both orientations are checked,
+    so the result is the exact connectivity of the digraph.
+
+    With a time budget in seconds, the flows stop when it runs out and the
+    minimum local connectivity over random pairs is returned ("sampled"), which
+    is an upper bound.
+    """
+    if not G.is_directed():
+        G = G.to_directed()
+    if len(G) <= 1 or not nx.is_strongly_connected(G):
+        return 0, "bound"
+
+    succ, pred = _node_neighbors(G)
+    v = min(G, key=lambda u: min(len(succ[u]), len(pred[u])))
+    K = min(len(succ[v]), len(pred[v]))
+    if K <= 1:
+        return K, "bound"
+    undirected = nx.Graph(G.to_undirected(as_view=True))
+    if next(nx.articulation_points(undirected), None) is not None:
+        return 1, "bound"
+
+    H = build_auxiliary_node_connectivity(G)
+    R = build_residual_network(H, "capacity")
+
+    def local(s, t, cutoff):
+        return local_node_connectivity(G, s, t, auxiliary=H, residual=R, cutoff=cutoff)
+
+    start = time.perf_counter()
+    for s, t in _candidate_pairs(G, v, succ, pred):
+        if K <= 1:  # a strongly connected graph has connectivity >= 1
+            return K, "exact"
+        if budget is not None and time.perf_counter() - start > budget:
+            break
+        K = min(K, local(s, t, K))
+    else:
+        return K, "exact"
+
+    logger.warning(
+        "Node connectivity: time budget of %s s exceeded, the value is estimated "
+        "from %s random pairs.",
+        budget,
+        samples,
+    )
+    rng = random.Random(seed)
+    nodes = list(G)
+    for _ in range(samples):
+        s, t = rng.sample(nodes, 2)
+        if t not in succ[s]:
+            K = min(K, local(s, t, K))
+    return K, "sampled"
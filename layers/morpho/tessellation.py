@@ -0,0 +1,212 @@
+"""
+Morphological tessellation of the buildings, in tiles
+
+momepy.Tessellation builds one Voronoi diagram from points along the outline
+of every building, so its memory grows with all the buildings of a polygon.
+With a memory cap, the limit is split into tiles (a quadtree, so that dense
+areas get smaller tiles). Every tile tessellates the buildings it owns (by
+centroid) together with the buildings of a halo around it, and keeps the cells
+of the buildings it owns. The cells are stitched back by uID.
+
+A cell is exact when no building outside the halo could be closer to it than
+its own building: the cell must not reach farther than halo - radius out of
+its tile, with radius the largest distance from the cell to its building.
+Tiles with a cell that does not pass this check are tessellated again with a
+larger halo, so the result is the same as the monolithic call up to floating
+point errors.
+"""
+
+import logging
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+import geopandas as gpd
+import momepy
+import numpy as np
+import pandas as pd
+import shapely
+from shapely.geometry import box
+
+logger = logging.getLogger("log")
+
+# Inward offset of the buildings and distance between the points along their
+# outline (momepy defaults), in meters
+SHRINK = 0.4
+SEGMENT = 0.5
+
+# Peak memory of the tessellation per point of the Voronoi diagram, in bytes
+BYTES_PER_POINT = 1500
+
+# Initial width of the halo around the tiles, in meters
+HALO = 150.0
+
+
+def count_points(buildings, segment=SEGMENT):
+    """Get the number of points of the Voronoi diagram of the buildings."""
+    return int(buildings.geometry.length.sum() / segment)
+
+
+def estimate_memory(buildings):
+    """Get the peak memory of the tessellation of the buildings, in bytes."""
+    return count_points(buildings) * BYTES_PER_POINT
+
+
+def tessellate(buildings, limit, verbose=False):
+    """Tessellate the buildings within limit with momepy, in one call."""
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        tess = momepy.Tessellation(
+            buildings, unique_id="uID", limit=limit, verbose=verbose
+        )
+    return tess.tessellation
+
+
+def get_tiles(bounds, centroids, sizes, max_points, min_size):
+    """Split bounds into a quadtree of tiles.
+
+    A tile is split in four while the buildings around it (with centroids
+    within min_size / 2 of it, as a proxy for its halo) have more than
+    max_points points, and it is larger than min_size. Tiles without
+    buildings are left out. Bounds are half-open, so every centroid is in one
+    tile.
+    """
+    tiles = []
+    pending = [tuple(bounds)]
+    x, y = centroids[:, 0], centroids[:, 1]
+    margin = min_size / 2
+    while pending:
+        x0, y0, x1, y1 = pending.pop()
+        owned = (x >= x0) & (x < x1) & (y >= y0) & (y < y1)
+        if not owned.any():
+            continue
+        around = (
+            (x >= x0 - margin)
+            & (x < x1 + margin)
+            & (y >= y0 - margin)
+            & (y < y1 + margin)
+        )
+        if sizes[around].sum() <= max_points or max(x1 - x0, y1 - y0) <= min_size:
+            tiles.append((x0, y0, x1, y1))
+            continue
+        xm, ym = (x0 + x1) / 2, (y0 + y1) / 2
+        pending += [
+            (x0, y0, xm, ym),
+            (xm, y0, x1, ym),
+            (x0, ym, xm, y1),
+            (xm, ym, x1, y1),
+        ]
+    return tiles
+
+
+def _get_reach(cells, buildings, tile):
+    """Get the halo that every cell needs to be exact, in meters.
+
+    That is how far the cell reaches out of each side of its tile (left,
+    bottom, right, top) plus the largest distance from the cell to its
+    building, and the inward offset and segment of the points of momepy.
+    """
+    x0, y0, x1, y1 = tile
+    bounds = shapely.bounds(cells.geometry.values)
+    out = np.column_stack(
+        [x0 - bounds[:, 0], y0 - bounds[:, 1], bounds[:, 2] - x1, bounds[:, 3] - y1]
+    )
+    footprints = buildings.set_index("uID").geometry.loc[cells["uID"]].values
+    radius = shapely.hausdorff_distance(cells.geometry.values, footprints)
+    return np.maximum(out, 0) + (radius + 2 * SEGMENT + SHRINK)[:, None]
+
+
+def _tessellate_tile(
+    buildings, limit, tile, owned_ids, halo, open_sides, verbose=False
+):
+    """Tessellate the buildings owned by a tile.
+
+    buildings and limit are clipped to the tile and its halo. Only the sides
+    of the halo in open_sides have buildings beyond them. Returns the cells of
+    owned_ids, or None and the halo they need if it is too small.
+    """
+    cells = tessellate(buildings, limit, verbose)
+    cells = cells[cells["uID"].isin(owned_ids)]
+    if len(cells) == 0 or not any(open_sides):
+        return cells, None
+    needed = _get_reach(cells, buildings, tile)[:, open_sides].max()
+    if needed >= halo:
+        return None, needed
+    return cells, None
+
+
+def chunked_tessellation(buildings, limit, max_memory, workers=1, verbose=False):
+    """Tessellate the buildings within limit using at most max_memory bytes.
+
+    The limit is split into tiles small enough for max_memory / workers each,
+    which are tessellated in parallel with workers > 1. Gives the same cells
+    as tessellate, ordered by uID.
+    """
+    if isinstance(limit, (gpd.GeoSeries, gpd.GeoDataFrame)):
+        limit = limit.unary_union
+    max_points = max_memory / workers / BYTES_PER_POINT
+    if count_points(buildings) <= max_points:
+        return tessellate(buildings, limit, verbose)
+
+    centroids = shapely.get_coordinates(buildings.geometry.centroid.values)
+    sizes = (buildings.geometry.length / SEGMENT).to_numpy()
+    minx, miny, maxx, maxy = shapely.bounds(limit)
+    bounds = (
+        min(minx, centroids[:, 0].min()),
+        min(miny, centroids[:, 1].min()),
+        # half-open bounds: the last centroids must be inside
+        max(maxx, centroids[:, 0].max()) + 1,
+        max(maxy, centroids[:, 1].max()) + 1,
+    )
+    tiles = get_tiles(bounds, centroids, sizes, max_points, min_size=4 * HALO)
+    logger.debug("Tessellation: %s tiles for %s buildings.", len(tiles), len(buildings))
+
+    ids = buildings["uID"].to_numpy()
+    pending = []
+    for x0, y0, x1, y1 in tiles:
+        x, y = centroids[:, 0], centroids[:, 1]
+        owned = (x >= x0) & (x < x1) & (y >= y0) & (y < y1)
+        pending.append(((x0, y0, x1, y1), ids[owned], HALO))
+
+    sindex = buildings.sindex
+    limit_bounds = shapely.bounds(limit)
+    parts = []
+    while pending:
+        tasks = []
+        for tile, owned_ids, halo in pending:
+            x0, y0, x1, y1 = tile
+            window = (x0 - halo, y0 - halo, x1 + halo, y1 + halo)
+            # sides of the halo with buildings beyond them
+            open_sides = [
+                window[0] > limit_bounds[0],
+                window[1] > limit_bounds[1],
+                window[2] < limit_bounds[2],
+                window[3] < limit_bounds[3],
+            ]
+            tasks.append(
+                (
+                    buildings.iloc[np.sort(sindex.query(box(*window)))],
+                    limit.intersection(box(*window)),
+                    tile,
+                    owned_ids,
+                    halo,
+                    open_sides,
+                    verbose,
+                )
+            )
+        if workers > 1 and len(tasks) > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(_tessellate_tile, *zip(*tasks)))
+        else:
+            results = [_tessellate_tile(*task) for task in tasks]
+
+        retry = []
+        for (tile, owned_ids, halo), (cells, needed) in zip(pending, results):
+            if cells is None:
+                logger.debug("Tessellation: halo of %.0f m too small.", halo)
+                retry.append((tile, owned_ids, max(2 * halo, 1.25 * needed)))
+            else:
+                parts.append(cells)
+        pending = retry
+
+    cells = pd.concat(parts, ignore_index=True)
+    return cells.sort_values("uID").reset_index(drop=True)
@@ -0,0 +1,254 @@
+"""
+Read streets and buildings from a local .osm.pbf extract
+
+Requires pyosmium (pip install osmium). The extract is read in a single
+streaming pass and filtered by polygon, so regional extracts (e.g. from
+https://download.geofabrik.de) can be used to process cities offline.
+"""
+
+import logging
+import re
+import tempfile
+from pathlib import Path
+from xml.sax.saxutils import quoteattr
+
+import geopandas as gpd
+import networkx as nx
+import osmnx as ox
+import pandas as pd
+import shapely
+
+logger = logging.getLogger("log")
+
+# Same as the osmnx "drive" network filter: a way is excluded if any of these
+# tags matches the regular expression
+DRIVE_EXCLUDE = {
+    "area": "yes",
+    "access": "private",
+    "highway": (
+        "abandoned|bridleway|bus_guideway|construction|corridor|cycleway|elevator|"
+        "escalator|footway|no|path|pedestrian|planned|platform|proposed|raceway|"
+        "razed|service|steps|track"
+    ),
+    "motor_vehicle": "no",
+    "motorcar": "no",
+    "service": "alley|driveway|emergency_access|parking|parking_aisle|private",
+}
+
+# Margin (degrees) around the polygon bounds when selecting features
+BOUNDS_MARGIN = 0.01
+
+
+def _import_osmium():
+    """Import pyosmium, which is only needed for this data source."""
+    try:
+        import osmium
+    except ImportError as e:
+        raise ImportError(
+            "Reading .osm.pbf files requires pyosmium: pip install osmium"
+        ) from e
+    return osmium
+
+
+def is_drive(tags):
+    """Check if the tags of a way belong to the drive network."""
+    if "highway" not in tags:
+        return False
+    return not any(
+        key in tags and re.search(pattern, tags[key])
+        for key, pattern in DRIVE_EXCLUDE.items()
+    )
+
+
+def matches_tags(tags, query):
+    """Check if OSM tags match an osmnx-style tags query, e.g. {"building": True}."""
+    for key, value in query.items():
+        if key not in tags:
+            continue
+        if value is True:
+            return True
+        values = [value] if isinstance(value, str) else value
+        if tags[key] in values:
+            return True
+    return False
+
+
+def _in_bounds(lon, lat, bounds):
+    minx, miny, maxx, maxy = bounds
+    return minx <= lon <= maxx and miny <= lat <= maxy
+
+
+def _expand(bounds, margin=BOUNDS_MARGIN):
+    minx, miny, maxx, maxy = bounds
+    return minx - margin, miny - margin, maxx + margin, maxy + margin
+
+
+def read_drive_ways(filepath, bounds):
+    """Read the drive network ways with a node within bounds.
+
+    Returns the node coordinates by id and a list of (way id, node ids, tags).
+    """
+    osmium = _import_osmium()
+    nodes = {}
+    ways = []
+    processor = (
+        osmium.FileProcessor(str(filepath))
+        .with_locations()
+        .with_filter(osmium.filter.KeyFilter("highway"))
+    )
+    for obj in processor:
+        if not obj.is_way():
+            continue
+        tags = dict(obj.tags)
+        if not is_drive(tags):
+            continue
+        refs = [(node.ref, node.lon, node.lat) for node in obj.nodes]
+        if not any(_in_bounds(lon, lat, bounds) for _, lon, lat in refs):
+            continue
+        for ref, lon, lat in refs:
+            nodes[ref] = (lon, lat)
+        ways.append((obj.id, [ref for ref, _, _ in refs], tags))
+    return nodes, ways
+
+
+def write_osm_xml(filepath, nodes, ways):
+    """Write nodes and ways to an OSM XML file that osmnx can read."""
+    with open(filepath, "w", encoding="utf-8") as f:
+        f.write("<?xml version='1.0' encoding='UTF-8'?>\n")
+        f.write('<osm version="0.6" generator="cityform">\n')
+        for node_id, (lon, lat) in nodes.items():
+            f.write(f' <node id="{node_id}" lat="{lat!r}" lon="{lon!r}"/>\n')
+        for way_id, refs, tags in ways:
+            f.write(f' <way id="{way_id}">\n')
+            for ref in refs:
+                f.write(f'  <nd ref="{ref}"/>\n')
+            for key, value in tags.items():
+                f.write(f"  <tag k={quoteattr(key)} v={quoteattr(value)}/>\n")
+            f.write(" </way>\n")
+        f.write("</osm>\n")
+
+
+def graph_from_pbf(
+    filepath,
+    polygon,
+    network_type="drive",
+    simplify=True,
+    retain_all=False,
+    truncate_by_edge=False,
+    custom_filter=None,
+):
+    """Get the street graph within polygon from a .osm.pbf file.
+
+    Follows ox.graph_from_polygon: the graph is built within the polygon
+    buffered by 500 m, simplified and then truncated to the polygon.
+    """
+    if network_type != "drive" or custom_filter is not None:
+        raise ValueError("Only the drive network can be read from .osm.pbf files")
+
+    poly_proj, crs_utm = ox.projection.project_geometry(polygon)
+    poly_buff, _ = ox.projection.project_geometry(
+        poly_proj.buffer(500), crs=crs_utm, to_latlong=True
+    )
+
+    logger.debug("Reading streets from %s", filepath)
+    nodes, ways = read_drive_ways(filepath, poly_buff.bounds)
+    if not ways:
+        raise ValueError("Found no graph nodes within the requested polygon")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        xml_file = Path(tmp_dir) / "streets.osm"
+        write_osm_xml(xml_file, nodes, ways)
+        G_buff = ox.graph_from_xml(xml_file, simplify=False, retain_all=True)
+
+    G_buff = ox.truncate.truncate_graph_polygon(
+        G_buff, poly_buff, retain_all=True, truncate_by_edge=truncate_by_edge
+    )
+    if simplify:
+        G_buff = ox.simplify_graph(G_buff)
+    G = ox.truncate.truncate_graph_polygon(
+        G_buff, polygon, retain_all=retain_all, truncate_by_edge=truncate_by_edge
+    )
+    street_count = ox.stats.count_streets_per_node(G_buff, nodes=G.nodes)
+    nx.set_node_attributes(G, values=street_count, name="street_count")
+    return G
+
+
+def features_from_pbf(filepath, polygon, tags, columns=None, geom_types=None):
+    """Get the features within polygon from a .osm.pbf file.
+
+    Returns a GeoDataFrame indexed by (element_type, osmid) with one column per
+    tag, like ox.features_from_polygon. With columns, only those tags are read,
+    and with geom_types only those geometry types are kept.
+    """
+    osmium = _import_osmium()
+    bounds = _expand(polygon.bounds)
+    wkb_factory = osmium.geom.WKBFactory()
+
+    index = []
+    geometries = []
+    records = []
+    processor = (
+        osmium.FileProcessor(str(filepath))
+        .with_locations()
+        .with_areas()
+        .with_filter(osmium.filter.KeyFilter(*tags.keys()))
+    )
+    logger.debug("Reading features from %s", filepath)
+    for obj in processor:
+        if obj.is_way() or obj.is_relation():
+            continue  # polygons are read from the assembled areas
+        obj_tags = dict(obj.tags)
+        if not matches_tags(obj_tags, tags):
+            continue
+        try:
+            if obj.is_node():
+                if geom_types is not None and "Point" not in geom_types:
+                    continue
+                if not _in_bounds(obj.location.lon, obj.location.lat, bounds):
+                    continue
+                geometry = wkb_factory.create_point(obj)
+                key = ("node", obj.id)
+            else:
+                first = next(iter(next(iter(obj.outer_rings()))))
+                if not _in_bounds(first.lon, first.lat, bounds):
+                    continue
+                geometry = wkb_factory.create_multipolygon(obj)
+                key = ("way" if obj.from_way() else "relation", obj.orig_id())
+        except (RuntimeError, StopIteration):  # invalid location or geometry
+            continue
+        index.append(key)
+        geometries.append(geometry)
+        if columns is not None:
+            obj_tags = {key: obj_tags[key] for key in columns if key in obj_tags}
+        records.append(obj_tags)
+
+    if not index:
+        raise ox._errors.InsufficientResponseError(
+            "No matching features within the requested polygon"
+        )
+
+    geometries = shapely.from_wkb(geometries)
+    # Closed ways are polygons in osmnx, relations are multipolygons
+    is_way = [key[0] == "way" for key in index]
+    geometries = [
+        geom.geoms[0] if way and geom.geom_type == "MultiPolygon" else geom
+        for geom, way in zip(geometries, is_way)
+    ]
+    if geom_types is not None:
+        keep = [geom.geom_type in geom_types for geom in geometries]
+        index, geometries, records = (
+            [item for item, k in zip(items, keep) if k]
+            for items in (index, geometries, records)
+        )
+    gdf = gpd.GeoDataFrame(
+        records,
+        geometry=geometries,
+        index=pd.MultiIndex.from_tuples(index, names=["element_type", "osmid"]),
+        crs="epsg:4326",
+    )
+    gdf = gdf[gdf.intersects(polygon)]
+    if gdf.empty:
+        raise ox._errors.InsufficientResponseError(
+            "No matching features within the requested polygon"
+        )
+    return gdf
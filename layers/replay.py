@@ -0,0 +1,328 @@
+"""
+Record/replay stand-in for the Overpass and Nominatim APIs
+
+A local HTTP server that forwards requests to the real services once, saves
+the responses as fixture files and then serves them at local speed:
+
+    /overpass/...   -> config.OVERPASS_URL
+    /nominatim/...  -> config.NOMINATIM_URL
+
+Latency and 429/504 errors can be injected to test the throughput and the
+retry behaviour of the fetch layer. Point the pipeline to the server with
+CITYFORM_OVERPASS_URL=http://localhost:8080/overpass and
+CITYFORM_NOMINATIM_URL=http://localhost:8080/nominatim, or use replaying().
+
+Run it with: python -m layers.replay [replay|record|auto] --port 8080
+"""
+
+import argparse
+import base64
+import hashlib
+import json
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qsl, urlsplit
+
+import requests
+
+import config
+from layers.files import atomic_write
+
+logger = logging.getLogger("log")
+
+MODES = ["replay", "record", "auto"]
+
+# Answer of the Overpass status endpoint, which osmnx checks before every query
+OVERPASS_STATUS = """Connected as: 0
+Current time: 2024-01-01T00:00:00Z
+Announced endpoint: none
+Rate limit: 2
+2 slots available now.
+Currently running queries (pid, space limit, time limit, start time):
+"""
+
+# Request headers forwarded to the real services
+FORWARDED_HEADERS = ["User-Agent", "Content-Type", "Accept", "Accept-Language"]
+
+
+def get_key(service, method, path, query, body):
+    """Get the fixture key of a request.
+
+    Query parameters are sorted, so that the same request made by another
+    client gives the same key.
+    """
+    h = hashlib.sha256()
+    params = sorted(parse_qsl(query, keep_blank_values=True))
+    if body and method == "POST":
+        params += sorted(parse_qsl(body.decode(), keep_blank_values=True))
+    h.update(json.dumps([service, method, path, params]).encode())
+    return h.hexdigest()
+
+
+def load_fixture(directory, key):
+    """Load a recorded response, None if it was not recorded."""
+    path = Path(directory) / (key + ".json")
+    try:
+        with open(path, encoding="utf-8") as f:
+            fixture = json.load(f)
+    except FileNotFoundError:
+        return None
+    fixture["body"] = base64.b64decode(fixture["body"])
+    return fixture
+
+
+def save_fixture(directory, key, request, response):
+    """Save a response as a fixture file, atomically."""
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    fixture = {
+        "request": request,
+        "status": response.status_code,
+        "content_type": response.headers.get("Content-Type", "text/plain"),
+        "body": base64.b64encode(response.content).decode(),
+    }
+    with atomic_write(directory / (key + ".json")) as f:
+        json.dump(fixture, f, indent=1)
+
+
+class ReplayServer(ThreadingHTTPServer):
+    """HTTP server replaying the fixtures of directory.
+
+    mode is "replay" (only fixtures, 404 for unknown requests), "record"
+    (always forward and save) or "auto" (forward and save unknown requests).
+    latency (+ a random jitter) in seconds is added to every response.
+    error_rate is the probability of answering with one of error_codes, and
+    fail_first fails the first requests of every fixture, to test retries.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        directory,
+        upstreams,
+        mode="replay",
+        latency=0.0,
+        jitter=0.0,
+        error_rate=0.0,
+        error_codes=(429, 504),
+        fail_first=0,
+        seed=0,
+        host="127.0.0.1",
+        port=0,
+    ):
+        if mode not in MODES:
+            raise ValueError(f"Unknown replay mode: {mode}")
+        super().__init__((host, port), ReplayHandler)
+        self.directory = Path(directory)
+        self.upstreams = {name: url.rstrip("/") for name, url in upstreams.items()}
+        self.mode = mode
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_codes = list(error_codes)
+        self.fail_first = fail_first
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.attempts = {}
+        self.stats = {"requests": 0, "hits": 0, "recorded": 0, "misses": 0, "errors": 0}
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+
+    def get_error(self, key):
+        """Get the status code of an injected error, None for no error."""
+        with self.lock:
+            attempt = self.attempts.get(key, 0)
+            self.attempts[key] = attempt + 1
+            if attempt < self.fail_first or self.rng.random() < self.error_rate:
+                return self.rng.choice(self.error_codes)
+        return None
+
+    def get_delay(self):
+        with self.lock:
+            return self.latency + self.rng.uniform(0, self.jitter)
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    """Serve the requests of a ReplayServer."""
+
+    server: ReplayServer
+
+    def log_message(self, fmt, *args):
+        logger.debug("Replay: " + fmt, *args)
+
+    def do_GET(self):
+        self.handle_request("GET")
+
+    def do_POST(self):
+        self.handle_request("POST")
+
+    def send(self, status, body, content_type="application/json", headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def handle_request(self, method):
+        server = self.server
+        server.count("requests")
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+
+        url = urlsplit(self.path)
+        service, _, path = url.path.lstrip("/").partition("/")
+        if service not in server.upstreams:
+            self.send(404, b'{"error": "unknown service"}')
+            return
+        if service == "overpass" and path == "status":
+            self.send(200, OVERPASS_STATUS.encode(), "text/plain")
+            return
+
+        time.sleep(server.get_delay())
+        key = get_key(service, method, path, url.query, body)
+        status = server.get_error(key)
+        if status is not None:
+            server.count("errors")
+            self.send(status, b'{"error": "injected"}', headers={"Retry-After": "1"})
+            return
+
+        fixture = (
+            None if server.mode == "record" else load_fixture(server.directory, key)
+        )
+        if fixture is None and server.mode == "replay":
+            server.count("misses")
+            logger.warning("Replay: no fixture for %s %s", method, self.path)
+            self.send(404, b'{"error": "no fixture"}')
+            return
+        if fixture is None:
+            fixture = self.record(service, method, path, url.query, body, key)
+            if fixture is None:
+                return
+        else:
+            server.count("hits")
+        self.send(fixture["status"], fixture["body"], fixture["content_type"])
+
+    def record(self, service, method, path, query, body, key):
+        """Forward a request to the real service and save its response."""
+        server = self.server
+        upstream = f"{server.upstreams[service]}/{path}" + (
+            f"?{query}" if query else ""
+        )
+        headers = {k: self.headers[k] for k in FORWARDED_HEADERS if k in self.headers}
+        try:
+            response = requests.request(
+                method, upstream, data=body or None, headers=headers, timeout=180
+            )
+        except requests.RequestException as e:
+            logger.error("Replay: %s failed: %s", upstream, e)
+            self.send(502, b'{"error": "upstream failed"}')
+            return None
+        if not response.ok:
+            # errors of the real service are passed on, not recorded
+            self.send(response.status_code, response.content)
+            return None
+        request = {"service": service, "method": method, "path": path, "query": query}
+        save_fixture(server.directory, key, request, response)
+        server.count("recorded")
+        logger.debug("Replay: recorded %s", upstream)
+        return {
+            "status": response.status_code,
+            "content_type": response.headers.get("Content-Type", "text/plain"),
+            "body": response.content,
+        }
+
+
+def get_upstreams():
+    """Get the URLs of the real services."""
+    return {"overpass": config.OVERPASS_URL, "nominatim": config.NOMINATIM_URL}
+
+
+@contextmanager
+def serve(directory, upstreams=None, **kwargs):
+    """Run a ReplayServer in a background thread.
+
+    Takes the arguments of ReplayServer. Yields the server.
+    """
+    server = ReplayServer(directory, upstreams or get_upstreams(), **kwargs)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+
+@contextmanager
+def replaying(directory, **kwargs):
+    """Point the fetch layer to a ReplayServer while in the block.
+
+    Takes the arguments of ReplayServer. Yields the server.
+    """
+    previous = config.OVERPASS_URL, config.NOMINATIM_URL
+    with serve(directory, **kwargs) as server:
+        config.OVERPASS_URL = f"{server.url}/overpass"
+        config.NOMINATIM_URL = f"{server.url}/nominatim"
+        try:
+            yield server
+        finally:
+            config.OVERPASS_URL, config.NOMINATIM_URL = previous
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m layers.replay")
+    parser.add_argument("mode", nargs="?", default="replay", choices=MODES)
+    parser.add_argument("--dir", default=None, help="fixtures directory")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--fail-first", type=int, default=0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    logger.addHandler(logging.StreamHandler())
+    logger.setLevel(logging.INFO)
+    server = ReplayServer(
+        args.dir or config.REPLAY_DIR,
+        get_upstreams(),
+        mode=args.mode,
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        fail_first=args.fail_first,
+        seed=args.seed,
+        host=args.host,
+        port=args.port,
+    )
+    logger.info(
+        "Replay: serving %s on %s (%s)", server.directory, server.url, args.mode
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        logger.info("Replay: %s", server.stats)
+
+
+if __name__ == "__main__":
+    main()
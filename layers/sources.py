@@ -0,0 +1,93 @@
+"""
+OpenStreetMap data sources
+
+Streets and buildings are downloaded from the Overpass API with osmnx, unless
+config.OSM_PBF_FILE points to a local .osm.pbf extract. Results are saved in
+the disk cache (see layers.cache).
+"""
+
+import logging
+
+import osmnx as ox
+
+import config
+from layers.cache import cached
+from layers.client import route_osmnx
+from layers.pbf import features_from_pbf, graph_from_pbf
+
+logger = logging.getLogger("log")
+
+OVERPASS_SETTINGS = "[out:json][timeout:{timeout}]{maxsize}"
+
+
+def get_source():
+    """Get the name of the data source, used to tell cache entries apart."""
+    if config.OSM_PBF_FILE:
+        stat = config.OSM_PBF_FILE.stat()
+        return f"pbf:{config.OSM_PBF_FILE.resolve()}:{stat.st_size}:{stat.st_mtime}"
+    return f"overpass:{config.OVERPASS_URL}"
+
+
+def set_snapshot_date():
+    """Query Overpass for the data as of config.OSM_SNAPSHOT_DATE, if set."""
+    settings = OVERPASS_SETTINGS
+    if config.OSM_SNAPSHOT_DATE:
+        settings += f'[date:"{config.OSM_SNAPSHOT_DATE}"]'
+    ox.settings.overpass_settings = settings
+
+
+def set_endpoints():
+    """Send the osmnx requests to config.OVERPASS_URL and config.NOMINATIM_URL.
+
+    They go through the shared client, with its rate limits and retries.
+    """
+    ox.settings.overpass_url = config.OVERPASS_URL
+    ox.settings.nominatim_url = config.NOMINATIM_URL
+    route_osmnx()
+
+
+def _graph_from_polygon(polygon, **kwargs):
+    if config.OSM_PBF_FILE:
+        return graph_from_pbf(config.OSM_PBF_FILE, polygon, **kwargs)
+    set_endpoints()
+    set_snapshot_date()
+    return ox.graph_from_polygon(polygon, **kwargs)
+
+
+def _features_from_polygon(polygon, tags, columns=None, geom_types=None):
+    if config.OSM_PBF_FILE:
+        return features_from_pbf(
+            config.OSM_PBF_FILE, polygon, tags, columns, geom_types
+        )
+    set_endpoints()
+    set_snapshot_date()
+    gdf = ox.features_from_polygon(polygon, tags)
+    if geom_types is not None:
+        gdf = gdf[gdf.geom_type.isin(geom_types)]
+    if columns is not None:
+        gdf = gdf[[col for col in columns if col in gdf.columns] + ["geometry"]]
+    return gdf
+
+
+def graph_from_polygon(polygon, **kwargs):
+    """Get the street graph within polygon.
+
+    Takes the same arguments as ox.graph_from_polygon.
+    """
+    return cached("graph", _graph_from_polygon, polygon, get_source(), **kwargs)
+
+
+def features_from_polygon(polygon, tags, columns=None, geom_types=None):
+    """Get the features within polygon.
+
+    Takes the same arguments as ox.features_from_polygon. With columns, only
+    those tags are kept (OSM features have hundreds of sparse tag columns), and
+    with geom_types only those geometry types (e.g. ["Polygon"]). Both are
+    pruned before the features are cached.
+    """
+    params = {"tags": tags}
+    if columns is not None:
+        params["columns"] = list(columns)
+    if geom_types is not None:
+        params["geom_types"] = list(geom_types)
+    return cached("features", _features_from_polygon, polygon, get_source(), **params)
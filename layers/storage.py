@@ -0,0 +1,142 @@
+"""
+Storage of the stage outputs: streets, buildings and morphometrics
+
+Every output is written either as a GeoPackage (.gpkg) or as a GeoParquet file
+(.parquet). GeoParquet is columnar and written through Arrow, which is much
+faster for cities with millions of buildings, and can be read back with only
+some of its columns. Readers find an output in either format.
+
+GeoParquet requires pyarrow (pip install pyarrow).
+"""
+
+import json
+import logging
+from pathlib import Path
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+from packaging.version import Version
+from shapely.geometry import box
+
+logger = logging.getLogger("log")
+
+# Output formats and their file extensions, the first one is the default
+FORMATS = {"gpkg": ".gpkg", "parquet": ".parquet"}
+
+# Since geopandas 1.0, GeoParquet files have a bbox column to filter rows on read
+GEOPANDAS_GE_1 = Version(gpd.__version__) >= Version("1.0")
+
+
+def _import_pyarrow():
+    """Import pyarrow, which is only needed for GeoParquet."""
+    try:
+        import pyarrow
+    except ImportError as e:
+        raise ImportError(
+            "Reading and writing GeoParquet requires pyarrow: pip install pyarrow"
+        ) from e
+    return pyarrow
+
+
+def get_format(path):
+    """Get the format of a file from its extension."""
+    suffix = Path(path).suffix
+    for fmt, extension in FORMATS.items():
+        if suffix == extension:
+            return fmt
+    raise ValueError(f"Unknown output format: {path}")
+
+
+def get_path(directory, name, fmt="gpkg"):
+    """Get the path of an output, e.g. '{city} - morpho' in fmt."""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown output format: {fmt}")
+    return Path(directory) / (name + FORMATS[fmt])
+
+
+def find(directory, name, fmt="gpkg"):
+    """Find an output saved in any format, preferring fmt.
+
+    Returns None if it does not exist.
+    """
+    formats = [fmt] + [other for other in FORMATS if other != fmt]
+    for other in formats:
+        path = get_path(directory, name, other)
+        if path.exists():
+            return path
+    return None
+
+
+def glob(directory, suffix):
+    """Get the outputs of every city ending with suffix, e.g. ' - morpho'.
+
+    Returns a dict of paths by city. When a city has both formats, the most
+    recent file is used.
+    """
+    paths = {}
+    for extension in FORMATS.values():
+        for path in Path(directory).glob(f"*{suffix}{extension}"):
+            city = path.name[: -len(suffix + extension)].strip()
+            if city not in paths or path.stat().st_mtime > paths[city].stat().st_mtime:
+                paths[city] = path
+    return dict(sorted(paths.items()))
+
+
+def write(gdf, path):
+    """Write a GeoDataFrame in the format of path, replacing the file."""
+    path = Path(path)
+    fmt = get_format(path)
+    if fmt == "parquet":
+        _import_pyarrow()
+        kwargs = {"write_covering_bbox": True} if GEOPANDAS_GE_1 else {}
+        gdf.to_parquet(path, **kwargs)
+    else:
+        if path.exists():
+            path.unlink()
+        gdf.to_file(path, driver="GPKG")
+    return path
+
+
+def read(path, columns=None, bbox=None):
+    """Read a GeoDataFrame in the format of path.
+
+    columns is the list of columns to read (the geometry is always read), and
+    bbox (minx, miny, maxx, maxy) keeps the rows that intersect it, in the
+    CRS of the file.
+    """
+    path = Path(path)
+    fmt = get_format(path)
+    if fmt == "parquet":
+        _import_pyarrow()
+        if columns is not None:
+            columns = list(dict.fromkeys(list(columns) + ["geometry"]))
+        if GEOPANDAS_GE_1:
+            return gpd.read_parquet(path, columns=columns, bbox=bbox)
+        gdf = gpd.read_parquet(path, columns=columns)
+        if bbox is not None:
+            rows = gdf.sindex.query(box(*bbox), predicate="intersects")
+            gdf = gdf.iloc[np.sort(rows)]
+        return gdf
+
+    gdf = gpd.read_file(path, bbox=bbox)
+    if columns is not None:
+        gdf = gdf[[col for col in gdf.columns if col in columns or col == "geometry"]]
+    return gdf
+
+
+def read_attributes(path):
+    """Read the attributes of an output as a DataFrame, without the geometry."""
+    path = Path(path)
+    fmt = get_format(path)
+    if fmt == "parquet":
+        _import_pyarrow()
+        import pyarrow.parquet as pq
+
+        schema = pq.read_schema(path)
+        geo = json.loads(schema.metadata[b"geo"])
+        geometries = set(geo["columns"])
+        columns = [name for name in schema.names if name not in geometries]
+        return pq.read_table(path, columns=columns).to_pandas()
+
+    return pd.DataFrame(gpd.read_file(path, ignore_geometry=True))
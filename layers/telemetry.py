@@ -0,0 +1,160 @@
+"""
+Timings of the stages of every city and polygon
+
+Stages are timed with `with stage(name):` while a recorder is active, with the
+peak memory of the process at their end. Every record is tagged with the tags
+of the recorder (city, polygon, number of nodes, edges and buildings) and
+written as a JSON line to "{city} - timings.jsonl" next to the morphometrics.
+summary() ranks the slowest stages and polygons of a batch.
+"""
+
+import json
+import logging
+import sys
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import pandas as pd
+
+from layers.files import atomic_write, to_json
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logger = logging.getLogger("log")
+
+TIMINGS_SUFFIX = " - timings.jsonl"
+
+# Recorder of the current process, None when timings are not recorded
+_recorder = None
+
+
+def get_max_rss():
+    """Get the peak resident memory of the process in MB, None if unknown."""
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return max_rss / 1024**2 if sys.platform == "darwin" else max_rss / 1024
+
+
+class Recorder:
+    """Timings of the stages run while it is active."""
+
+    def __init__(self, **tags):
+        self.tags = tags
+        self.records = []
+
+    def add(self, name, seconds, **tags):
+        """Add the timing of a stage."""
+        self.records.append({"stage": name, "seconds": seconds, **tags})
+
+    def tag(self, **tags):
+        """Tag all the timings of the recorder."""
+        self.tags.update(tags)
+
+    def extend(self, records):
+        """Add the tagged timings of another recorder, e.g. of a worker."""
+        self.records.extend(records)
+
+    def get_records(self):
+        """Get the timings with the tags of the recorder."""
+        return [{**self.tags, **record} for record in self.records]
+
+
+@contextmanager
+def recording(**tags):
+    """Record the timings of the stages run in the block."""
+    global _recorder
+    previous = _recorder
+    _recorder = Recorder(**tags)
+    try:
+        yield _recorder
+    finally:
+        _recorder = previous
+
+
+@contextmanager
+def stage(name, **tags):
+    """Time a stage if timings are being recorded.
+
+    The peak memory of the process at the end of the stage is recorded too.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if _recorder is not None:
+            seconds = time.perf_counter() - start
+            _recorder.add(name, seconds, max_rss_mb=get_max_rss(), **tags)
+
+
+def tag(**tags):
+    """Tag the timings being recorded."""
+    if _recorder is not None:
+        _recorder.tag(**tags)
+
+
+def extend(records):
+    """Add the timings recorded elsewhere, e.g. by a worker process."""
+    if _recorder is not None and records:
+        _recorder.extend(records)
+
+
+def get_path(directory, city):
+    """Get the timings file of a city."""
+    return Path(directory) / (city + TIMINGS_SUFFIX)
+
+
+def save(path, records):
+    """Write timings as JSON lines, replacing the file."""
+    with atomic_write(path) as f:
+        for record in records:
+            f.write(json.dumps(record, default=to_json) + "\n")
+    logger.info("Timings:    Saved %s", path)
+
+
+def load(directory):
+    """Load the timings of all cities in directory as a DataFrame."""
+    records = []
+    for path in sorted(Path(directory).glob("*" + TIMINGS_SUFFIX)):
+        with open(path, encoding="utf-8") as f:
+            records.extend(json.loads(line) for line in f if line.strip())
+    return pd.DataFrame(records, columns=None if records else ["stage", "seconds"])
+
+
+def summary(directory, top=10):
+    """Get the slowest stages and polygons of the timings in directory.
+
+    Returns two DataFrames: the count, total, mean and maximum time by stage,
+    and the time of the polygons with their number of nodes, edges and
+    buildings.
+    """
+    df = load(directory)
+    stages = (
+        df.groupby("stage")["seconds"]
+        .agg(["count", "sum", "mean", "max"])
+        .sort_values("sum", ascending=False)
+        .head(top)
+    )
+    polygons = df[df["stage"] == "polygon"]
+    columns = ["city", "polygon", "nodes", "edges", "buildings", "seconds"]
+    # Counts are NaN in the records of the city, which makes them floats
+    polygons = polygons[[col for col in columns if col in polygons]].convert_dtypes()
+    polygons = polygons.sort_values("seconds", ascending=False).head(top)
+    return stages, polygons
+
+
+def print_summary(directory, top=10):
+    """Print the slowest stages and polygons of the timings in directory."""
+    stages, polygons = summary(directory, top)
+    if stages.empty:
+        print(f"No timings in {directory}.")
+        return
+    print(f"Slowest stages (seconds):\n{stages.round(2).to_string()}\n")
+    if not polygons.empty:
+        polygons = polygons.round(2).to_string(index=False)
+        print(f"Slowest polygons (seconds):\n{polygons}")
@@ -0,0 +1,78 @@
+"""Tests for the offline benchmarks"""
+
+import networkx as nx
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks import fixtures, kernels, scaling
+from benchmarks.kernels import run_benchmarks
+from layers.morpho.metrics import CENTRALITY_VARS, INTERMEDIATES
+
+
+@pytest.mark.parametrize("graph_type", list(fixtures.GRAPHS))
+def test_graphs_like_osmnx(graph_type):
+    """Test that the synthetic street networks are connected osmnx-like graphs"""
+    G = fixtures.GRAPHS[graph_type](6)
+    assert G.graph["crs"] == "epsg:4326"
+    assert nx.is_weakly_connected(G)
+    for _, data in G.nodes(data=True):
+        assert {"x", "y", "street_count"} <= set(data)
+    for _, _, data in G.edges(data=True):
+        assert data["length"] > 0 and "osmid" in data
+
+
+def test_buildings_in_polygon():
+    """Test that the buildings are valid polygons in the city polygon"""
+    buildings = fixtures.buildings(5)
+    assert len(buildings) == 4 * 4 * 4
+    assert buildings.is_valid.all()
+    assert buildings.within(fixtures.polygon(5)).all()
+
+
+def test_run_benchmarks():
+    """Test that kernels are timed without network access"""
+    results = run_benchmarks(["grid"], [4], ["get_entropy", "street_vars"], repeat=1)
+    assert [r["kernel"] for r in results] == ["get_entropy", "street_vars"]
+    assert all(r["seconds"] > 0 and r["peak_mb"] > 0 for r in results)
+
+
+def test_fit_exponents():
+    """Test that variables growing faster than the exponent are flagged"""
+    n = np.array([1e3, 1e4, 1e5])
+    df = pd.DataFrame(
+        {
+            "variable": ["linear"] * 3 + ["quadratic"] * 3,
+            "n": np.concatenate([n, n]),
+            "seconds": np.concatenate([n * 1e-3, n**2 * 1e-8]),
+        }
+    )
+    exponents = scaling.fit_exponents(df, exponent=1.2).set_index("variable")
+    assert exponents.loc["linear", "exponent"] == pytest.approx(1)
+    assert exponents.loc["quadratic", "exponent"] == pytest.approx(2)
+    assert list(exponents["superlinear"]) == [True, False]
+
+
+def test_variable_costs():
+    """Test that a variable costs the time of all the steps it needs"""
+    run = {
+        "nodes": 10,
+        "buildings": 40,
+        "records": [
+            {"stage": "buildings", "seconds": 1.0, "max_rss_mb": 100},
+            {"stage": "building_area", "seconds": 0.5, "max_rss_mb": 120},
+            {"stage": "avg_building_area", "seconds": 0.25, "max_rss_mb": 120},
+            {"stage": "streets_graph", "seconds": 2.0, "max_rss_mb": 150},
+        ],
+    }
+    (row,) = scaling.get_variable_costs(run, ["avg_building_area"])
+    assert row["seconds"] == 1.75
+    assert row["n"] == 40
+    assert row["max_rss_mb"] == 120
+
+
+def test_centrality_kernel():
+    """Test that the centrality kernel times the four measures, local closeness too"""
+    assert set(kernels.STEPS) <= set(INTERMEDIATES)
+    values = kernels.KERNELS["centrality"](kernels.get_inputs("grid", 4))()
+    assert set(values) == set(CENTRALITY_VARS.values())
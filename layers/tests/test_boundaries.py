@@ -0,0 +1,200 @@
+"""Tests for finding the admin_level of the boundaries of a city"""
+
+import json
+import re
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+import requests
+
+import config
+from boundaries import boundaries, store
+
+
+class Response:
+    def __init__(self, data, status_code=200):
+        self.data = data
+        self.status_code = status_code
+        self.ok = status_code == 200
+
+    def json(self):
+        return self.data
+
+    def raise_for_status(self):
+        if not self.ok:
+            raise requests.HTTPError(self.status_code)
+
+
+def fake_overpass(relations, counts=True):
+    """Fake client of an Overpass server with relations by admin_level."""
+    requested = []
+    lock = threading.Lock()
+
+    def get(url, params, timeout):
+        query = params["data"]
+        if "out count" in query:
+            if not counts:
+                return Response({}, 504)
+            levels = re.findall(r'"admin_level"="(\d+)"', query)
+            elements = [
+                {
+                    "type": "count",
+                    "tags": {"relations": str(relations.get(int(level), 0))},
+                }
+                for level in levels
+            ]
+            return Response({"elements": elements})
+        admin_level = int(re.search(r'"admin_level"="(\d+)"', query).group(1))
+        time.sleep(0.05)
+        with lock:
+            requested.append(admin_level)
+        elements = [
+            {"type": "relation", "id": i} for i in range(relations.get(admin_level, 0))
+        ]
+        return Response({"elements": elements})
+
+    return get, requested
+
+
+def test_get_admin_level_counts(monkeypatch):
+    """Test that the most granular level is found with two requests"""
+    get, requested = fake_overpass({8: 3, 6: 1})
+    monkeypatch.setattr(boundaries, "get_client", lambda: SimpleNamespace(get=get))
+    assert boundaries.get_admin_level_counts(1)[8] == 3
+    admin_level, geojson = boundaries.get_admin_level(1)
+    assert admin_level == 8
+    assert len(geojson["elements"]) == 3
+    assert requested == [8]
+
+
+def test_get_admin_level_none(monkeypatch):
+    get, requested = fake_overpass({})
+    monkeypatch.setattr(boundaries, "get_client", lambda: SimpleNamespace(get=get))
+    assert boundaries.get_admin_level(1) == (None, None)
+    assert requested == []
+
+
+@pytest.mark.parametrize("workers", [1, 3])
+def test_probe_admin_levels(monkeypatch, workers):
+    """Test that the levels are probed when the count request fails"""
+    get, requested = fake_overpass({7: 2, 4: 1}, counts=False)
+    monkeypatch.setattr(boundaries, "get_client", lambda: SimpleNamespace(get=get))
+    admin_level, geojson = boundaries.get_admin_level(1, workers=workers)
+    assert admin_level == 7
+    assert len(geojson["elements"]) == 2
+    # the coarser levels are cancelled once the answer is known
+    assert 0 not in requested
+
+
+def test_probe_admin_levels_stops_requests(monkeypatch):
+    """Test that no request is still running once the levels are probed"""
+    get, requested = fake_overpass({10: 1}, counts=False)
+    monkeypatch.setattr(boundaries, "get_client", lambda: SimpleNamespace(get=get))
+    admin_level, _ = boundaries.probe_admin_levels(1, workers=4)
+    assert admin_level == 10
+    done = list(requested)
+    time.sleep(0.2)
+    assert requested == done
+    assert len(done) < len(boundaries.ADMIN_LEVELS)
+
+
+class StreamedResponse(Response):
+    def __init__(self, text, chunk_size=7):
+        super().__init__(None)
+        self.text = text
+        self.chunk_size = chunk_size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def iter_content(self, chunk_size):
+        data = self.text.encode()
+        for i in range(0, len(data), self.chunk_size):
+            yield data[i : i + self.chunk_size]
+
+
+def fake_batch_overpass(relations, remark=None):
+    """Fake client answering batch queries with relations by city_id."""
+    queries = []
+
+    def post(url, data, timeout, stream):
+        query = data["data"]
+        queries.append(query)
+        elements = []
+        for city_id, index in re.findall(
+            r"area\(id:(\d+)\).*?index=\"(\d+)\"", query, re.DOTALL
+        ):
+            elements += [
+                {"type": "relation", "id": i, "tags": {"name": "ñ"}}
+                for i in range(relations.get(int(city_id), 0))
+            ]
+            elements.append(
+                {"type": boundaries.BATCH_MARKER, "id": 1, "tags": {"index": index}}
+            )
+        if remark:
+            elements = elements[:-2]
+        text = json.dumps(
+            {"version": 0.6, "elements": elements, "remark": remark}, indent=1
+        )
+        return StreamedResponse(text)
+
+    return post, queries
+
+
+@pytest.mark.parametrize("chunk_size", [1, 5, 1000])
+def test_iter_elements(chunk_size):
+    elements = [{"type": "node", "id": i, "tags": {"name": "]ñ,"}} for i in range(5)]
+    text = json.dumps({"version": 0.6, "elements": elements})
+    chunks = (text[i : i + chunk_size] for i in range(0, len(text), chunk_size))
+    assert list(boundaries.iter_elements(chunks)) == elements
+
+
+def test_iter_elements_remark():
+    text = '{"elements": [{"id": 1}], "remark": "runtime error: timed out"}'
+    with pytest.raises(ValueError):
+        list(boundaries.iter_elements(iter([text])))
+
+
+def test_request_batch(monkeypatch):
+    post, queries = fake_batch_overpass({1: 2, 2: 0, 3: 1})
+    monkeypatch.setattr(boundaries, "get_client", lambda: SimpleNamespace(post=post))
+    batch = [("A", 1, 8), ("B", 2, 8), ("C", 3, 6)]
+    results = dict(boundaries.request_batch(batch))
+    assert len(queries) == 1
+    assert [len(results[city]["elements"]) for city in "ABC"] == [2, 0, 1]
+    assert results["A"]["elements"][0]["tags"]["name"] == "ñ"
+
+
+def test_request_batch_error(monkeypatch):
+    """Test that only the cities complete before an error are yielded"""
+    post, _ = fake_batch_overpass({1: 2, 2: 1}, remark="runtime error: timed out")
+    monkeypatch.setattr(boundaries, "get_client", lambda: SimpleNamespace(post=post))
+    results = dict(boundaries.request_batch([("A", 1, 8), ("B", 2, 8)]))
+    assert list(results) == ["A"]
+
+
+def test_get_boundaries_batch(monkeypatch, tmp_path):
+    monkeypatch.setattr(config, "QUERY_DATA_DB", tmp_path / "query_data.sqlite")
+    for i, city in enumerate(["A", "B", "C"], 1):
+        store.save(config.QUERY_DATA_DB, city, city_id=i, admin_level=8)
+    store.save(config.QUERY_DATA_DB, "D", city_id=4)
+    post, queries = fake_batch_overpass({1: 2, 2: 1, 3: 1})
+    get, requested = fake_overpass({8: 1})
+    client = SimpleNamespace(post=post, get=get)
+    monkeypatch.setattr(boundaries, "get_client", lambda: client)
+    saved = []
+    monkeypatch.setattr(
+        boundaries, "save_boundaries", lambda city, geojson: saved.append(city)
+    )
+
+    boundaries.get_boundaries(["A", "B", "C", "D", "E: no data"], batch_size=2)
+    assert len(queries) == 2
+    # D has no admin_level and is found with the count query
+    assert requested == [8]
+    assert saved == ["A", "B", "C", "D"]
+    assert store.get_settings(config.QUERY_DATA_DB, ["D"]) == {"D": (4, 8)}
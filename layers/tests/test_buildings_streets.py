@@ -1,6 +1,9 @@
 import geopandas as gpd
+import pandas as pd
 import pytest
+from shapely.geometry import LineString, MultiPolygon, Point, box
 
+from layers import layers
 from layers.layers import get_buildings, get_polygons, get_streets
 
 city = "test"
@@ -121,3 +124,29 @@ def test_streets(streets_gdf):
     ]
     actual_columns = list(streets_gdf.columns)
     assert all(column in actual_columns for column in expected_columns)
+
+
+def test_saved_buildings_same_as_city_buildings(monkeypatch):
+    """Test that the saved buildings keep the geometries of the morphometrics"""
+    geometries = [
+        box(0, 0, 1, 1),
+        MultiPolygon([box(2, 0, 3, 1), box(4, 0, 5, 1)]),
+        LineString([(0, 2), (1, 2)]),
+        Point(0, 3),
+    ]
+    index = pd.MultiIndex.from_tuples(
+        [("way", 1), ("relation", 2), ("way", 3), ("node", 4)],
+        names=["element_type", "osmid"],
+    )
+    downloaded = gpd.GeoDataFrame(
+        {"name": None, "height": ["3", "6", None, None]},
+        geometry=geometries,
+        index=index,
+        crs="epsg:4326",
+    )
+    monkeypatch.setattr(layers, "download_buildings", lambda _: downloaded)
+
+    city_buildings = layers.get_city_buildings("test", None)
+    saved = get_buildings(None, city_buildings)
+    assert list(city_buildings.geom_type) == ["Polygon", "MultiPolygon"]
+    assert list(saved.index) == list(city_buildings.index)
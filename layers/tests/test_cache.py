@@ -0,0 +1,134 @@
+"""Tests for the OpenStreetMap disk cache"""
+
+import os
+import time
+
+import geopandas as gpd
+import pytest
+from shapely.geometry import Point, box
+
+import config
+from layers import cache, sources
+
+polygon = box(2.17, 41.38, 2.18, 41.39)
+
+
+@pytest.fixture(autouse=True)
+def cache_settings(tmp_path, monkeypatch):
+    """Use an empty cache in a temporary folder"""
+    monkeypatch.setattr(config, "OSM_CACHE", True)
+    monkeypatch.setattr(config, "OSM_CACHE_DIR", tmp_path)
+    monkeypatch.setattr(config, "OSM_CACHE_MAX_SIZE", 10**9)
+    monkeypatch.setattr(config, "OSM_CACHE_TTL", 30)
+    monkeypatch.setattr(config, "OSM_SNAPSHOT_DATE", None)
+
+
+class Fetcher:
+    """Count the calls to a fetch function"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, polygon, **params):
+        self.calls += 1
+        return {"bounds": polygon.bounds, **params}
+
+
+def test_cached_loads_from_disk():
+    """Test that a second identical request is not fetched"""
+    fetch = Fetcher()
+    first = cache.cached("graph", fetch, polygon, "overpass", network_type="drive")
+    second = cache.cached("graph", fetch, polygon, "overpass", network_type="drive")
+    assert first == second
+    assert fetch.calls == 1
+
+
+@pytest.mark.parametrize(
+    "other",
+    [
+        ("features", polygon, "overpass", {"network_type": "drive"}),
+        ("graph", box(0, 0, 1, 1), "overpass", {"network_type": "drive"}),
+        ("graph", polygon, "pbf:europe.osm.pbf", {"network_type": "drive"}),
+        ("graph", polygon, "overpass", {"network_type": "drive", "simplify": False}),
+    ],
+)
+def test_key_depends_on_request(other):
+    """Test that any change in the request gives a different key"""
+    kind, other_polygon, source, params = other
+    key = cache.get_key("graph", polygon, "overpass", network_type="drive")
+    assert cache.get_key(kind, other_polygon, source, **params) != key
+
+
+def test_key_depends_on_snapshot_date(monkeypatch):
+    key = cache.get_key("graph", polygon, "overpass")
+    monkeypatch.setattr(config, "OSM_SNAPSHOT_DATE", "2024-01-01T00:00:00Z")
+    assert cache.get_key("graph", polygon, "overpass") != key
+
+
+def test_expired_entries_are_fetched_again(monkeypatch):
+    fetch = Fetcher()
+    cache.cached("graph", fetch, polygon, "overpass")
+    path = cache.get_path(cache.get_key("graph", polygon, "overpass"))
+    old = time.time() - 31 * 24 * 3600
+    os.utime(path, (old, old))
+    cache.cached("graph", fetch, polygon, "overpass")
+    assert fetch.calls == 2
+
+
+def test_snapshot_entries_do_not_expire(monkeypatch):
+    monkeypatch.setattr(config, "OSM_SNAPSHOT_DATE", "2024-01-01T00:00:00Z")
+    fetch = Fetcher()
+    cache.cached("graph", fetch, polygon, "overpass")
+    path = cache.get_path(cache.get_key("graph", polygon, "overpass"))
+    old = time.time() - 365 * 24 * 3600
+    os.utime(path, (old, old))
+    cache.cached("graph", fetch, polygon, "overpass")
+    assert fetch.calls == 1
+
+
+def test_evict_least_recently_used():
+    keys = []
+    for i in range(3):
+        key = cache.get_key("graph", polygon, "overpass", i=i)
+        cache.save(key, list(range(1000)))
+        # Last access times in increasing order
+        os.utime(cache.get_path(key), (1000 + i, time.time()))
+        keys.append(key)
+    # Use the oldest entry, which makes the second one the least recently used
+    assert cache.load(keys[0]) is not None
+
+    size = cache.get_path(keys[0]).stat().st_size
+    cache.evict(max_size=2 * size)
+    assert cache.get_path(keys[0]).exists()
+    assert not cache.get_path(keys[1]).exists()
+    assert cache.get_path(keys[2]).exists()
+
+
+def test_cache_disabled(monkeypatch):
+    monkeypatch.setattr(config, "OSM_CACHE", False)
+    fetch = Fetcher()
+    cache.cached("graph", fetch, polygon, "overpass")
+    cache.cached("graph", fetch, polygon, "overpass")
+    assert fetch.calls == 2
+    assert not list(config.OSM_CACHE_DIR.iterdir())
+
+
+def test_features_pruned_before_caching(monkeypatch):
+    """Test that only the requested tags and geometries are cached"""
+    features = gpd.GeoDataFrame(
+        {"height": ["12", None], "name": ["a", "b"], "amenity": [None, "cafe"]},
+        geometry=[box(2.171, 41.381, 2.172, 41.382), Point(2.175, 41.385)],
+        crs="epsg:4326",
+    )
+    monkeypatch.setattr(config, "OSM_PBF_FILE", None)
+    monkeypatch.setattr(sources, "set_endpoints", lambda: None)
+    monkeypatch.setattr(sources.ox, "features_from_polygon", lambda *_: features)
+
+    params = {"columns": ["height"], "geom_types": ["Polygon", "MultiPolygon"]}
+    buildings = sources.features_from_polygon(polygon, {"building": True}, **params)
+    assert list(buildings.columns) == ["height", "geometry"]
+    assert list(buildings.geom_type) == ["Polygon"]
+
+    monkeypatch.setattr(sources.ox, "features_from_polygon", None)
+    cached = sources.features_from_polygon(polygon, {"building": True}, **params)
+    assert cached.equals(buildings)
@@ -0,0 +1,93 @@
+"""Tests for the morphometrics checkpoints"""
+
+import geopandas as gpd
+import networkx as nx
+import numpy as np
+import pytest
+from shapely.geometry import box
+
+import config
+from layers import checkpoint
+from layers.morpho import morpho
+
+params = {"full": False, "centrality_samples": None}
+
+
+def test_save_and_open(tmp_path):
+    """Test that saved polygons are loaded with their values"""
+    checkpoint.open_checkpoints(tmp_path, params)
+    checkpoint.save(tmp_path, np.int64(3), {"a": np.float64(1.5), "b": np.nan})
+    results = checkpoint.open_checkpoints(tmp_path, params)
+    assert list(results) == [3]
+    assert results[3]["a"] == 1.5
+    assert np.isnan(results[3]["b"])
+
+
+def test_changed_params_discard(tmp_path):
+    """Test that checkpoints with other parameters are discarded"""
+    checkpoint.open_checkpoints(tmp_path, params)
+    checkpoint.save(tmp_path, 0, {"a": 1.0})
+    assert checkpoint.open_checkpoints(tmp_path, {**params, "full": True}) == {}
+
+
+def test_no_temporary_files(tmp_path):
+    """Test that saving leaves no temporary files behind"""
+    checkpoint.open_checkpoints(tmp_path, params)
+    checkpoint.save(tmp_path, 0, {"a": 1.0})
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["0.json", "params.json"]
+
+
+@pytest.fixture(name="polygons")
+def fixture_polygons():
+    return gpd.GeoDataFrame(
+        {"UID": range(4)},
+        geometry=[box(i * 0.01, 0, i * 0.01 + 0.01, 0.01) for i in range(4)],
+        crs="epsg:4326",
+    )
+
+
+def test_get_morphometrics_resumes(tmp_path, polygons, monkeypatch):
+    """Test that a crashed run resumes from the finished polygons"""
+    calls = []
+
+    def crash_at_third(row, **kwargs):
+        index = row.index[0]
+        if index == 2 and not calls.count(2):
+            calls.append(index)
+            raise KeyboardInterrupt
+        calls.append(index)
+        return {"fractal-dimension": float(index)}
+
+    monkeypatch.setattr(morpho, "_polygon_morphometrics", crash_at_third)
+    with pytest.raises(KeyboardInterrupt):
+        morpho.get_morphometrics(polygons, full=False, checkpoint_dir=tmp_path)
+    assert calls == [0, 1, 2]
+
+    gdf = morpho.get_morphometrics(polygons, full=False, checkpoint_dir=tmp_path)
+    assert calls == [0, 1, 2, 2, 3]
+    assert list(gdf["fractal-dimension"]) == [0.0, 1.0, 2.0, 3.0]
+
+
+@pytest.mark.parametrize("change", ["source", "city_graph"])
+def test_get_morphometrics_other_data(tmp_path, polygons, monkeypatch, change):
+    """Test that polygons of a run with other data are computed again"""
+    calls = []
+
+    def fake_polygon(row, **kwargs):
+        calls.append(row.index[0])
+        return {"fractal-dimension": 1.0}
+
+    monkeypatch.setattr(morpho, "_polygon_morphometrics", fake_polygon)
+    monkeypatch.setattr(
+        morpho, "get_polygon_graphs", lambda gdf, graph: dict.fromkeys(gdf.index)
+    )
+    morpho.get_morphometrics(polygons, full=False, checkpoint_dir=tmp_path)
+    assert len(calls) == 4
+
+    kwargs = {}
+    if change == "source":
+        monkeypatch.setattr(config, "OVERPASS_URL", "http://localhost:8080/overpass")
+    else:
+        kwargs["city_graph"] = nx.MultiDiGraph()
+    morpho.get_morphometrics(polygons, full=False, checkpoint_dir=tmp_path, **kwargs)
+    assert len(calls) == 8
@@ -0,0 +1,118 @@
+"""Tests for reusing city-wide data in the morphometrics of each polygon"""
+
+import geopandas as gpd
+import networkx as nx
+import pytest
+from shapely.geometry import LineString, Point, box
+
+from layers.morpho.helpers import (
+    clip_buildings,
+    clip_graph,
+    get_building_index,
+    get_node_index,
+    prepare_buildings,
+)
+
+
+@pytest.fixture(scope="module")
+def city_graph():
+    """Return a 5x5 grid street graph with two-way streets"""
+    G = nx.MultiDiGraph(crs="epsg:4326")
+    for i in range(5):
+        for j in range(5):
+            G.add_node(i * 5 + j, x=float(i), y=float(j))
+    for i in range(5):
+        for j in range(5):
+            for u, v in [((i, j), (i + 1, j)), ((i, j), (i, j + 1))]:
+                if v[0] < 5 and v[1] < 5:
+                    G.add_edge(u[0] * 5 + u[1], v[0] * 5 + v[1], length=1.0)
+                    G.add_edge(v[0] * 5 + v[1], u[0] * 5 + u[1], length=1.0)
+    # Isolated street far from the grid
+    G.add_node(100, x=1.5, y=1.5)
+    G.add_node(101, x=1.6, y=1.6)
+    G.add_edge(100, 101, length=1.0)
+    return G
+
+
+@pytest.fixture(scope="module")
+def city_buildings():
+    """Return a row of buildings, one of them on the border between polygons"""
+    geometries = [box(0, 0, 1, 1), box(1.5, 0, 2.9, 1), box(3.2, 0, 4, 1)]
+    return gpd.GeoDataFrame({"height": [3, 6, 9]}, geometry=geometries)
+
+
+def test_clip_graph_truncate_by_edge(city_graph):
+    """Test that neighbors of nodes inside the polygon are kept"""
+    subgraph = clip_graph(city_graph, box(-0.5, -0.5, 0.5, 0.5))
+    assert set(subgraph.nodes) == {0, 1, 5}
+
+
+def test_clip_graph_largest_component(city_graph):
+    """Test that only the largest weakly connected component is kept"""
+    subgraph = clip_graph(city_graph, box(1.2, 1.2, 2.2, 2.2))
+    assert 100 not in subgraph.nodes
+    assert 12 in subgraph.nodes
+
+
+def test_clip_graph_reuses_index(city_graph):
+    """Test that a prebuilt node index gives the same subgraph"""
+    polygon = box(0.5, 0.5, 3.5, 3.5)
+    node_index = get_node_index(city_graph)
+    expected = clip_graph(city_graph, polygon)
+    subgraph = clip_graph(city_graph, polygon, node_index)
+    assert set(subgraph.edges) == set(expected.edges)
+    assert subgraph.graph["crs"] == "epsg:4326"
+
+
+def test_clip_graph_empty(city_graph):
+    """Test that a polygon without nodes raises a ValueError like get_graph"""
+    with pytest.raises(ValueError):
+        clip_graph(city_graph, box(10, 10, 11, 11))
+
+
+def test_clip_buildings_intersects(city_buildings):
+    """Test that every building touching the polygon is returned"""
+    buildings = clip_buildings(city_buildings, box(0, 0, 2, 2))
+    assert list(buildings["height"]) == [3, 6]
+
+
+@pytest.mark.parametrize(
+    "polygon,expected", [(box(0, 0, 2, 2), [3]), (box(2, 0, 5, 2), [6, 9])]
+)
+def test_clip_buildings_centroid(city_buildings, polygon, expected):
+    """Test that each building is assigned to the polygon with its centroid"""
+    building_index = get_building_index(city_buildings, partition="centroid")
+    buildings = clip_buildings(city_buildings, polygon, building_index)
+    assert list(buildings["height"]) == expected
+
+
+def test_building_index_unknown_partition(city_buildings):
+    """Test that an unknown partition raises a ValueError"""
+    with pytest.raises(ValueError):
+        get_building_index(city_buildings, partition="within")
+
+
+def test_prepare_buildings():
+    """Test that only the footprints and the heights are kept"""
+    geometries = [
+        box(2.0, 41.0, 2.001, 41.001),
+        Point(2, 41),
+        box(2.002, 41.0, 2.003, 41.001),
+    ]
+    buildings = gpd.GeoDataFrame(
+        {"height": ["12", "3", "12 m"], "name": ["a", "b", None], "building": "yes"},
+        geometry=geometries,
+        crs="epsg:4326",
+    )
+    result = prepare_buildings(buildings)
+    assert list(result.columns) == ["height", "geometry"]
+    assert list(result.index) == [0, 1]
+    assert result["height"].dtype == "float32"
+    assert list(result["height"]) == [12.0, 0.0]
+    assert result.crs.is_projected
+
+
+def test_prepare_buildings_without_heights():
+    geometries = [box(2.0, 41.0, 2.001, 41.001), LineString([(2, 41), (2.001, 41)])]
+    buildings = gpd.GeoDataFrame(geometry=geometries, crs="epsg:4326")
+    assert list(prepare_buildings(buildings).columns) == ["geometry"]
@@ -0,0 +1,131 @@
+"""Tests for the shared HTTP client of the web services"""
+
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import osmnx as ox
+import pytest
+import requests
+
+import config
+from layers import client
+from layers.replay import OVERPASS_STATUS
+
+
+class FlakyHandler(BaseHTTPRequestHandler):
+    """Answers 503 to the first failures requests, then 200."""
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def do_GET(self):
+        self.server.requests += 1
+        status = 503 if self.server.requests <= self.server.failures else 200
+        self.send_response(status)
+        self.send_header("Retry-After", "0")
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+
+@pytest.fixture(name="flaky")
+def fixture_flaky():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FlakyHandler)
+    server.requests = 0
+    server.failures = 2
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server, f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_token_bucket():
+    """Test that requests beyond the burst wait for their token"""
+    bucket = client.TokenBucket(rate=20, burst=2)
+    start = time.perf_counter()
+    waits = [bucket.acquire() for _ in range(6)]
+    assert waits[:2] == [0, 0]
+    assert time.perf_counter() - start >= 0.18
+
+
+def test_parse_retry_after():
+    assert client.parse_retry_after("3") == 3
+    assert client.parse_retry_after(None) is None
+    assert client.parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0
+    assert client.parse_retry_after("soon") is None
+
+
+def test_parse_overpass_status():
+    assert client.parse_overpass_status(OVERPASS_STATUS) == 0
+    status = OVERPASS_STATUS.replace(
+        "2 slots available now.",
+        "Slot available after: 2024-01-01T00:00:10Z, in 7 seconds.\n"
+        "Slot available after: 2024-01-01T00:00:30Z, in 27 seconds.",
+    )
+    assert client.parse_overpass_status(status) == 7
+    assert client.parse_overpass_status("") is None
+
+
+def test_retries(flaky, monkeypatch):
+    """Test that 503 answers are retried until the request succeeds"""
+    server, url = flaky
+    monkeypatch.setattr(client, "get_backoff", lambda attempt: 0)
+    response = client.Client({}, max_retries=3).get(url, timeout=5)
+    assert response.status_code == 200
+    assert server.requests == 3
+
+
+def test_retries_run_out(flaky, monkeypatch):
+    server, url = flaky
+    monkeypatch.setattr(client, "get_backoff", lambda attempt: 0)
+    response = client.Client({}, max_retries=1).get(url, timeout=5)
+    assert response.status_code == 503
+    assert server.requests == 2
+
+
+def test_connection_errors_raise(monkeypatch):
+    monkeypatch.setattr(client, "get_backoff", lambda attempt: 0)
+    with pytest.raises(requests.ConnectionError):
+        client.Client({}, max_retries=1).get("http://127.0.0.1:9", timeout=1)
+
+
+def test_rate_limit_per_service(flaky, monkeypatch):
+    """Test that only the requests to a service take its tokens"""
+    server, url = flaky
+    server.failures = 0
+    monkeypatch.setattr(config, "OVERPASS_URL", url + "/api")
+    assert client.get_service(url + "/api/interpreter") == "overpass"
+    assert client.get_service(url + "/other") is None
+    c = client.Client({"overpass": 0.001})
+    c.get(url + "/api/interpreter", timeout=5)
+    c.get(url + "/api/status", timeout=5)
+    c.get(url + "/other", timeout=5)
+    assert c.buckets["overpass"].tokens == pytest.approx(1, abs=0.01)
+
+
+def test_geocoder_uses_client():
+    geocoder = client.get_geocoder("http://127.0.0.1:9/nominatim")
+    assert geocoder.adapter.session is client.get_client()
+    assert geocoder.api == "http://127.0.0.1:9/nominatim/search"
+
+
+def test_route_osmnx(flaky, monkeypatch):
+    """Test that the requests of osmnx take tokens and are retried"""
+    server, url = flaky
+    monkeypatch.setattr(client, "get_backoff", lambda attempt: 0)
+    monkeypatch.setattr(config, "OVERPASS_URL", url + "/api")
+    c = client.Client({"overpass": 10}, max_retries=3)
+    monkeypatch.setattr(client, "get_client", lambda: c)
+    monkeypatch.setattr(ox.settings, "requests_kwargs", {})
+    client.route_osmnx()
+
+    # as sent by osmnx
+    response = requests.get(
+        url + "/api/interpreter", timeout=5, **ox.settings.requests_kwargs
+    )
+    assert response.status_code == 200
+    assert server.requests == 3
+    # the three requests took a token each, out of a burst of two
+    assert c.buckets["overpass"].tokens < 0.5
@@ -0,0 +1,113 @@
+"""Tests for the consolidation of the morphometrics into one CSV"""
+
+import geopandas as gpd
+import pandas as pd
+import pytest
+from shapely.geometry import box
+
+from layers import consolidate, storage
+
+
+def write_city(directory, city, values):
+    gdf = gpd.GeoDataFrame(
+        {"UID": range(len(values)), "fractal-dimension": values},
+        geometry=[box(i, 0, i + 1, 1) for i in range(len(values))],
+        crs="epsg:4326",
+    )
+    storage.write(gdf, storage.get_path(directory, city + " - morpho"))
+
+
+@pytest.fixture(name="dirs")
+def fixture_dirs(tmp_path):
+    morpho_dir = tmp_path / "2_morphometrics"
+    morpho_dir.mkdir()
+    return morpho_dir, tmp_path / "partitions", tmp_path / "Morphometrics.csv"
+
+
+def test_consolidate(dirs):
+    """Test that the CSV has the attributes of every city"""
+    morpho_dir, partitions_dir, out_csv = dirs
+    write_city(morpho_dir, "A", [1.0, 2.0])
+    write_city(morpho_dir, "B", [3.0])
+
+    consolidate.consolidate(morpho_dir, partitions_dir, out_csv)
+    df = pd.read_csv(out_csv)
+    assert list(df.columns) == ["UID", "fractal-dimension", "city"]
+    assert list(df["city"]) == ["A", "A", "B"]
+    assert list(df["fractal-dimension"]) == [1.0, 2.0, 3.0]
+
+
+def test_only_changed_cities_read(dirs, monkeypatch):
+    """Test that only new or changed cities are read again"""
+    morpho_dir, partitions_dir, out_csv = dirs
+    write_city(morpho_dir, "A", [1.0])
+    write_city(morpho_dir, "B", [2.0])
+    consolidate.consolidate(morpho_dir, partitions_dir, out_csv)
+
+    read = []
+    read_attributes = storage.read_attributes
+
+    def counting_read(path):
+        read.append(path.name)
+        return read_attributes(path)
+
+    monkeypatch.setattr(storage, "read_attributes", counting_read)
+    _, changed, removed = consolidate.update_partitions(morpho_dir, partitions_dir)
+    assert not read and not changed and not removed
+
+    write_city(morpho_dir, "B", [5.0, 6.0])
+    write_city(morpho_dir, "C", [7.0])
+    consolidate.consolidate(morpho_dir, partitions_dir, out_csv)
+    assert read == ["B - morpho.gpkg", "C - morpho.gpkg"]
+    df = pd.read_csv(out_csv)
+    assert list(df["city"]) == ["A", "B", "B", "C"]
+    assert list(df["fractal-dimension"]) == [1.0, 5.0, 6.0, 7.0]
+
+
+def test_removed_city(dirs):
+    """Test that cities without a morphometrics file are removed"""
+    morpho_dir, partitions_dir, out_csv = dirs
+    write_city(morpho_dir, "A", [1.0])
+    write_city(morpho_dir, "B", [2.0])
+    consolidate.consolidate(morpho_dir, partitions_dir, out_csv)
+
+    storage.get_path(morpho_dir, "A - morpho").unlink()
+    consolidate.consolidate(morpho_dir, partitions_dir, out_csv)
+    assert list(pd.read_csv(out_csv)["city"]) == ["B"]
+    assert list(consolidate.load_manifest(partitions_dir)) == ["B"]
+    assert not consolidate.get_partition_path(partitions_dir, "A").exists()
+
+
+def test_csv_rewritten_when_partitions_change(dirs, monkeypatch):
+    """Test that the CSV is written again unless its partitions are the same"""
+    _, partitions_dir, out_csv = dirs
+    partitions_dir.mkdir()
+    manifest = {}
+
+    def set_city(city, value):
+        path = consolidate.get_partition_path(partitions_dir, city)
+        pd.DataFrame({"fractal-dimension": [value], "city": city}).to_csv(
+            path, index=None
+        )
+        manifest[city] = {"file": city, "size": 1, "mtime": value}
+
+    def update_partitions(*_):
+        return dict(manifest), [], []
+
+    monkeypatch.setattr(consolidate, "update_partitions", update_partitions)
+
+    set_city("A", 1)
+    consolidate.consolidate(None, partitions_dir, out_csv)
+    written = out_csv.stat().st_mtime_ns
+    consolidate.consolidate(None, partitions_dir, out_csv)
+    assert out_csv.stat().st_mtime_ns == written
+
+    # the manifest changes within the resolution of the modification times
+    set_city("A", 2)
+    consolidate.consolidate(None, partitions_dir, out_csv)
+    assert list(pd.read_csv(out_csv)["fractal-dimension"]) == [2]
+
+    # a CSV edited since it was written is written again
+    out_csv.write_text("edited\n")
+    consolidate.consolidate(None, partitions_dir, out_csv)
+    assert list(pd.read_csv(out_csv)["fractal-dimension"]) == [2]
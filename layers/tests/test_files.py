@@ -0,0 +1,27 @@
+"""Tests for the atomic writes of files"""
+
+import json
+
+import numpy as np
+import pytest
+
+from layers.files import atomic_write, to_json
+
+
+def test_atomic_write(tmp_path):
+    path = tmp_path / "a.json"
+    with atomic_write(path) as f:
+        json.dump({"a": np.float32(1.5), "b": np.int64(2)}, f, default=to_json)
+    assert json.loads(path.read_text()) == {"a": 1.5, "b": 2}
+    assert [p.name for p in tmp_path.iterdir()] == ["a.json"]
+
+
+def test_atomic_write_error(tmp_path):
+    """Test that a failed write leaves the file as it was"""
+    path = tmp_path / "a.txt"
+    path.write_text("old")
+    with pytest.raises(TypeError):
+        with atomic_write(path) as f:
+            json.dump({"a": object()}, f, default=to_json)
+    assert path.read_text() == "old"
+    assert [p.name for p in tmp_path.iterdir()] == ["a.txt"]
@@ -0,0 +1,297 @@
+"""Tests for the morphometric kernels on small synthetic street networks"""
+
+import momepy
+import networkx as nx
+import numpy as np
+import osmnx as ox
+import pytest
+from shapely.geometry import LineString
+
+from benchmarks import fixtures
+from layers.morpho.centrality import centrality, get_centrality, get_sample_size
+from layers.morpho.helpers import (
+    count_and_merge,
+    fractal_dimension,
+    get_bearings,
+    get_edge_bearings,
+    get_entropies,
+    get_entropy,
+    get_orientation_order,
+    get_orientation_orders,
+    rasterize_graph,
+)
+from layers.morpho.network import diameter, node_connectivity
+
+
+def grid_graph(size=10, spacing=100.0, crs="epsg:32631"):
+    """Return a projected grid street network with two-way streets"""
+    G = nx.MultiDiGraph(crs=crs)
+    for i in range(size):
+        for j in range(size):
+            G.add_node(i * size + j, x=i * spacing, y=j * spacing)
+    for i in range(size):
+        for j in range(size):
+            for di, dj in [(1, 0), (0, 1)]:
+                if i + di < size and j + dj < size:
+                    u, v = i * size + j, (i + di) * size + j + dj
+                    G.add_edge(u, v, length=spacing, osmid=len(G.edges))
+                    G.add_edge(v, u, length=spacing, osmid=len(G.edges) - 1)
+    return G
+
+
+@pytest.fixture(scope="module", name="grid")
+def fixture_grid():
+    return grid_graph()
+
+
+def test_rasterize_graph_is_boolean(grid):
+    """Test that the rasterized network is a boolean grid of the given size"""
+    raster = rasterize_graph(grid, resolution=256)
+    assert raster.dtype == bool
+    assert max(raster.shape) == 256
+    assert 0 < raster.mean() < 1
+
+
+def test_rasterize_graph_edge_geometry():
+    """Test that curved edges are drawn along their geometry"""
+    G = nx.MultiDiGraph(crs="epsg:32631")
+    G.add_node(0, x=0.0, y=0.0)
+    G.add_node(1, x=100.0, y=0.0)
+    G.add_edge(0, 1, geometry=LineString([(0, 0), (50, 100), (100, 0)]))
+    raster = rasterize_graph(G, resolution=101, line_width=1, node_size=0)
+    # The top row (y=100) is only reached by the curved geometry
+    assert raster[2].any()
+
+
+def test_fractal_dimension_deterministic(grid):
+    """Test that the fractal dimension does not change between runs"""
+    first = fractal_dimension(rasterize_graph(grid))
+    second = fractal_dimension(rasterize_graph(grid))
+    assert first == second
+    assert 1 < first < 2
+
+
+@pytest.fixture(scope="module", name="latlon_grid")
+def fixture_latlon_grid():
+    return grid_graph(size=5, spacing=0.001, crs="epsg:4326")
+
+
+def test_edge_bearings_grid(latlon_grid):
+    """Test that a grid has one bearing per two-way street, all north or east"""
+    bearings, weights = get_edge_bearings(latlon_grid)
+    assert len(bearings) == 2 * 5 * 4
+    assert set(np.round(bearings) % 180) == {0, 90}
+    assert (weights == 1).all()
+
+
+def test_edge_bearings_weighted(latlon_grid):
+    """Test that the weights are the street lengths"""
+    _, weights = get_edge_bearings(latlon_grid, weight_by_length=True)
+    assert np.allclose(weights, 0.001)
+
+
+def test_edge_bearings_projected(grid):
+    """Test that a projected graph is rejected"""
+    with pytest.raises(ValueError):
+        get_edge_bearings(grid)
+
+
+def test_weighted_histogram_matches_replication():
+    """Test that weighting by length matches replicating bearings by length"""
+    bearings = np.array([1.0, 44.0, 91.0, 359.9])
+    weights = np.array([3, 1, 2, 5])
+    weighted = count_and_merge(36, bearings, weights=weights)
+    replicated = count_and_merge(36, np.repeat(bearings, weights))
+    assert np.array_equal(weighted, replicated)
+
+
+def test_orientation_order_grid(latlon_grid):
+    """Test that a grid has its four bearings in four equal bins"""
+    expected = 1 - (np.log(2) / np.log(18)) ** 2
+    assert get_entropy(latlon_grid) == pytest.approx(expected)
+
+
+def test_orientation_order_uniform():
+    """Test that uniform bearings have an orientation order of 0"""
+    assert get_orientation_order(np.ones(36)) == pytest.approx(0)
+    assert np.isnan(get_orientation_order(np.zeros(36)))
+
+
+def test_orientation_orders_many_bins():
+    """Test that one pass gives the same orders as a histogram per bin count"""
+    rng = np.random.default_rng(0)
+    bearings = np.round(rng.uniform(0, 360, 500), 1)
+    weights = rng.uniform(1, 100, 500)
+    orders = get_orientation_orders(bearings, weights, sizes=(18, 36, 72))
+    for n, order in orders.items():
+        expected = get_orientation_order(count_and_merge(n, bearings, weights))
+        assert order == pytest.approx(expected)
+
+
+def test_entropies_batch(latlon_grid):
+    """Test that a batch of graphs gives the entropy of each graph"""
+    G = latlon_grid.copy()
+    G.add_node(100, x=0.0005, y=0.0015)
+    G.add_edge(0, 100, length=100.0, osmid=1000)
+    entropies = get_entropies([latlon_grid, G, nx.MultiDiGraph(crs="epsg:4326")])
+    assert entropies[0] == pytest.approx(get_entropy(latlon_grid))
+    assert entropies[1] == pytest.approx(get_entropy(G))
+    assert np.isnan(entropies[2])
+    bearings = get_bearings(G)
+    assert entropies[1] == pytest.approx(
+        get_orientation_order(count_and_merge(36, bearings))
+    )
+
+
+@pytest.fixture(scope="module", name="primal")
+def fixture_primal(grid):
+    G = grid.copy()
+    # remove a few streets, so that nodes differ in centrality
+    G.remove_edges_from([(0, 1), (1, 0), (44, 54), (54, 44), (77, 78), (78, 77)])
+    edges = ox.graph_to_gdfs(ox.get_undirected(G), nodes=False, fill_edge_geometry=True)
+    return momepy.gdf_to_nx(edges, approach="primal")
+
+
+def test_sample_size():
+    """Test the number of sampled nodes"""
+    assert get_sample_size(1000) is None
+    assert get_sample_size(1000, 100) == 100
+    assert get_sample_size(1000, 2000) is None
+    assert get_sample_size(10**6, 0.1) == 1382
+    with pytest.raises(ValueError):
+        get_sample_size(1000, 0)
+
+
+def test_centrality_matches_momepy(primal):
+    """Test that one sweep gives the same values as the momepy functions"""
+    values = centrality(primal, radius=250)
+    expected = {
+        "betweenness": momepy.betweenness_centrality(
+            primal, name="value", mode="nodes", weight="mm_len"
+        ),
+        "closeness_local": momepy.closeness_centrality(
+            primal, name="value", radius=250, distance="mm_len", verbose=False
+        ),
+        "closeness_global": momepy.closeness_centrality(primal, name="value"),
+        "straightness": momepy.straightness_centrality(
+            primal, name="value", verbose=False
+        ),
+    }
+    for name, graph in expected.items():
+        reference = [graph.nodes[node]["value"] for node in primal.nodes]
+        assert np.allclose(values[name], reference), name
+
+
+def test_centrality_measures(primal):
+    """Test that the measures computed alone match the full sweep"""
+    values = centrality(primal, radius=250)
+    for measures in [["betweenness"], ["closeness_local"], ["straightness"]]:
+        subset = centrality(primal, radius=250, measures=measures)
+        assert list(subset) == measures
+        assert np.allclose(subset[measures[0]], values[measures[0]])
+
+
+def test_sampled_centrality(primal):
+    """Test that the same seed samples the same nodes"""
+    exact = get_centrality(primal, radius=250)
+    first = get_centrality(primal, radius=250, k=40, seed=1)
+    assert first == get_centrality(primal, radius=250, k=40, seed=1)
+    for name, value in first.items():
+        assert value == pytest.approx(exact[name], rel=0.25), name
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_diameter_random_graphs(seed):
+    """Test that the diameter matches nx.diameter"""
+    G = nx.random_geometric_graph(100, 0.2, seed=seed)
+    G = G.subgraph(max(nx.connected_components(G), key=len))
+    assert diameter(G) == nx.diameter(G)
+    assert diameter(G, max_bfs=3) <= nx.diameter(G)
+
+
+def test_diameter_street_graph(grid):
+    """Test the diameter of an undirected street network"""
+    assert diameter(ox.get_undirected(grid)) == 18
+    assert diameter(grid.to_undirected()) == 18
+
+
+def test_diameter_disconnected():
+    """Test that a disconnected graph raises like nx.diameter"""
+    G = nx.Graph([(0, 1), (2, 3)])
+    with pytest.raises(nx.NetworkXError):
+        diameter(G)
+
+
+def brute_force_connectivity(G):
+    """Minimum local node connectivity over all ordered non-adjacent pairs"""
+    if not nx.is_strongly_connected(G):
+        return 0
+    return min(
+        [len(G) - 1]
+        + [
+            nx.node_connectivity(G, s, t)
+            for s in G
+            for t in G
+            if s != t and t not in G[s]
+        ]
+    )
+
+
+@pytest.mark.parametrize("seed", range(30))
+def test_node_connectivity_random_digraphs(seed):
+    """Test that the connectivity is the exact connectivity of the digraph"""
+    G = nx.gnp_random_graph(10, 0.3 + seed / 50, seed=seed, directed=True)
+    connectivity, _ = node_connectivity(G)
+    assert connectivity == brute_force_connectivity(G)
+
+
+def test_node_connectivity_street_graph(grid):
+    """Test the bounds on a grid of two-way streets"""
+    # corners have two neighbours, there are no articulation points
+    assert node_connectivity(grid) == (2, "exact")
+    G = grid.copy()
+    G.remove_edge(1, 0)  # one-way street out of a corner
+    assert node_connectivity(G) == (1, "bound")
+    G.remove_edge(10, 0)  # the corner can no longer be reached
+    assert node_connectivity(G) == (0, "bound")
+
+
+@pytest.mark.parametrize("seed", range(4))
+@pytest.mark.parametrize("name", fixtures.GRAPHS)
+def test_node_connectivity_same_as_networkx(name, seed):
+    """Test the connectivity of street graphs against nx.node_connectivity
+
+    With two-way streets only, the value is the same. One-way streets can make
+    nx.node_connectivity over-report: it only checks one orientation of each
+    pair and takes weakly connected digraphs as connected.
+    """
+    G = fixtures.GRAPHS[name](5, seed=seed)
+    two_way = nx.DiGraph(G)
+    two_way.add_edges_from([(v, u) for u, v in G.edges()])
+    assert node_connectivity(two_way)[0] == nx.node_connectivity(two_way)
+
+    connectivity, _ = node_connectivity(G)
+    assert connectivity == brute_force_connectivity(nx.DiGraph(G))
+    assert connectivity <= nx.node_connectivity(G)
+
+
+def test_node_connectivity_one_way_streets():
+    """Test the street graphs where nx.node_connectivity over-reports"""
+    # weakly but not strongly connected: some nodes cannot be reached
+    G = fixtures.organic_graph(4, seed=2)
+    assert nx.node_connectivity(G) == 1
+    assert node_connectivity(G) == (0, "bound")
+    # a single node separates some pairs in one orientation only
+    G = fixtures.random_planar_graph(4, seed=3)
+    assert nx.node_connectivity(G) == 2
+    assert node_connectivity(G) == (1, "bound")
+
+
+def test_node_connectivity_budget():
+    """Test that the estimate is used when the time budget runs out"""
+    G = nx.gnp_random_graph(30, 0.5, seed=1, directed=True)
+    exact, method = node_connectivity(G)
+    assert method == "exact"
+    estimate, method = node_connectivity(G, budget=0)
+    assert method == "sampled"
+    assert estimate >= exact
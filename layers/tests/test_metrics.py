@@ -0,0 +1,119 @@
+"""Tests for the metric graph of the morphometrics"""
+
+import geopandas as gpd
+import pytest
+
+from benchmarks import fixtures
+from layers.morpho import metrics, morpho
+
+
+def test_plan_only_needed_steps():
+    """Test that the plan has only the intermediates of the variables"""
+    plan = metrics.get_plan(["avg_building_area"])
+    assert plan == ["buildings_gdf", "buildings", "building_area", "avg_building_area"]
+
+    plan = metrics.get_plan(["avg_street_length", "total_street_length"])
+    assert plan == [
+        "graph",
+        "basic_stats",
+        "avg_street_length",
+        "total_street_length",
+    ]
+
+
+def test_plan_centrality():
+    """Test that centrality only needs the diameter for local closeness"""
+    plan = metrics.get_plan(["avg_betweenness_centrality"])
+    assert "diameter" not in plan
+    assert "diameter" not in metrics.get_plan(morpho.get_variables_list(False))
+    plan = metrics.get_plan(["avg_local_closeness_centrality"])
+    assert plan.index("diameter") < plan.index("centrality")
+
+
+def test_centrality_one_sweep(monkeypatch):
+    """Test that the four centrality measures come from one sweep"""
+    calls = []
+
+    def fake_centrality(graph, radius=None, k=None, seed=None, measures=None):
+        calls.append((radius, sorted(measures)))
+        return dict.fromkeys(measures, 1.0)
+
+    monkeypatch.setattr(metrics, "get_centrality", fake_centrality)
+    variables = list(metrics.CENTRALITY_VARS)
+    values = metrics.compute_metrics(
+        variables, polygon=None, area=1.0, graph=fixtures.grid_graph(4), diameter=8
+    )
+    assert calls == [(2.0, sorted(metrics.CENTRALITY_VARS.values()))]
+    assert all(values[variable] == 1.0 for variable in variables)
+
+
+def test_fractal_resolution(monkeypatch):
+    """Test that the fractal dimension is computed at the option resolution"""
+    resolutions = []
+
+    def fake_fractal_dimension(graph, resolution=None):
+        resolutions.append(resolution)
+        return 1.5
+
+    monkeypatch.setattr(metrics, "get_fractal_dimension", fake_fractal_dimension)
+    graph = fixtures.grid_graph(4)
+    for options in [None, {"fractal_resolution": 256}]:
+        values = metrics.compute_metrics(
+            ["fractal-dimension"], options, polygon=None, area=1.0, graph=graph
+        )
+        assert values["fractal-dimension"] == 1.5
+    assert resolutions == [metrics.FRACTAL_RESOLUTION, 256]
+
+
+def test_plan_extra_columns():
+    """Test that extra columns follow their parent variable"""
+    plan = metrics.get_plan(["avg_node_connectivity"])
+    assert plan[-1] == "avg_node_connectivity_method"
+
+
+def test_unknown_variable():
+    """Test that unknown variables raise an error"""
+    with pytest.raises(ValueError, match="not-a-variable"):
+        metrics.get_plan(["not-a-variable"])
+    with pytest.raises(ValueError, match="not-a-variable"):
+        morpho.get_variables_list(True, ["fractal-dimension", "not-a-variable"])
+
+
+def test_each_step_computed_once(monkeypatch):
+    """Test that shared intermediates are computed once per polygon"""
+    calls = []
+
+    def base(polygon):
+        calls.append("base")
+        return polygon * 2
+
+    monkeypatch.setitem(
+        metrics.INTERMEDIATES,
+        "base",
+        metrics.Step("base", base, ("polygon",), (), None),
+    )
+    monkeypatch.setitem(
+        metrics.METRICS,
+        "double",
+        metrics.Step("double", lambda x: x, ("base",), (), None),
+    )
+    monkeypatch.setitem(
+        metrics.METRICS,
+        "quadruple",
+        metrics.Step("quadruple", lambda x: 2 * x, ("base",), (), None),
+    )
+
+    values = metrics.compute_metrics(["double", "quadruple"], polygon=3, area=1)
+    assert values == {"double": 6, "quadruple": 12}
+    assert calls == ["base"]
+
+
+def test_missing_requirement():
+    """Test that variables of a polygon without buildings are left out"""
+    values = metrics.compute_metrics(
+        ["total_area", "avg_building_area"],
+        polygon=None,
+        area=5.0,
+        buildings_gdf=gpd.GeoDataFrame(geometry=[]),
+    )
+    assert values == {"total_area": 5.0}
@@ -0,0 +1,101 @@
+"""Tests for reading streets and buildings from .osm.pbf files"""
+
+import osmnx as ox
+import pytest
+from shapely.geometry import box
+
+from layers.pbf import features_from_pbf, graph_from_pbf, is_drive
+
+osmium = pytest.importorskip("osmium")
+
+# A 3x3 grid of streets around Barcelona with one building
+LON, LAT, STEP = 2.17, 41.38, 0.001
+
+
+@pytest.fixture(scope="module")
+def pbf_file(tmp_path_factory):
+    """Write a small .osm.pbf file"""
+    from osmium.osm.mutable import Node, Way
+
+    filepath = tmp_path_factory.mktemp("pbf") / "test.osm.pbf"
+    writer = osmium.SimpleWriter(str(filepath))
+    for i in range(3):
+        for j in range(3):
+            location = (LON + i * STEP, LAT + j * STEP)
+            writer.add_node(Node(id=1 + i * 3 + j, location=location))
+    corners = [(0.2, 0.2), (0.4, 0.2), (0.4, 0.4), (0.2, 0.4)]
+    for n, (x, y) in enumerate(corners, start=100):
+        writer.add_node(Node(id=n, location=(LON + x * STEP, LAT + y * STEP)))
+    ways = [
+        (1, [1, 2, 3], {"highway": "residential"}),
+        (2, [4, 5, 6], {"highway": "residential", "oneway": "yes"}),
+        (3, [7, 8, 9], {"highway": "residential"}),
+        (4, [1, 4, 7], {"highway": "primary"}),
+        (5, [3, 6, 9], {"highway": "residential"}),
+        (6, [2, 5], {"highway": "footway"}),
+        (7, [100, 101, 102, 103, 100], {"building": "yes", "height": "12"}),
+    ]
+    for way_id, refs, tags in ways:
+        writer.add_way(Way(id=way_id, nodes=refs, tags=tags))
+    writer.close()
+    return filepath
+
+
+@pytest.fixture(scope="module")
+def polygon():
+    return box(LON - STEP, LAT - STEP, LON + 3 * STEP, LAT + 3 * STEP)
+
+
+@pytest.mark.parametrize(
+    "tags,expected",
+    [
+        ({"highway": "residential"}, True),
+        ({"highway": "footway"}, False),
+        ({"highway": "service"}, False),
+        ({"highway": "primary", "access": "private"}, False),
+        ({"building": "yes"}, False),
+    ],
+)
+def test_is_drive(tags, expected):
+    assert is_drive(tags) == expected
+
+
+def test_graph_from_pbf(pbf_file, polygon):
+    """Test that the drive network is read without the footway"""
+    G = graph_from_pbf(pbf_file, polygon, simplify=False, retain_all=True)
+    assert set(G.nodes) == set(range(1, 10))
+    assert not G.has_edge(2, 5)
+    # One-way street
+    assert G.has_edge(4, 5) and not G.has_edge(5, 4)
+    assert G.has_edge(1, 2) and G.has_edge(2, 1)
+
+
+def test_graph_from_pbf_empty(pbf_file):
+    """Test that a polygon without streets raises a ValueError"""
+    with pytest.raises(ValueError):
+        graph_from_pbf(pbf_file, box(10, 10, 10.1, 10.1))
+
+
+def test_features_from_pbf(pbf_file, polygon):
+    """Test that buildings are read like ox.features_from_polygon"""
+    buildings = features_from_pbf(pbf_file, polygon, {"building": True})
+    assert list(buildings.index) == [("way", 7)]
+    assert buildings.geom_type.iloc[0] == "Polygon"
+    assert buildings["height"].iloc[0] == "12"
+
+
+def test_features_from_pbf_columns(pbf_file, polygon):
+    """Test that only the requested tags are read"""
+    buildings = features_from_pbf(pbf_file, polygon, {"building": True}, ["height"])
+    assert list(buildings.columns) == ["height", "geometry"]
+
+
+def test_features_from_pbf_geom_types(pbf_file, polygon):
+    """Test that only the requested geometry types are kept"""
+    tags = {"building": True}
+    buildings = features_from_pbf(
+        pbf_file, polygon, tags, geom_types=["Polygon", "MultiPolygon"]
+    )
+    assert list(buildings.index) == [("way", 7)]
+    with pytest.raises(ox._errors.InsufficientResponseError):
+        features_from_pbf(pbf_file, polygon, tags, geom_types=["Point"])
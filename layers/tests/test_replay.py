@@ -0,0 +1,118 @@
+"""Tests for the record/replay server of Overpass and Nominatim"""
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+import config
+from boundaries import boundaries
+from layers import replay
+
+
+class UpstreamHandler(BaseHTTPRequestHandler):
+    """Stand-in for the real services: echoes the request."""
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def do_GET(self):
+        self.server.hits += 1
+        body = json.dumps({"path": self.path, "hits": self.server.hits}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture(name="upstreams")
+def fixture_upstreams():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), UpstreamHandler)
+    server.hits = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    yield {"overpass": url + "/api", "nominatim": url}, server
+    server.shutdown()
+    server.server_close()
+
+
+def test_record_then_replay(tmp_path, upstreams):
+    """Test that a recorded response is replayed without the real service"""
+    urls, upstream = upstreams
+    with replay.serve(tmp_path, urls, mode="auto") as server:
+        first = requests.get(f"{server.url}/overpass/interpreter?data=a", timeout=5)
+        second = requests.get(f"{server.url}/overpass/interpreter?data=a", timeout=5)
+    assert first.json() == {"path": "/api/interpreter?data=a", "hits": 1}
+    assert second.json() == first.json()
+    assert upstream.hits == 1
+    assert server.stats["recorded"] == 1 and server.stats["hits"] == 1
+
+    with replay.serve(tmp_path, {"overpass": "http://unused"}) as server:
+        response = requests.get(f"{server.url}/overpass/interpreter?data=a", timeout=5)
+    assert response.json() == first.json()
+
+
+def test_replay_miss(tmp_path):
+    """Test that an unknown request is a 404 in replay mode"""
+    with replay.serve(tmp_path, {"nominatim": "http://unused"}) as server:
+        response = requests.get(f"{server.url}/nominatim/search?q=x", timeout=5)
+        unknown = requests.get(f"{server.url}/other/search", timeout=5)
+    assert response.status_code == 404
+    assert unknown.status_code == 404
+    assert server.stats["misses"] == 1
+
+
+def test_key_ignores_parameter_order():
+    a = replay.get_key("nominatim", "GET", "search", "q=x&format=json", b"")
+    b = replay.get_key("nominatim", "GET", "search", "format=json&q=x", b"")
+    c = replay.get_key("nominatim", "GET", "search", "format=json&q=y", b"")
+    assert a == b != c
+    post = replay.get_key("overpass", "POST", "interpreter", "", b"data=a")
+    assert post != replay.get_key("overpass", "POST", "interpreter", "", b"data=b")
+
+
+def test_overpass_status(tmp_path):
+    """Test that the Overpass status has free slots, so that osmnx does not wait"""
+    with replay.serve(tmp_path, {"overpass": "http://unused"}) as server:
+        response = requests.get(f"{server.url}/overpass/status", timeout=5)
+    assert response.ok
+    assert "2 slots available now." in response.text
+    assert server.stats["misses"] == 0
+
+
+def test_injected_errors(tmp_path, upstreams):
+    """Test that the first requests fail with a 429 or 504, then succeed"""
+    urls, _ = upstreams
+    with replay.serve(tmp_path, urls, mode="auto", fail_first=2) as server:
+        codes = [
+            requests.get(f"{server.url}/nominatim/search?q=x", timeout=5).status_code
+            for _ in range(3)
+        ]
+    assert set(codes[:2]) <= {429, 504}
+    assert codes[2] == 200
+    assert server.stats["errors"] == 2
+
+
+def test_latency(tmp_path, upstreams):
+    urls, _ = upstreams
+    with replay.serve(tmp_path, urls, mode="auto", latency=0.2) as server:
+        start = time.perf_counter()
+        requests.get(f"{server.url}/nominatim/search?q=x", timeout=5)
+    assert time.perf_counter() - start >= 0.2
+
+
+def test_make_request_replaying(tmp_path, upstreams):
+    """Test that the boundaries queries go through the replay server"""
+    urls, upstream = upstreams
+    previous_url = config.OVERPASS_URL
+    with replay.replaying(tmp_path, upstreams=urls, mode="auto"):
+        assert config.OVERPASS_URL.endswith("/overpass")
+        data = boundaries.make_request(123, 8)
+    assert data["path"].startswith("/api/interpreter?data=")
+    assert upstream.hits == 1
+    assert config.OVERPASS_URL == previous_url
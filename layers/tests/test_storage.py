@@ -0,0 +1,72 @@
+"""Tests for the storage of the stage outputs"""
+
+import os
+
+import geopandas as gpd
+import pytest
+from shapely.geometry import box
+
+from layers import storage
+
+
+@pytest.fixture(name="gdf")
+def fixture_gdf():
+    return gpd.GeoDataFrame(
+        {"name": ["a", "b", "c"], "height": [3.0, None, 9.5]},
+        geometry=[box(i, i, i + 0.5, i + 0.5) for i in range(3)],
+        crs="epsg:4326",
+    )
+
+
+def test_unknown_format(tmp_path):
+    """Test that unknown formats raise an error"""
+    with pytest.raises(ValueError):
+        storage.get_path(tmp_path, "city - morpho", "shp")
+    with pytest.raises(ValueError):
+        storage.read(tmp_path / "city - morpho.shp")
+
+
+@pytest.mark.parametrize("fmt", ["gpkg", "parquet"])
+def test_round_trip(tmp_path, gdf, fmt):
+    """Test that outputs are read back with the selected columns and rows"""
+    if fmt == "parquet":
+        pytest.importorskip("pyarrow", exc_type=ImportError)
+    path = storage.write(gdf, storage.get_path(tmp_path, "city - Buildings", fmt))
+    # Writing again replaces the file
+    storage.write(gdf, path)
+
+    result = storage.read(path)
+    assert list(result["name"]) == ["a", "b", "c"]
+    assert result.crs == gdf.crs
+
+    result = storage.read(path, columns=["height"], bbox=(0.8, 0.8, 3, 3))
+    assert list(result.columns) == ["height", "geometry"]
+    assert len(result) == 2
+    assert result["height"].iloc[1] == 9.5
+
+
+def test_find_prefers_format(tmp_path):
+    """Test that outputs are found in either format"""
+    assert storage.find(tmp_path, "city - morpho") is None
+    parquet = storage.get_path(tmp_path, "city - morpho", "parquet")
+    parquet.touch()
+    assert storage.find(tmp_path, "city - morpho", "gpkg") == parquet
+
+    gpkg = storage.get_path(tmp_path, "city - morpho", "gpkg")
+    gpkg.touch()
+    assert storage.find(tmp_path, "city - morpho", "gpkg") == gpkg
+    assert storage.find(tmp_path, "city - morpho", "parquet") == parquet
+
+
+def test_glob_most_recent(tmp_path):
+    """Test that the most recent output of every city is used"""
+    for name in ["A - morpho.gpkg", "A - morpho.parquet", "B - morpho.gpkg"]:
+        (tmp_path / name).touch()
+    (tmp_path / "A - Buildings.gpkg").touch()
+    os.utime(tmp_path / "A - morpho.gpkg", (0, 0))
+
+    paths = storage.glob(tmp_path, " - morpho")
+    assert paths == {
+        "A": tmp_path / "A - morpho.parquet",
+        "B": tmp_path / "B - morpho.gpkg",
+    }
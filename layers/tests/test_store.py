@@ -0,0 +1,88 @@
+"""Tests of the store of city_id and admin_level"""
+
+import sqlite3
+import threading
+
+from boundaries import store
+
+
+def test_save_and_get_settings(tmp_path):
+    db = tmp_path / "query_data.sqlite"
+    store.save(db, "Boston", city_id=3602315704)
+    store.save(db, "Boston", admin_level=10)
+    store.save(db, "Lima", city_id=3601944670)
+
+    settings = store.get_settings(db, ["Boston", "Lima", "Quito"])
+    assert settings == {
+        "Boston": (3602315704, 10),
+        "Lima": (3601944670, None),
+        "Quito": (None, None),
+    }
+
+
+def test_store_uses_wal(tmp_path):
+    db = tmp_path / "query_data.sqlite"
+    store.save(db, "Boston", city_id=1)
+    with sqlite3.connect(db) as conn:
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+
+def test_import_csv(tmp_path):
+    db = tmp_path / "query_data.sqlite"
+    csv_file = tmp_path / "old.csv"
+    csv_file.write_text("city,city_id,admin_level\nBoston,1,8\nLima,2,\n")
+    store.save(db, "Boston", city_id=100)
+
+    assert store.import_csv(db, csv_file) == 2
+    # values already in the store are kept
+    assert store.get_settings(db, ["Boston", "Lima"]) == {
+        "Boston": (100, 8),
+        "Lima": (2, None),
+    }
+
+
+def test_csv_imported_on_creation(tmp_path):
+    (tmp_path / "query_data.csv").write_text("city,city_id,admin_level\nLima,2,6\n")
+    db = tmp_path / "query_data.sqlite"
+    assert store.get_settings(db, ["Lima"]) == {"Lima": (2, 6)}
+
+
+def test_prefetch_city_ids(tmp_path, monkeypatch):
+    db = tmp_path / "query_data.sqlite"
+    store.save(db, "Boston", city_id=1)
+    requested = []
+
+    def get_city_id(city, nominatim_url):
+        requested.append(city)
+        if city == "Atlantis":
+            raise ValueError("not found")
+        return 2
+
+    monkeypatch.setattr(store, "get_city_id", get_city_id)
+    city_ids = store.prefetch_city_ids(db, ["Boston", "Lima", "Atlantis"])
+
+    assert sorted(requested) == ["Atlantis", "Lima"]
+    assert city_ids == {"Lima": 2}
+    assert store.get_settings(db, ["Lima", "Atlantis"]) == {
+        "Lima": (2, None),
+        "Atlantis": (None, None),
+    }
+    assert store.prefetch_city_ids(db, ["Boston", "Lima"]) == {}
+
+
+def test_concurrent_writers(tmp_path):
+    db = tmp_path / "query_data.sqlite"
+    store.save(db, "city 0", city_id=0)
+
+    def write(start):
+        for i in range(start, start + 20):
+            store.save(db, f"city {i}", city_id=i, admin_level=i % 11)
+
+    threads = [threading.Thread(target=write, args=(i * 20,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    settings = store.get_settings(db, [f"city {i}" for i in range(80)])
+    assert all(settings[f"city {i}"] == (i, i % 11) for i in range(80))
@@ -0,0 +1,82 @@
+"""Tests for the timings of the stages"""
+
+import geopandas as gpd
+import numpy as np
+import pytest
+from shapely.geometry import box
+
+from layers import telemetry
+from layers.morpho import morpho
+
+
+def test_stage_without_recorder():
+    """Test that stages run without recording anything"""
+    with telemetry.stage("graph"):
+        value = 1
+    assert value == 1
+    telemetry.tag(nodes=3)
+
+
+def test_recording():
+    """Test that stages are recorded with the tags of the recorder"""
+    with telemetry.recording(city="A") as recorder:
+        with telemetry.stage("graph"):
+            pass
+        with telemetry.recording(polygon=np.int64(2)) as polygon_recorder:
+            with telemetry.stage("entropy"):
+                pass
+            telemetry.tag(nodes=10)
+        telemetry.extend(polygon_recorder.get_records())
+
+    records = recorder.get_records()
+    assert [record["stage"] for record in records] == ["graph", "entropy"]
+    assert all(record["city"] == "A" for record in records)
+    assert records[1]["polygon"] == 2 and records[1]["nodes"] == 10
+    assert all(record["seconds"] >= 0 for record in records)
+
+
+def test_summary(tmp_path):
+    """Test that the slowest stages and polygons are ranked"""
+    records = [
+        {"city": "A", "stage": "graph", "seconds": 1.0},
+        {"city": "A", "polygon": 0, "nodes": 5, "stage": "entropy", "seconds": 2.0},
+        {"city": "A", "polygon": 0, "nodes": 5, "stage": "polygon", "seconds": 3.0},
+        {"city": "A", "polygon": 1, "nodes": 9, "stage": "polygon", "seconds": 7.0},
+    ]
+    telemetry.save(telemetry.get_path(tmp_path, "A"), records)
+    stages, polygons = telemetry.summary(tmp_path)
+    assert list(stages.index) == ["polygon", "entropy", "graph"]
+    assert stages.loc["polygon", "count"] == 2
+    assert list(polygons["polygon"]) == [1, 0]
+    assert list(polygons["nodes"]) == [9, 5]
+
+
+def test_save_keeps_file_on_error(tmp_path):
+    """Test that a failed save leaves the previous timings as they were"""
+    path = telemetry.get_path(tmp_path, "A")
+    telemetry.save(path, [{"city": "A", "stage": "graph", "seconds": 1.0}])
+    with pytest.raises(TypeError):
+        telemetry.save(path, [{"city": "A", "stage": "graph", "seconds": object()}])
+    assert telemetry.load(tmp_path)["seconds"].tolist() == [1.0]
+    assert [p.name for p in tmp_path.iterdir()] == [path.name]
+
+
+def test_get_morphometrics_timings(monkeypatch):
+    """Test that every polygon is timed"""
+    gdf = gpd.GeoDataFrame(
+        {"UID": range(3)},
+        geometry=[box(i * 0.01, 0, i * 0.01 + 0.01, 0.01) for i in range(3)],
+        crs="epsg:4326",
+    )
+
+    def fake_polygon(row, **kwargs):
+        with telemetry.stage("entropy"):
+            return {"fractal-dimension": 1.0}
+
+    monkeypatch.setattr(morpho, "_polygon_morphometrics", fake_polygon)
+    with telemetry.recording(city="A") as recorder:
+        morpho.get_morphometrics(gdf, full=False)
+
+    records = recorder.get_records()
+    assert [r["polygon"] for r in records if r["stage"] == "polygon"] == [0, 1, 2]
+    assert sum(r["stage"] == "entropy" for r in records) == 3
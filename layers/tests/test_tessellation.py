@@ -0,0 +1,63 @@
+"""Tests for the tessellation of the buildings in tiles"""
+
+import momepy
+import numpy as np
+import osmnx as ox
+import pytest
+
+from benchmarks import fixtures
+from layers.morpho import tessellation
+
+
+@pytest.fixture(name="buildings", scope="module")
+def fixture_buildings():
+    buildings = fixtures.buildings(6, per_block=1).reset_index(drop=True)
+    buildings = ox.project_gdf(buildings)
+    buildings["uID"] = range(len(buildings))
+    return buildings
+
+
+def assert_same_cells(expected, result):
+    expected = expected.set_index("uID").geometry.sort_index()
+    result = result.set_index("uID").geometry
+    assert list(result.index) == list(expected.index)
+    difference = expected.symmetric_difference(result).area
+    assert (difference / expected.area).max() < 1e-6
+
+
+def test_get_tiles():
+    """Test that dense areas get smaller tiles and every centroid one tile"""
+    rng = np.random.default_rng(0)
+    centroids = np.vstack(
+        [rng.uniform(0, 1000, (100, 2)), rng.uniform(0, 100, (300, 2))]
+    )
+    sizes = np.ones(len(centroids))
+    tiles = tessellation.get_tiles((0, 0, 1000, 1000), centroids, sizes, 150, 50)
+    x, y = centroids[:, 0], centroids[:, 1]
+    owners = [
+        ((x >= x0) & (x < x1) & (y >= y0) & (y < y1)).sum() for x0, y0, x1, y1 in tiles
+    ]
+    assert sum(owners) == len(centroids)
+    widths = {round(x1 - x0) for x0, _, x1, _ in tiles}
+    assert min(widths) < max(widths)
+
+
+def test_chunked_tessellation(buildings, monkeypatch):
+    """Test that the tiles give the same cells as one tessellation"""
+    # a small halo, so that some tiles are tessellated again with a larger one
+    monkeypatch.setattr(tessellation, "HALO", 60.0)
+    limit = momepy.buffered_limit(buildings)
+    expected = tessellation.tessellate(buildings, limit)
+    max_memory = tessellation.estimate_memory(buildings) / 2
+
+    result = tessellation.chunked_tessellation(buildings, limit, max_memory)
+    assert_same_cells(expected, result)
+
+
+def test_chunked_tessellation_fits(buildings, monkeypatch):
+    """Test that buildings within the memory cap are tessellated in one piece"""
+    monkeypatch.setattr(tessellation, "get_tiles", None)
+    limit = momepy.buffered_limit(buildings)
+    max_memory = tessellation.estimate_memory(buildings)
+    result = tessellation.chunked_tessellation(buildings, limit, max_memory)
+    assert len(result) == len(buildings)
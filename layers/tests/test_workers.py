@@ -0,0 +1,66 @@
+"""Tests for the morphometrics of the polygons in worker processes"""
+
+import geopandas as gpd
+import pandas as pd
+import pytest
+from shapely.geometry import box
+
+from benchmarks import fixtures
+from layers.morpho import morpho
+
+VARIABLES = [
+    "fractal-dimension",
+    "avg_street_length",
+    "avg_betweenness_centrality",
+    "avg_building_area",
+]
+
+
+@pytest.fixture(name="city", scope="module")
+def fixture_city():
+    """Get the four quadrants of a synthetic city, its graph and buildings"""
+    size = 8
+    x0, y0, x1, y1 = fixtures.polygon(size).bounds
+    xm, ym = (x0 + x1) / 2, (y0 + y1) / 2
+    quadrants = [
+        box(x0, y0, xm, ym),
+        box(xm, y0, x1, ym),
+        box(x0, ym, xm, y1),
+        box(xm, ym, x1, y1),
+    ]
+    gdf = gpd.GeoDataFrame({"UID": range(4)}, geometry=quadrants, crs="epsg:4326")
+    return gdf, fixtures.grid_graph(size), fixtures.buildings(size, per_block=1)
+
+
+def run(city, workers):
+    gdf, graph, buildings = city
+    return morpho.get_morphometrics(
+        gdf,
+        city_graph=graph,
+        city_buildings=buildings,
+        variables=VARIABLES,
+        workers=workers,
+    )
+
+
+def test_workers_same_as_serial(city):
+    """Test that the polygons give the same values in worker processes"""
+    serial = run(city, workers=1)
+    assert serial[VARIABLES].notna().all().all()
+    pd.testing.assert_frame_equal(run(city, workers=2), serial)
+
+
+def test_failing_polygon(city, monkeypatch):
+    """Test that an error in a polygon leaves only its values missing"""
+    get_polygon_morphometrics = morpho.get_polygon_morphometrics
+
+    def fail_second(row, **kwargs):
+        if row.index[0] == 1:
+            raise RuntimeError("failed")
+        return get_polygon_morphometrics(row, **kwargs)
+
+    # the worker processes are forked, so they see the patch
+    monkeypatch.setattr(morpho, "get_polygon_morphometrics", fail_second)
+    gdf = run(city, workers=2)
+    assert gdf.loc[1, VARIABLES].isna().all()
+    assert gdf.drop(index=1)[VARIABLES].notna().all().all()
@@ -7,6 +7,8 @@ import config
 from boundaries.boundaries import get_boundaries
 from layers import main
 from layers.logger import init_logger
+from layers.morpho.metrics import print_variables
+from layers.telemetry import print_summary
 
 if __name__ == "__main__":
     logger = init_logger(level=config.LOG_LEVEL)
@@ -14,7 +16,19 @@ if __name__ == "__main__":
     logger.info("City list:      %s", ", ".join(config.CITY_LIST))
 
     if len(sys.argv) == 2 and sys.argv[1] == "boundaries":
-        get_boundaries(config.CITY_LIST)
+        get_boundaries(
+            config.CITY_LIST,
+            workers=config.BOUNDARIES_WORKERS,
+            batch_size=config.BOUNDARIES_BATCH_SIZE,
+        )
+        sys.exit(0)
+
+    if len(sys.argv) == 2 and sys.argv[1] == "variables":
+        print_variables()
+        sys.exit(0)
+
+    if len(sys.argv) == 2 and sys.argv[1] == "timings":
+        print_summary(config.MORPHOMETRICS_DIR)
         sys.exit(0)
 
     logger.info("Parameters:")
@@ -22,7 +36,15 @@ if __name__ == "__main__":
     logger.info(" Buildings:     %s", config.BUILDINGS)
     logger.info(" Morphometrics: %s", config.MORPHOMETRICS)
     logger.info(" Full vars:     %s", config.FULL_VARIABLES)
+    logger.info(" Variables:     %s", ", ".join(config.VARIABLES or ["all"]))
     logger.info(" CSV out:       %s", config.CSV_OUT)
+    logger.info(" Output format: %s", config.OUTPUT_FORMAT)
+    logger.info(" Workers:       %s", config.WORKERS)
+    logger.info(" City graph:    %s", config.CITY_GRAPH)
+    logger.info(" City bldgs:    %s", config.CITY_BUILDINGS)
+    logger.info(" Centrality:    %s", config.CENTRALITY_SAMPLES or "exact")
+    logger.info(" Checkpoints:   %s", config.CHECKPOINTS)
+    logger.info(" Timings:       %s", config.TIMINGS)
     logger.info(" Log level:     %s", config.LOG_LEVEL)
 
     main(
@@ -32,4 +54,19 @@ if __name__ == "__main__":
         morphometrics=config.MORPHOMETRICS,
         full=config.FULL_VARIABLES,
         csv_out=config.CSV_OUT,
+        workers=config.WORKERS,
+        city_graph=config.CITY_GRAPH,
+        city_buildings=config.CITY_BUILDINGS,
+        partition=config.BUILDINGS_PARTITION,
+        centrality_samples=config.CENTRALITY_SAMPLES,
+        centrality_seed=config.CENTRALITY_SEED,
+        diameter_max_bfs=config.DIAMETER_MAX_BFS,
+        connectivity_budget=config.CONNECTIVITY_TIME_BUDGET,
+        fractal_resolution=config.FRACTAL_RESOLUTION,
+        tessellation_memory=config.TESSELLATION_MAX_MEMORY,
+        tessellation_workers=config.TESSELLATION_WORKERS,
+        checkpoints=config.CHECKPOINTS,
+        variables=config.VARIABLES,
+        output_format=config.OUTPUT_FORMAT,
+        timings=config.TIMINGS,
     )